@@ -1,9 +1,11 @@
 from fastapi import APIRouter
 from src.api.routes.graph_text_input import router as graph_input_router
 from src.api.routes.graph_audio_input import router as graph_audio_router
+from src.api.routes.diagram_history import router as diagram_history_router
+from src.api.routes.metrics import router as metrics_router
 
 router = APIRouter()
-routers = [graph_audio_router, graph_input_router]
+routers = [graph_audio_router, graph_input_router, diagram_history_router, metrics_router]
 
 for route in routers:
     router.include_router(router=route)
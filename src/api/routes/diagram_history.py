@@ -0,0 +1,72 @@
+from typing import Callable, Dict
+
+from fastapi import APIRouter, HTTPException
+
+from src.models.schemas.graphs_output import DiagramHistoryOutput, DiagramVersionOutput
+from src.utilities.llm_module.diagram_history import DiagramHistory, HistoryError
+from src.utilities.llm_module.src.markup_to_x6 import render_diagram
+from src.utilities.llm_module.states import GenerationState
+from src.utilities.services.session_store import get_session_store
+
+router = APIRouter(prefix="/diagram", tags=["diagram"])
+
+
+def _load(session_id: str) -> GenerationState:
+    state = get_session_store().get(session_id)
+    if not state:
+        raise HTTPException(status_code=404, detail="Чат не найден")
+    return state
+
+
+def _move(session_id: str, move: Callable[[DiagramHistory], int], status_code: int) -> DiagramVersionOutput:
+    """
+    Переход по истории диаграмм чата; прежние узлы сохраняют позиции, клиенту уходит diff холста
+    """
+
+    store = get_session_store()
+    # под тем же локом, что и генерация: иначе undo и параллельная правка затрут друг друга
+    with store.lock(session_id):
+        state = _load(session_id)
+        try:
+            version = move(state["bpmn"])
+        except HistoryError as e:
+            raise HTTPException(status_code=status_code, detail=str(e))
+        output, diff = render_diagram(state, state["bpmn"].view(), incremental=True)
+        store.set(session_id, state)
+    return DiagramVersionOutput(output=output, session_id=session_id, diff=diff, version=version)
+
+
+@router.get("/{session_id}/history", summary="История диаграмм чата", response_model=DiagramHistoryOutput)
+def get_history(session_id: str) -> DiagramHistoryOutput:
+    history = _load(session_id)["bpmn"]
+    return DiagramHistoryOutput(session_id=session_id, head=history.head, versions=len(history))
+
+
+@router.post("/{session_id}/undo", summary="Отменить последнюю правку", response_model=DiagramVersionOutput)
+def undo(session_id: str) -> DiagramVersionOutput:
+    return _move(session_id, lambda history: history.undo(), status_code=409)
+
+
+@router.post("/{session_id}/redo", summary="Вернуть отмененную правку", response_model=DiagramVersionOutput)
+def redo(session_id: str) -> DiagramVersionOutput:
+    return _move(session_id, lambda history: history.redo(), status_code=409)
+
+
+@router.post("/{session_id}/checkout/{version}", summary="Перейти к версии диаграммы",
+             response_model=DiagramVersionOutput)
+def checkout(session_id: str, version: int) -> DiagramVersionOutput:
+    return _move(session_id, lambda history: history.checkout(version), status_code=404)
+
+
+@router.get("/{session_id}/diff", summary="Изменения между версиями диаграммы")
+def diff(session_id: str, old: int, new: int) -> Dict[str, list]:
+    """
+    :param old: Номер исходной версии
+    :param new: Номер конечной версии
+    :return: added/removed/changed узлы и added/removed ребра
+    """
+
+    try:
+        return _load(session_id)["bpmn"].diff(old, new)
+    except HistoryError as e:
+        raise HTTPException(status_code=404, detail=str(e))
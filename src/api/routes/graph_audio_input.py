@@ -1,40 +1,342 @@
-import decouple
+import asyncio
+import hashlib
+import json
 import os
+from typing import AsyncIterator, BinaryIO, Callable, List, Optional, Tuple
 
-from fastapi import APIRouter, File, HTTPException, UploadFile
+import numpy as np
+from fastapi import APIRouter, File, Form, HTTPException, Request, Response, UploadFile, WebSocket
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
 
-router = APIRouter(prefix="/user_input", tags=["user_input"])
+from src.api.routes.graph_text_input import generate_output, llm_backend, saturated_error, sse_event
+from src.config.manager import settings
+from src.models.schemas.graphs_output import VoiceJobOutput
+from src.utilities.debug.logger import setup_logger
+from src.utilities.services.audio_service import SAMPLE_RATE, VoiceActivityDetector, resample, to_float32
+from src.utilities.services.generation_executor import (ExecutorSaturatedError, get_generation_executor,
+                                                         get_transcription_executor)
+from src.utilities.services.session_store import new_session_id
+from src.utilities.services.transcription import TranscriptionService, get_transcript_cache, transcript_key
+from src.utilities.services.upload_store import get_upload_store
+from src.utilities.services.voice_jobs import VoiceJob, get_voice_jobs
 
-UPLOAD_DIR = decouple.config(
-    "UPLOAD_AUDIO_DIR", cast=str)
+logger = setup_logger("VoiceInput")
 
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+ALLOWED_EXTENSIONS = {".wav", ".mp3", ".m4a"}
+# запас на multipart-обертку файла: заголовки частей и поля формы
+FORM_OVERHEAD_BYTES = 64 * 1024
 
 
-@router.post("/voice")
-async def upload_voice_message(file: UploadFile = File(...)):
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Файл больше {settings.UPLOAD_MAX_BYTES / (1024 * 1024):g} МБ")
+
+
+class UploadLimitRoute(APIRoute):
+    """
+    Размер тела ограничивается до разбора формы: Starlette сохраняет UploadFile целиком еще до вызова
+    обработчика, и проверка в нем срабатывала бы только после приема всего тела.
+    Content-Length сверх лимита - сразу 413; без Content-Length (chunked) тело считается по мере
+    приема, и 413 уходит, как только лимит превышен, остаток тела не читается
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def limited_handler(request: Request) -> Response:
+            limit = settings.UPLOAD_MAX_BYTES + FORM_OVERHEAD_BYTES
+            length = request.headers.get("content-length", "")
+            if length.isdigit() and int(length) > limit:
+                raise _too_large()
+            receive, received = request.receive, 0
+
+            async def limited_receive():
+                nonlocal received
+                message = await receive()
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise _too_large()
+                return message
+
+            return await handler(Request(request.scope, limited_receive))
+
+        return limited_handler
+
+
+router = APIRouter(prefix="/user_input", tags=["user_input"], route_class=UploadLimitRoute)
+
+
+def _write_chunk(buffer: BinaryIO, digest, chunk: bytes) -> None:
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+async def _save_upload(file: UploadFile, extension: str) -> Tuple[str, str]:
+    """
+    Файл переносится в каталог загрузок частями UPLOAD_CHUNK_SIZE, в памяти целиком не держится, sha256
+    считается по тем же частям. Дописанный файл сохраняется под своим хешем (см. UploadStore).
+    Тело запроса уже ограничено в UploadLimitRoute, здесь - точный размер самого файла:
+    сверх UPLOAD_MAX_BYTES - 413, недописанный файл удаляется
+    :return: путь к файлу и sha256 содержимого
+    """
+
+    store = get_upload_store()
+    partial_path = store.partial_path()
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(partial_path, "wb") as buffer:
+            while chunk := await file.read(settings.UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > settings.UPLOAD_MAX_BYTES:
+                    raise _too_large()
+                await run_in_threadpool(_write_chunk, buffer, digest, chunk)
+        file_path = await run_in_threadpool(store.commit, partial_path, digest.hexdigest(), extension)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    return file_path, digest.hexdigest()
+
+
+def transcribe_job(job: VoiceJob) -> None:
+    """
+    Стадия транскрипции в пуле транскрипции: сегменты публикуются по мере декодирования,
+    затем задача передается в пул генерации (или заканчивается, если нужен только текст)
+    """
+
+    try:
+        job.publish("status", {"status": "transcribing"})
+        segments = []
+        for segment in TranscriptionService().iter_segments(job.audio_file):
+            segments.append(segment)
+            job.publish("segment", segment)
+        if job.audio_hash and job.transcript:
+            get_transcript_cache().set(transcript_key(job.audio_hash), json.dumps(segments, ensure_ascii=False))
+        finish_transcription(job)
+    except ExecutorSaturatedError:
+        job.publish("error", {"detail": "Сервер перегружен, повторите запрос позже"})
+    except Exception as e:
+        logger.exception(f"Voice job {job.id} failed: {e}")
+        job.publish("error", {"detail": str(e)})
+
+
+def finish_transcription(job: VoiceJob) -> None:
+    """
+    Транскрипт готов (распознан или взят из кеша): результат или передача в пул генерации
+    (задача без session_id - только транскрипция)
+    """
+
+    if not job.transcript:
+        raise ValueError("В записи не удалось распознать речь")
+    if job.session_id is None:
+        job.publish("result", {"transcript": job.transcript})
+        return
+    job.publish("status", {"status": "generating", "transcript": job.transcript})
+    get_generation_executor().submit_threadsafe(generate_job, job)
+
+
+def replay_transcript(job: VoiceJob, segments: List[dict]) -> None:
+    """
+    Транскрипт из кеша публикуется как распознанный, без очереди транскрипции
+    """
+
+    for segment in segments:
+        job.publish("segment", segment)
+    finish_transcription(job)
+
+
+def generate_job(job: VoiceJob) -> None:
+    """
+    Стадия генерации: распознанный текст уходит в тот же путь генерации с сессией, что и /text.
+    Бэкенд определяется здесь, в потоке генерации: локальная модель может грузиться при первом запросе
+    """
+
+    try:
+        output = generate_output(job.transcript, session_id=job.session_id, on_event=job.publish, **llm_backend())
+        job.publish("result", output.model_dump())
+    except Exception as e:
+        logger.exception(f"Voice job {job.id} failed: {e}")
+        job.publish("error", {"detail": str(e)})
+
+
+def _job_output(job: VoiceJob) -> VoiceJobOutput:
+    return VoiceJobOutput(job_id=job.id, session_id=job.session_id, status=job.status, transcript=job.transcript,
+                          result=job.result if job.session_id else None, error=job.error)
+
+
+def _get_job(job_id: str) -> VoiceJob:
+    job = get_voice_jobs().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+
+@router.post("/voice", summary="Голосовой запрос", response_model=VoiceJobOutput, status_code=202)
+async def upload_voice_message(file: UploadFile = File(...),
+                               session_id: Optional[str] = Form(None),
+                               generate: bool = Form(True)) -> VoiceJobOutput:
+    """
+    :param file: Запись запроса (.wav, .mp3, .m4a)
+    :param session_id: Идентификатор чата, если не передан - создается новый чат
+    :param generate: False - только транскрипция, текст в transcript задачи
+    :return: Задача, прогресс которой отдается через GET /user_input/voice/{job_id}/events.
+    Повторная загрузка того же файла берет транскрипт из кеша, без очереди транскрипции
+    """
 
-    allowed_extensions = {".wav", ".mp3", ".m4a"}
     file_extension = os.path.splitext(file.filename)[1].lower()
 
-    if file_extension not in allowed_extensions:
+    if file_extension not in ALLOWED_EXTENSIONS:
         raise HTTPException(
             status_code=400,
             detail="Недопустимый формат файла. Поддерживаются: .wav, .mp3, .m4a"
         )
 
     try:
-        file_name = f"{file.filename.split('.')[0]}_{os.urandom(8).hex()}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, file_name)
-
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-
-        return
-
+        file_path, audio_hash = await _save_upload(file, file_extension)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Ошибка при загрузке файла: {str(e)}"
         )
+
+    jobs = get_voice_jobs()
+    # задача и ее события пишутся в общее для воркеров хранилище (SQLite) - не в event loop
+    job = await run_in_threadpool(jobs.create, (session_id or new_session_id()) if generate else None,
+                                  file_path, audio_hash)
+    cached = await run_in_threadpool(get_transcript_cache().get, transcript_key(audio_hash))
+    try:
+        if cached is None:
+            get_transcription_executor().submit_threadsafe(transcribe_job, job)
+        else:
+            await run_in_threadpool(replay_transcript, job, json.loads(cached))
+    except ExecutorSaturatedError:
+        await run_in_threadpool(job.publish, "error", {"detail": "Сервер перегружен"})
+        raise saturated_error()
+    finally:
+        await run_in_threadpool(get_upload_store().maybe_collect, jobs.active_files)
+    return _job_output(job)
+
+
+@router.get("/voice/{job_id}", summary="Статус голосового запроса", response_model=VoiceJobOutput)
+def get_voice_job(job_id: str) -> VoiceJobOutput:
+    return _job_output(_get_job(job_id))
+
+
+@router.get("/voice/{job_id}/events", summary="Прогресс голосового запроса")
+async def stream_voice_job(job_id: str) -> StreamingResponse:
+    """
+    Server-Sent Events:
+    * status - {"status": ...} - этап задачи (transcribing, generating)
+    * segment - {"start", "end", "text"} - распознанный сегмент записи
+    * node, token - прогресс генерации, как в /text/stream
+    * result - GenerationOutput ({"transcript"} при generate=False), последнее событие при успехе
+    * error - {"detail": ...}, последнее событие при ошибке
+    """
+
+    job = await run_in_threadpool(_get_job, job_id)
+
+    async def events() -> AsyncIterator[str]:
+        async for event, data in get_voice_jobs().events(job):
+            yield sse_event(event, data)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.websocket("/voice/stream")
+async def stream_microphone(websocket: WebSocket, sample_rate: int = SAMPLE_RATE, beam_size: int = 5) -> None:
+    """
+    Поток с микрофона браузера. Клиент шлет бинарные сообщения - PCM int16 little-endian моно
+    с частотой sample_rate, и текстовое {"type": "end"} в конце записи.
+    Сервер режет поток на фразы по тишине (VoiceActivityDetector) и сразу отдает каждую фразу
+    в пул транскрипции, пока пользователь продолжает говорить. Ответы (JSON, фразы - по порядку):
+    * {"type": "speech", "utterance": i} - началась фраза
+    * {"type": "utterance", "utterance": i, "text": ...} - фраза распознана
+    * {"type": "error", "utterance": i, "detail": ...} - фразу распознать не удалось
+    * {"type": "error", "detail": ...} - текстовое сообщение не JSON, соединение закрывается с кодом 1003
+    * {"type": "transcript", "text": ...} - весь текст после end, затем соединение закрывается
+    """
+
+    await websocket.accept()
+    if not 8000 <= sample_rate <= 96000:
+        await websocket.close(code=1003, reason="sample_rate должен быть от 8000 до 96000")
+        return
+
+    detector = VoiceActivityDetector(sample_rate=sample_rate)
+    service = TranscriptionService()
+    # фразы в порядке нарезки: (номер, future транскрипции), None - конец потока
+    pending: asyncio.Queue = asyncio.Queue()
+    texts: List[str] = []
+    utterances = 0
+
+    def submit(utterance: np.ndarray) -> None:
+        nonlocal utterances
+        try:
+            future = get_transcription_executor().submit(service.transcribe, resample(utterance, sample_rate),
+                                                         beam_size)
+        except ExecutorSaturatedError as e:
+            future = asyncio.get_running_loop().create_future()
+            future.set_exception(e)
+        pending.put_nowait((utterances, future))
+        utterances += 1
+
+    async def send_results() -> None:
+        while (item := await pending.get()) is not None:
+            index, future = item
+            try:
+                text = (await future).strip()
+            except ExecutorSaturatedError:
+                await websocket.send_json({"type": "error", "utterance": index,
+                                           "detail": "Сервер перегружен, фраза пропущена"})
+                continue
+            except Exception as e:
+                logger.exception(f"Utterance {index} transcription failed: {e}")
+                await websocket.send_json({"type": "error", "utterance": index, "detail": str(e)})
+                continue
+            if text:
+                texts.append(text)
+            await websocket.send_json({"type": "utterance", "utterance": index, "text": text})
+
+    sender = asyncio.create_task(send_results())
+    # сэмпл int16 может разойтись по двум сообщениям: нечетный байт ждет следующего
+    remainder = b""
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                pcm = remainder + message["bytes"]
+                usable = len(pcm) - len(pcm) % 2
+                remainder = pcm[usable:]
+                was_speaking = detector.in_speech
+                cut = detector.feed(to_float32(pcm[:usable]))
+                if not was_speaking and (cut or detector.in_speech):
+                    await websocket.send_json({"type": "speech", "utterance": utterances})
+                for utterance in cut:
+                    submit(utterance)
+            elif message.get("text"):
+                try:
+                    control = json.loads(message["text"])
+                except ValueError:
+                    control = None
+                if not isinstance(control, dict):
+                    await websocket.send_json({"type": "error", "detail": "Текстовое сообщение должно быть JSON"})
+                    await websocket.close(code=1003, reason="Текстовое сообщение должно быть JSON")
+                    return
+                if control.get("type") == "end":
+                    break
+
+        for utterance in detector.flush():
+            submit(utterance)
+        pending.put_nowait(None)
+        await sender
+        await websocket.send_json({"type": "transcript", "text": " ".join(texts)})
+        await websocket.close()
+    finally:
+        # при обрыве соединения уже отправленные фразы дораспознаются в пуле, но никуда не уходят
+        sender.cancel()
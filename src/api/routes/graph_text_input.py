@@ -1,48 +1,69 @@
-from fastapi import APIRouter
-from src.utilities.llm_module.src.markup_to_x6 import x6_layout
-from src.utilities.llm_module.graphs import GenerationGraph
+import asyncio
+import json
+from typing import AsyncIterator, Dict, Optional
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from src.utilities.llm_module.src.markup_to_x6 import render_diagram
+from src.utilities.llm_module.graphs import EventCallback, get_generation_graph
 from src.utilities.llm_module.states import generation
 from src.models.schemas.graphs_output import GenerationInput, GenerationOutput
-from awq import AutoAWQForCausalLM
-from transformers import AutoTokenizer
+from src.utilities.services.session_store import get_session_store, new_session_id
+from src.utilities.services.generation_executor import ExecutorSaturatedError, get_generation_executor
+from src.utilities.services.model_registry import get_local_model_cfg
+from src.utilities.llm_module.llm_constants import LLM_MODE
+from src.utilities.debug.logger import setup_logger
 
 
 router = APIRouter(prefix="/user_input", tags=["user_input"])
 
-model_path = "solidrust/Nous-Hermes-2-Mistral-7B-DPO-AWQ"
+logger = setup_logger("TextInput")
 
-model = AutoAWQForCausalLM.from_quantized(model_path, fuse_layers=True)
-tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
 
-
-# только для MVP, потом заменить на бд
-STATE = None
-MODE = "local"
-LOCAL_MODEL_CFG = {
-    "model": model,
-    "tokenizer": tokenizer,
-}
+def llm_backend() -> dict:
+    """
+    Режим LLM из LLM_MODE, локальная модель грузится лениво при первом запросе
+    (внутри потока генерации, а не при импорте в каждом воркере)
+    """
+    if LLM_MODE == "local":
+        return {"mode": "local", "local_model_cfg": get_local_model_cfg()}
+    return {"mode": "api"}
 
 
-def generate_output(input_data: str, mode: str, local_model_cfg=None) -> GenerationOutput:
+def generate_output(input_data: str, mode: str, local_model_cfg=None,
+                    session_id: str = None, on_event: Optional[EventCallback] = None) -> GenerationOutput:
     """
     :param input_data: Входные параметры для генерации диаграммы
-    :param process_query: Базовый промпт работы модели
+    :param mode: Режим работы модели (local | api)
+    :param session_id: Идентификатор чата, если не передан - создается новый чат
+    :param on_event: Колбэк событий прогресса графа (ноды и токены), см. GenerationGraph.__call__
     :return: BPMN диаграмма и дополнительная информация о процессе
     """
-    global STATE
-    if not STATE:
-        STATE = generation(input_data)
-    else:
-        STATE["user_input"].append(input_data)
+    store = get_session_store()
+    known_session = session_id is not None
+    session_id = session_id or new_session_id()
+    # запросы одной сессии идут по очереди, иначе правка одного потеряется при записи другого
+    with store.lock(session_id):
+        state = store.get(session_id)
+        if not state:
+            if known_session:
+                logger.warning(f"Session {session_id} not found (expired or evicted), starting a new chat")
+            state = generation(input_data)
+        else:
+            state["user_input"].append(input_data)
 
-    graph = GenerationGraph(mode=mode, local_model_cfg=local_model_cfg)
-    STATE = graph(STATE)
-    last = STATE["last"][-1][1]
-    output = STATE["agents_result"][last][-1]["content"]
-    if last in ["x6processor", "editor"]:
-        output = x6_layout(output)
-    return GenerationOutput(output=output)
+        graph = get_generation_graph(mode=mode, local_model_cfg=local_model_cfg)
+        state = graph(state, on_event=on_event)
+        last = state["last"][-1][1]
+        result = state["agents_result"][last][-1]
+        diff = None
+        if last in ["x6processor", "editor"]:
+            # после правки редактора позиции прежних узлов сохраняются, клиенту уходит и diff
+            output, diff = render_diagram(state, state["bpmn"].view(result["version"]),
+                                          incremental=last == "editor")
+        else:
+            output = result["content"]
+        store.set(session_id, state)
+    return GenerationOutput(output=output, session_id=session_id, diff=diff)
 
 
 @router.post("/text", summary="Получить граф", response_model=GenerationOutput)
@@ -52,4 +73,65 @@ async def get_json_graph(user: GenerationInput) -> GenerationOutput:
     :return: BPMN диаграмма и дополнительная информация о процессе
     """
 
-    return generate_output(user.user_input, 'api')
+    try:
+        return await get_generation_executor().run(
+            lambda: generate_output(user.user_input, session_id=user.session_id, **llm_backend()))
+    except ExecutorSaturatedError:
+        raise saturated_error()
+
+
+def saturated_error() -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Сервер перегружен, повторите запрос позже",
+        headers={"Retry-After": "1"}
+    )
+
+
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/text/stream", summary="Получить граф в режиме стриминга")
+async def stream_json_graph(user: GenerationInput) -> StreamingResponse:
+    """
+    Server-Sent Events:
+    * node - {"node": ..., "status": "start" | "end"} - какая нода графа работает
+    * token - {"node": ..., "text": ...} - инкрементальные токены агента
+    * result - GenerationOutput, последнее событие при успехе
+    * error - {"detail": ...}, последнее событие при ошибке
+    """
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    session_id = user.session_id or new_session_id()
+
+    def on_event(event: str, data: Dict):
+        # вызывается из потока генерации
+        loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+
+    try:
+        task = get_generation_executor().submit(
+            lambda: generate_output(user.user_input, session_id=session_id, on_event=on_event, **llm_backend()))
+    except ExecutorSaturatedError:
+        raise saturated_error()
+
+    async def events() -> AsyncIterator[str]:
+        while True:
+            get = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({get, task}, return_when=asyncio.FIRST_COMPLETED)
+            if get in done:
+                yield sse_event(*get.result())
+                continue
+            get.cancel()
+            # результат задачи приходит в loop после всех ее событий, дочитываем очередь
+            while not queue.empty():
+                yield sse_event(*queue.get_nowait())
+            if task.exception():
+                yield sse_event("error", {"detail": str(task.exception())})
+            else:
+                yield sse_event("result", task.result().model_dump())
+            return
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,31 @@
+from typing import Dict
+
+from fastapi import APIRouter
+
+from src.utilities.llm_module.preclassifier import get_preclassifier
+from src.utilities.llm_module.response_cache import get_response_cache
+from src.utilities.services.generation_executor import get_generation_executor, get_transcription_executor
+from src.utilities.services.model_registry import loaded_whisper_models
+from src.utilities.services.transcription import get_transcript_cache
+from src.utilities.services.upload_store import get_upload_store
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", summary="Метрики сервиса")
+def get_metrics() -> Dict[str, Dict]:
+    """
+    :return: статистика кеша ответов агентов, маршруты пре-классификатора verifier, загрузка пулов
+    генерации и транскрипции, загруженные модели Whisper, кеш транскриптов и каталог загрузок
+    """
+
+    cache = get_response_cache()
+    classifier = get_preclassifier()
+    return {
+        "response_cache": cache.stats() if cache else {"enabled": False},
+        "verifier_routing": classifier.stats() if classifier else {"enabled": False},
+        "generation": get_generation_executor().stats(),
+        "transcription": dict(get_transcription_executor().stats(), whisper_models=loaded_whisper_models()),
+        "transcript_cache": get_transcript_cache().stats(),
+        "uploads": get_upload_store().stats(),
+    }
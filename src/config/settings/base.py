@@ -37,6 +37,38 @@ class BackendBaseSettings(BaseSettings):
     ALLOWED_METHODS: list[str] = ["*"]
     ALLOWED_HEADERS: list[str] = ["*"]
 
+    # у каждого воркера своя память, поэтому при нескольких воркерах сессии хранятся в SQLite
+    SESSION_STORE_BACKEND: str = decouple.config(
+        "SESSION_STORE_BACKEND", default="sqlite" if SERVER_WORKERS > 1 else "memory", cast=str)
+    SESSION_TTL_SECONDS: int = decouple.config(
+        "SESSION_TTL_SECONDS", default=3600, cast=int)
+    SESSION_MAX_SIZE: int = decouple.config(
+        "SESSION_MAX_SIZE", default=1024, cast=int)
+    SESSION_DB_PATH: str = decouple.config(
+        "SESSION_DB_PATH", default="data/sessions.sqlite3", cast=str)
+
+    GENERATION_MAX_IN_FLIGHT: int = decouple.config(
+        "GENERATION_MAX_IN_FLIGHT", default=2, cast=int)
+    GENERATION_MAX_QUEUE: int = decouple.config(
+        "GENERATION_MAX_QUEUE", default=8, cast=int)
+    TRANSCRIPTION_MAX_QUEUE: int = decouple.config(
+        "TRANSCRIPTION_MAX_QUEUE", default=16, cast=int)
+
+    UPLOAD_AUDIO_DIR: str = decouple.config(
+        "UPLOAD_AUDIO_DIR", default="data/audio/", cast=str)
+    UPLOAD_MAX_BYTES: int = decouple.config(
+        "UPLOAD_MAX_BYTES", default=25 * 1024 * 1024, cast=int)
+    UPLOAD_CHUNK_SIZE: int = decouple.config(
+        "UPLOAD_CHUNK_SIZE", default=1024 * 1024, cast=int)
+    VOICE_JOB_TTL_SECONDS: int = decouple.config(
+        "VOICE_JOB_TTL_SECONDS", default=3600, cast=int)
+    UPLOAD_MAX_AGE_SECONDS: int = decouple.config(
+        "UPLOAD_MAX_AGE_SECONDS", default=7 * 24 * 3600, cast=int)
+    UPLOAD_DIR_QUOTA_BYTES: int = decouple.config(
+        "UPLOAD_DIR_QUOTA_BYTES", default=2 * 1024 * 1024 * 1024, cast=int)
+    UPLOAD_GC_INTERVAL_SECONDS: int = decouple.config(
+        "UPLOAD_GC_INTERVAL_SECONDS", default=600, cast=int)
+
     LOGGING_LEVEL: int = logging.INFO
     LOGGERS: tuple[str, str] = ("uvicorn.asgi", "uvicorn.access")
 
@@ -45,6 +77,17 @@ class BackendBaseSettings(BaseSettings):
         env_file: str = f"{str(ROOT_DIR)}/.env"
         validate_assignment: bool = True
 
+    @pydantic.model_validator(mode="after")
+    def check_session_store_backend(self) -> "BackendBaseSettings":
+        """
+        Сессии и голосовые задачи в памяти одного воркера не видны другим: запрос чата,
+        попавший в другой воркер, молча начал бы диалог заново. Такой конфиг не запускается
+        """
+        if self.SESSION_STORE_BACKEND == "memory" and self.SERVER_WORKERS > 1:
+            raise ValueError("SESSION_STORE_BACKEND=memory is per process, "
+                             "use SESSION_STORE_BACKEND=sqlite with BACKEND_SERVER_WORKERS > 1")
+        return self
+
     @property
     def set_backend_app_attributes(self) -> dict[str, str | bool | None]:
         """
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Dict, Any, Union, List
+from typing import Dict, Any, Union, List, Optional
 
 
 class GenerationInput(BaseModel):
@@ -8,12 +8,17 @@ class GenerationInput(BaseModel):
 
     Attributes:
         user_input: Основной текст запроса для генерации диаграммы
+        session_id: Идентификатор чата, пустой для нового чата
     """
 
     user_input: str = Field(
         ...,
         example="Создать диаграмму для процесса найма сотрудников"
     )
+    session_id: Optional[str] = Field(
+        None,
+        example="5f0c4d1e9a7b4c2f8e3d6a1b0c9f8e7d"
+    )
 
 
 class GenerationOutput(BaseModel):
@@ -22,9 +27,69 @@ class GenerationOutput(BaseModel):
 
     Attributes:
         output: Последнее из сообщений агентов (возможно, невалидное сообщение, если не удалось сгенерировать диаграмму)
+        session_id: Идентификатор чата, который нужно передавать в следующих запросах
+        diff: Правка холста относительно прошлой диаграммы чата (added/moved/removed), только после редактора
     """
 
     output: Union[List[Dict], str] = Field(
         ...,
         example="Последнее из сообщений агентов (возможно, невалидное сообщение, если не удалось сгенерировать диаграмму)"
     )
+    session_id: Optional[str] = Field(
+        None,
+        example="5f0c4d1e9a7b4c2f8e3d6a1b0c9f8e7d"
+    )
+    diff: Optional[Dict[str, List[Any]]] = Field(
+        None,
+        example={"added": [], "moved": [], "removed": ["4", "2->4"]}
+    )
+
+
+class DiagramVersionOutput(GenerationOutput):
+    """
+    Диаграмма чата после undo/redo/checkout
+
+    Attributes:
+        version: Номер текущей версии диаграммы в истории чата
+    """
+
+    version: int = Field(
+        ...,
+        example=3
+    )
+
+
+class DiagramHistoryOutput(BaseModel):
+    """
+    Состояние истории диаграмм чата
+
+    Attributes:
+        session_id: Идентификатор чата
+        head: Номер текущей версии
+        versions: Количество версий (версия 0 - пустая диаграмма)
+    """
+
+    session_id: str
+    head: int = Field(..., example=3)
+    versions: int = Field(..., example=5)
+
+
+class VoiceJobOutput(BaseModel):
+    """
+    Задача голосового запроса: загрузка -> транскрипция -> генерация
+
+    Attributes:
+        job_id: Идентификатор задачи (статус - GET /user_input/voice/{job_id}, прогресс - .../events)
+        session_id: Идентификатор чата, в который уходит распознанный запрос (пустой, если только транскрипция)
+        status: queued | transcribing | generating | done | error
+        transcript: Распознанный на данный момент текст
+        result: Ответ генерации, когда задача закончена
+        error: Причина ошибки
+    """
+
+    job_id: str = Field(..., example="9b1d2c3e4f5a6b7c8d9e0f1a2b3c4d5e")
+    session_id: Optional[str] = Field(None, example="5f0c4d1e9a7b4c2f8e3d6a1b0c9f8e7d")
+    status: str = Field(..., example="transcribing")
+    transcript: str = Field("", example="Сделай диаграмму процесса найма")
+    result: Optional[GenerationOutput] = None
+    error: Optional[str] = None
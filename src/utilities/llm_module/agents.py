@@ -1,7 +1,9 @@
 from src.utilities.llm_module.base_agent import BaseAgent
 from src.utilities.llm_module.call_functions import mistral_call
 from src.utilities.llm_module.llm_constants import PROMPTS
-from typing import List, Optional, Dict
+from src.utilities.llm_module.context_log import ContextLog
+from typing import Callable, Optional, Dict
+import json
 import logging
 
 logger = logging.getLogger("Mistral")
@@ -14,22 +16,50 @@ if not logger.handlers:
     logger.addHandler(ch)
 
 class Verifier(BaseAgent):
+    cacheable = True
+
     def __init__(self, system_prompt: str = PROMPTS["verification"], llm_call: callable = mistral_call,
-                 context: Optional[List[dict]] = None, local_model_cfg: Optional[Dict] = None):
-        super().__init__(system_prompt, llm_call, context, local_model_cfg)
+                 context: Optional[ContextLog] = None, local_model_cfg: Optional[Dict] = None,
+                 on_token: Optional[Callable[[str], None]] = None):
+        super().__init__(system_prompt, llm_call, context, local_model_cfg, on_token)
 
 class Clarifier(BaseAgent):
+    cacheable = True
+
     def __init__(self, system_prompt: str = PROMPTS["clarification"], llm_call: callable = mistral_call,
-                 context: Optional[List[dict]] = None, local_model_cfg: Optional[Dict] = None):
-        super().__init__(system_prompt, llm_call, context,local_model_cfg)
+                 context: Optional[ContextLog] = None, local_model_cfg: Optional[Dict] = None,
+                 on_token: Optional[Callable[[str], None]] = None):
+        super().__init__(system_prompt, llm_call, context, local_model_cfg, on_token)
 
 class X6Processor(BaseAgent):
     def __init__(self, system_prompt: str = PROMPTS["x6processing"], llm_call: callable = mistral_call,
-                 context: Optional[List[dict]] = None, local_model_cfg: Optional[Dict] = None):
-        super().__init__(system_prompt, llm_call, context, local_model_cfg)
+                 context: Optional[ContextLog] = None, local_model_cfg: Optional[Dict] = None,
+                 on_token: Optional[Callable[[str], None]] = None):
+        super().__init__(system_prompt, llm_call, context, local_model_cfg, on_token)
 
 
 class Editor(BaseAgent):
     def __init__(self, system_prompt: str = PROMPTS["editing"], llm_call: callable = mistral_call,
-                 context: Optional[List[dict]] = None, local_model_cfg: Optional[Dict] = None):
-        super().__init__(system_prompt, llm_call, context,local_model_cfg)
\ No newline at end of file
+                 context: Optional[ContextLog] = None, local_model_cfg: Optional[Dict] = None,
+                 on_token: Optional[Callable[[str], None]] = None):
+        super().__init__(system_prompt, llm_call, context, local_model_cfg, on_token)
+
+    def _user_message(self, state: Dict) -> str:
+        """
+        Редактор отвечает операциями над текущей диаграммой, поэтому она передается вместе с запросом
+        """
+        diagram = json.dumps(state["bpmn"].view(), ensure_ascii=False, separators=(",", ":"))
+        return f"Current diagram:\n{diagram}\n\nUser request: {state['user_input'][-1]}"
+
+
+class Repairer(Editor):
+    """
+    Точечная починка диаграммы через LLM: те же операции правки, что у редактора, но запрос - список
+    проблем, которые не исправил детерминированный валидатор (см. validator.py)
+    """
+
+    def _user_message(self, state: Dict) -> str:
+        diagram = json.dumps(state["bpmn"].view(), ensure_ascii=False, separators=(",", ":"))
+        problems = "\n".join(f"- {problem}" for problem in state["agents_result"]["validator"][-1]["content"]["unfixable"])
+        return (f"Current diagram:\n{diagram}\n\nUser request: {state['user_input'][-1]}\n\n"
+                f"The previous answer has problems, return operations that fix them:\n{problems}")
@@ -1,11 +1,16 @@
 from abc import ABC
-from typing import List, Callable, Optional
+from typing import Callable, Optional
 import json
 import logging
 import langid
-from src.utilities.llm_module.llm_constants import LANGUAGES
+from src.utilities.llm_module.llm_constants import (AGENT_SCHEMAS, CONTEXT_CFG, LANGUAGES, LOCAL_CONSTRAINED_DECODING,
+                                                     MODELS)
+from src.utilities.llm_module.context_log import ContextLog
+from src.utilities.llm_module.context_manager import ContextManager
+from src.utilities.llm_module.json_stream import extract_json
+from src.utilities.llm_module.response_cache import cache_key, get_response_cache
 from typing import Dict
-from mistralai.models import SystemMessage, UserMessage, AssistantMessage
+from mistralai.models import SystemMessage
 
 logger = logging.getLogger("Base_agent")
 logger.setLevel(logging.DEBUG)
@@ -20,12 +25,24 @@ langid.set_languages(LANGUAGES)
 
 
 class BaseAgent(ABC):
+    # ответ зависит только от сообщений, его можно брать из кеша ответов (см. response_cache.py)
+    cacheable = False
+
     def __init__(self, system_prompt: str, llm_call: Callable,
-                 context: Optional[List] = None, local_model_cfg: Optional[Dict] = None):
+                 context: Optional[ContextLog] = None, local_model_cfg: Optional[Dict] = None,
+                 on_token: Optional[Callable[[str], None]] = None):
         self.system_prompt = system_prompt
         self.llm_call = llm_call
         self.local_model_cfg = local_model_cfg
-        self.history: List = context if context is not None else []
+        self.on_token = on_token
+        # последний ответ взят из кеша, а не сгенерирован
+        self.cache_hit = False
+        self.context: ContextLog = context if context is not None else ContextLog()
+        self.history = self.context.view(self._agent_role())
+        self.context_manager = ContextManager(
+            CONTEXT_CFG["budgets"].get(self._agent_role(), CONTEXT_CFG["budgets"]["x6processor"]),
+            tokenizer=local_model_cfg.get("tokenizer") if local_model_cfg else None,
+            summary_chars=CONTEXT_CFG["summary_chars"])
         logger.debug(
             f"{self._agent_role()} initialized. History length: {len(self.history)}")
 
@@ -33,23 +50,33 @@ class BaseAgent(ABC):
         user_input = state["user_input"][-1]
         logger.info(f"[{self._agent_role()}] Received input: {user_input}")
 
-        self.history.append(UserMessage(content=user_input))
+        self.context.record(self._agent_role(), "user", self._user_message(state))
         logger.debug(
             f"[{self._agent_role()}] Appended UserMessage. History length: {len(self.history)}")
 
         lang = langid.classify(user_input)[0]
         sys_msg = SystemMessage(
             content=f"{self.system_prompt}{lang} language code")
-        messages = [sys_msg] + self.history
+        # агент видит только свои события журнала, старые реплики сверх бюджета сворачиваются
+        messages = [sys_msg] + self.context_manager.fit(self.history)
 
+        cache = get_response_cache() if self.cacheable else None
+        key = cache_key(self._agent_role(), self._model_id(), messages) if cache else None
+        raw_response = cache.get(key) if cache else None
+        self.cache_hit = raw_response is not None
         try:
-            if not self.local_model_cfg and self.llm_call.__name__ == "mistral_call":
-                raw_response = self.llm_call(messages=messages)
+            if raw_response is not None:
+                logger.debug(f"[{self._agent_role()}] Response cache hit")
+                if self.on_token:
+                    self.on_token(raw_response)
+                response = self._process_response(raw_response)
             else:
-                raw_response = self.llm_call(messages=messages, local_model_cfg=self.local_model_cfg)
-            logger.debug(
-                f"[{self._agent_role()}] LLM raw response: {raw_response}")
-            response = self._process_response(raw_response)
+                raw_response = self.llm_call(messages=messages, **self._llm_kwargs())
+                logger.debug(
+                    f"[{self._agent_role()}] LLM raw response: {raw_response}")
+                response = self._process_response(raw_response)
+                if cache:
+                    cache.set(key, raw_response)
         except Exception as e:
             logger.exception(
                 f"[{self._agent_role()}] Error during LLM call or parsing: {e}")
@@ -57,11 +84,13 @@ class BaseAgent(ABC):
 
         logger.info(f"[{self._agent_role()}] Parsed response: {response}")
 
-        self.history.append(AssistantMessage(content=raw_response))
+        # другим агентам вместо JSON ответа достаточно его текста (вопрос clarifier и т.п.)
+        note = response.get("content") if isinstance(response.get("content"), str) else None
+        self.context.record(self._agent_role(), "assistant", raw_response, note)
         logger.debug(
             f"[{self._agent_role()}] Appended AssistantMessage. History length: {len(self.history)}")
 
-        state["context"] = self.history
+        state["context"] = self.context
         logger.debug(f"[{self._agent_role()}] Updated state context.")
         if self._agent_role() not in state["agents_result"].keys():
             state["agents_result"][self._agent_role()] = []
@@ -82,6 +111,10 @@ class BaseAgent(ABC):
             "editor": {
                 "flag": True,
                 "content": response
+            },
+            "repairer": {
+                "flag": True,
+                "content": response
             }
         }
         state["agents_result"][self._agent_role()].append(
@@ -93,15 +126,39 @@ class BaseAgent(ABC):
 
         return state
 
+    def _llm_kwargs(self) -> Dict:
+        """
+        Дополнительные аргументы llm_call: конфиг локальной модели (и схема ответа,
+        если включен constrained decoding) и колбэк стриминга токенов
+        """
+        kwargs = {}
+        if self.local_model_cfg:
+            kwargs["local_model_cfg"] = self.local_model_cfg
+            if LOCAL_CONSTRAINED_DECODING and self._agent_role() in AGENT_SCHEMAS:
+                kwargs["schema"] = AGENT_SCHEMAS[self._agent_role()]
+        if self.on_token:
+            kwargs["on_token"] = self.on_token
+        return kwargs
+
+    def _model_id(self) -> str:
+        # у маршрутизированного вызова (см. routing.py) модель своя
+        model_id = getattr(self.llm_call, "model_id", None)
+        if model_id:
+            return model_id
+        return MODELS["mistral_local"] if self.local_model_cfg else MODELS["mistral_api"]
+
+    def _user_message(self, state: Dict) -> str:
+        """
+        Текст сообщения пользователя для LLM, агенты могут дополнять запрос данными из состояния
+        """
+        return state["user_input"][-1]
+
     def _agent_role(self) -> str:
         return self.__class__.__name__.lower()
 
     def _process_response(self, raw: str) -> Dict:
         try:
-            data = json.loads(raw.strip().strip('```').strip('json'))
-            if not isinstance(data, dict):
-                raise ValueError("Response is not a JSON object")
-            return data
+            return extract_json(raw)
         except json.JSONDecodeError as e:
             logger.error(
                 f"[{self._agent_role()}] JSON decode error: {e}\nRaw: {raw}")
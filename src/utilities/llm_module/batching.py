@@ -0,0 +1,266 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+import torch
+from transformers import DynamicCache
+
+from src.utilities.debug.logger import setup_logger
+from src.utilities.llm_module.constrained import JsonSchemaLogitsProcessor
+from src.utilities.llm_module.json_stream import JsonStreamExtractor
+
+logger = setup_logger("BatchScheduler")
+
+
+class _Sequence:
+    """
+    Одна генерация внутри батча: токены, параметры сэмплинга и future для результата
+    """
+
+    def __init__(self, prompt_ids: List[int], future: Future, tokenizer, max_new_tokens: int = 1024,
+                 do_sample: bool = True, temperature: float = 0.7, top_p: float = 0.95,
+                 on_token: Optional[Callable[[str], None]] = None, stop_on_json: bool = True,
+                 schema: Optional[Dict] = None, stop: Optional[List[str]] = None):
+        self.prompt_ids = prompt_ids
+        self.generated: List[int] = []
+        self.future = future
+        self.tokenizer = tokenizer
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        self.temperature = temperature
+        self.top_p = top_p
+        self.on_token = on_token
+        self.extractor = JsonStreamExtractor() if stop_on_json else None
+        self.processor = JsonSchemaLogitsProcessor(tokenizer, [schema], len(prompt_ids)) if schema else None
+        self.stop = stop or []
+        self.text = ""
+
+    def sample(self, scores: torch.FloatTensor) -> int:
+        if self.processor:
+            input_ids = torch.tensor([self.prompt_ids + self.generated], device=scores.device)
+            scores = self.processor(input_ids, scores[None])[0]
+        if not self.do_sample:
+            return int(scores.argmax())
+        probs = torch.softmax(scores / self.temperature, dim=-1)
+        sorted_probs, sorted_ids = probs.sort(descending=True)
+        # top-p: оставляем минимальный набор токенов с суммарной вероятностью >= top_p
+        keep = sorted_probs.cumsum(-1) - sorted_probs < self.top_p
+        sorted_probs = sorted_probs * keep
+        return int(sorted_ids[torch.multinomial(sorted_probs, 1)])
+
+    def append(self, token_id: int) -> bool:
+        """
+        Добавляет токен, возвращает True, если генерация закончена
+        """
+
+        if token_id == self.tokenizer.eos_token_id:
+            return True
+        self.generated.append(token_id)
+        text = self.tokenizer.decode(self.generated, skip_special_tokens=True)
+        # незаконченный многобайтовый символ придержим до следующего токена
+        if not text.endswith("�"):
+            delta, self.text = text[len(self.text):], text
+            if delta:
+                if self.on_token:
+                    self.on_token(delta)
+                if self.extractor and self.extractor.feed(delta):
+                    return True
+                if any(sequence in self.text for sequence in self.stop):
+                    return True
+        return len(self.generated) >= self.max_new_tokens
+
+    def result(self) -> str:
+        return self.tokenizer.decode(self.generated, skip_special_tokens=True)
+
+
+class BatchScheduler:
+    """
+    Continuous batching перед локальной моделью: вызовы mistral_local_call из разных сессий
+    собираются в один батч. Последовательности добавляются и убираются из батча на границе
+    каждого токена: новые запросы проходят prefill отдельно и подклеиваются к KV-кешу батча
+    с паддингом слева, закончившиеся строки сразу вырезаются из кеша.
+
+    Работает с любой causal LM из transformers, у которой KV-кеш - DynamicCache
+    (для AWQ это значит fuse_layers=False, fused слои держат собственный кеш)
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size: int = 8, max_wait_ms: float = 10):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self._queue: "queue.Queue[_Sequence]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+
+    def submit(self, prompt_ids: List[int], **params) -> Future:
+        future = Future()
+        self._queue.put(_Sequence(prompt_ids, future, self.tokenizer, **params))
+        self._ensure_started()
+        return future
+
+    def generate(self, prompt_ids: List[int], **params) -> str:
+        return self.submit(prompt_ids, **params).result()
+
+    def _ensure_started(self) -> None:
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="batch-scheduler", daemon=True)
+                self._thread.start()
+
+    def _collect(self, active: int) -> List[_Sequence]:
+        """
+        Новые запросы: если батч пуст - ждем первый и еще max_wait на набор батча,
+        иначе забираем только то, что уже в очереди, чтобы не тормозить активные строки
+        """
+
+        free = self.max_batch_size - active
+        new = []
+        if not active:
+            new.append(self._queue.get())
+            deadline = time.monotonic() + self.max_wait
+            while len(new) < free:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    new.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        while len(new) < free:
+            try:
+                new.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return new
+
+    def _loop(self) -> None:
+        active: List[_Sequence] = []
+        cache = None
+        mask = None
+        logits = None
+        while True:
+            new = self._collect(len(active))
+            try:
+                if new:
+                    new_cache, new_mask, new_logits = self._prefill(new)
+                    if active:
+                        cache, mask = _merge(cache, mask, new_cache, new_mask)
+                        logits = torch.cat([logits, new_logits])
+                    else:
+                        cache, mask, logits = new_cache, new_mask, new_logits
+                    active.extend(new)
+
+                keep, tokens = [], []
+                for row, sequence in enumerate(active):
+                    token_id = self._step(sequence, logits[row])
+                    if token_id is not None:
+                        keep.append(row)
+                        tokens.append(token_id)
+
+                if len(keep) < len(active):
+                    active = [active[row] for row in keep]
+                    if not active:
+                        cache = mask = logits = None
+                        continue
+                    cache, mask = _select(cache, mask, keep)
+
+                cache, mask, logits = self._decode(cache, mask, tokens)
+            except Exception as e:
+                # сюда доходят только ошибки модели (prefill/decode), они портят кеш всего батча
+                logger.exception(f"Batch generation failed: {e}")
+                # новые строки могли не успеть попасть в active, если упал их prefill
+                for sequence in active + [sequence for sequence in new if sequence not in active]:
+                    if not sequence.future.done():
+                        sequence.future.set_exception(e)
+                active, cache, mask, logits = [], None, None, None
+
+    @staticmethod
+    def _step(sequence: _Sequence, scores: torch.FloatTensor) -> Optional[int]:
+        """
+        Следующий токен строки или None, если строка закончила (результат или ошибка уже в future).
+        Ошибки сэмплинга, колбэка on_token (клиент отключился) и экстрактора завершают только свою строку
+        """
+
+        if sequence.future.cancelled():
+            return None
+        try:
+            token_id = sequence.sample(scores)
+            if not sequence.append(token_id):
+                return token_id
+            sequence.future.set_result(sequence.result())
+        except Exception as e:
+            logger.warning(f"Sequence dropped from the batch: {e!r}")
+            if not sequence.future.done():
+                sequence.future.set_exception(e)
+        return None
+
+    def _device(self) -> torch.device:
+        return next(self.model.parameters()).device
+
+    @torch.no_grad()
+    def _prefill(self, sequences: List[_Sequence]):
+        length = max(len(sequence.prompt_ids) for sequence in sequences)
+        input_ids = torch.full((len(sequences), length), self.pad_token_id, dtype=torch.long)
+        mask = torch.zeros((len(sequences), length), dtype=torch.long)
+        for row, sequence in enumerate(sequences):
+            input_ids[row, length - len(sequence.prompt_ids):] = torch.tensor(sequence.prompt_ids)
+            mask[row, length - len(sequence.prompt_ids):] = 1
+        device = self._device()
+        input_ids, mask = input_ids.to(device), mask.to(device)
+        output = self.model(input_ids=input_ids, attention_mask=mask, position_ids=_positions(mask),
+                            past_key_values=DynamicCache(), use_cache=True)
+        return output.past_key_values, mask, output.logits[:, -1, :].float()
+
+    @torch.no_grad()
+    def _decode(self, cache, mask: torch.Tensor, tokens: List[int]):
+        mask = torch.cat([mask, mask.new_ones((mask.shape[0], 1))], dim=1)
+        input_ids = torch.tensor(tokens, device=mask.device)[:, None]
+        output = self.model(input_ids=input_ids, attention_mask=mask,
+                            position_ids=_positions(mask)[:, -1:], past_key_values=cache, use_cache=True)
+        return output.past_key_values, mask, output.logits[:, -1, :].float()
+
+
+def _positions(mask: torch.Tensor) -> torch.Tensor:
+    return (mask.cumsum(-1) - 1).clamp(min=0)
+
+
+def _merge(cache, mask: torch.Tensor, new_cache, new_mask: torch.Tensor):
+    """
+    Склейка KV-кешей двух батчей по оси батча, более короткий дополняется нулями слева
+    """
+
+    length = max(mask.shape[1], new_mask.shape[1])
+    layers = []
+    for (key, value), (new_key, new_value) in zip(cache.to_legacy_cache(), new_cache.to_legacy_cache()):
+        layers.append((torch.cat([_pad_left(key, length), _pad_left(new_key, length)]),
+                       torch.cat([_pad_left(value, length), _pad_left(new_value, length)])))
+    mask = torch.cat([_pad_left(mask, length), _pad_left(new_mask, length)])
+    return DynamicCache.from_legacy_cache(tuple(layers)), mask
+
+
+def _select(cache, mask: torch.Tensor, rows: List[int]):
+    """
+    Оставляет в кеше только строки rows и срезает слева колонки, где у всех оставшихся паддинг
+    """
+
+    index = torch.tensor(rows, device=mask.device)
+    mask = mask.index_select(0, index)
+    start = int((mask.sum(0) == 0).long().cumprod(0).sum())
+    layers = tuple((key.index_select(0, index)[:, :, start:], value.index_select(0, index)[:, :, start:])
+                   for key, value in cache.to_legacy_cache())
+    return DynamicCache.from_legacy_cache(layers), mask[:, start:]
+
+
+def _pad_left(tensor: torch.Tensor, length: int) -> torch.Tensor:
+    # маска [batch, seq], кеш [batch, heads, seq, dim]
+    axis = 1 if tensor.dim() == 2 else 2
+    missing = length - tensor.shape[axis]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[axis] = missing
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=axis)
@@ -1,7 +1,12 @@
-from mistralai import Mistral
 from mistralai.models import SystemMessage, UserMessage, AssistantMessage
-from src.utilities.llm_module.llm_constants import MISTRAL_API_KEY, MODELS
-from typing import List, Dict, Union
+from src.utilities.llm_module.mistral_client import get_mistral_client
+from src.utilities.llm_module.json_stream import JsonStreamExtractor
+from src.utilities.llm_module.constrained import JsonSchemaLogitsProcessor
+from src.utilities.llm_module.prefix_cache import common_prefix_length
+from src.utilities.services.model_client import ModelServerClient
+from transformers import DynamicCache, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+from threading import Thread
+from typing import Callable, List, Dict, Optional, Union
 import torch
 import logging
 
@@ -20,41 +25,173 @@ def _preprocess_context(context: List[Union[UserMessage, SystemMessage, Assistan
     return processed_context
 
 
-def mistral_call(messages: List[Union[UserMessage, SystemMessage, AssistantMessage]]) -> str:
-    passed = False
-    client = Mistral(api_key=MISTRAL_API_KEY)
-    while not passed:
-        try:
-            response = client.chat.complete(
-                model=MODELS["mistral_api"],
-                messages=messages,
-                safe_prompt=True
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            logger.exception(f"Error during Mistral API call: {e}")
-            continue
+class JsonStoppingCriteria(StoppingCriteria):
+    """
+    Останавливает generate, как только в новых токенах закрылся первый JSON объект
+    (все агенты отвечают одним объектом, остальное - потраченные впустую токены)
+    """
+
+    def __init__(self, tokenizer, prompt_length: int):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.extractor = JsonStreamExtractor()
+        self.seen = prompt_length
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        new_tokens = input_ids[0, self.seen:]
+        self.seen = input_ids.shape[1]
+        return self.extractor.feed(self.tokenizer.decode(new_tokens, skip_special_tokens=True))
+
+
+def mistral_call(messages: List[Union[UserMessage, SystemMessage, AssistantMessage]],
+                 on_token: Optional[Callable[[str], None]] = None, stop_on_json: bool = True,
+                 model: Optional[str] = None, max_new_tokens: Optional[int] = None,
+                 temperature: Optional[float] = None, stop: Optional[List[str]] = None) -> str:
+    """
+    Вызов Mistral API через общий клиент (пул соединений, повторы с backoff, предохранитель).
+    При недоступности API бросает MistralUnavailableError.
+    Ответ забирается через streaming API: токены отдаются в on_token (если передан),
+    а при stop_on_json поток обрывается сразу после закрытия первого JSON объекта
+    model, max_new_tokens, temperature, stop - параметры маршрута агента (см. routing.py),
+    не заданные берутся по умолчанию клиента/API
+    """
+    params = {key: value for key, value in
+              dict(model=model, max_tokens=max_new_tokens, temperature=temperature, stop=stop or None).items()
+              if value is not None}
+    if on_token or stop_on_json:
+        until = JsonStreamExtractor().feed if stop_on_json else None
+        return get_mistral_client().stream(messages=messages, on_token=on_token, until=until, safe_prompt=True,
+                                           **params)
+    return get_mistral_client().complete(messages=messages, safe_prompt=True, **params)
+
+
+async def mistral_async_call(messages: List[Union[UserMessage, SystemMessage, AssistantMessage]]) -> str:
+    """
+    Асинхронный вариант mistral_call для вызова из event loop
+    """
+    return await get_mistral_client().complete_async(messages=messages, safe_prompt=True)
+
+
+def _generate(model, streamer: TextIteratorStreamer, outputs: List, errors: List[Exception], **generation_kwargs):
+    """
+    generate для фонового потока: при ошибке закрываем streamer, иначе читатель зависнет
+    """
+    try:
+        with torch.no_grad():
+            outputs.append(model.generate(streamer=streamer, **generation_kwargs))
+    except Exception as e:
+        errors.append(e)
+        streamer.end()
 
 
-def mistral_local_call(messages: List[Union[UserMessage, SystemMessage, AssistantMessage]], local_model_cfg) -> str:
+def _system_prefix_length(tokenizer, messages: List[Dict[str, str]], prompt_ids: List[int]) -> int:
+    """
+    Длина общей для всех сессий части промпта - шаблон чата до конца системного сообщения
+    """
+    if not messages or messages[0]["role"] != "system":
+        return 0
+    system_ids = tokenizer.apply_chat_template(messages[:1], tokenize=True, add_generation_prompt=False)
+    return common_prefix_length(system_ids, prompt_ids)
+
+
+def _store_prefixes(prefix_cache, tokenizer, messages: List[Dict[str, str]], prompt_ids: List[int], cache) -> None:
+    """
+    Кладет в кеш системный промпт и весь промпт вызова (с него начнется следующий ход сессии)
+    """
+    prefix_cache.store(prompt_ids, cache, _system_prefix_length(tokenizer, messages, prompt_ids))
+    prefix_cache.store(prompt_ids, cache, len(prompt_ids))
+
+
+def cut_stop(text: str, stop: Optional[List[str]]) -> str:
+    """
+    Обрезка ответа по первой стоп-последовательности (как это делает API)
+    """
+    for sequence in stop or []:
+        index = text.find(sequence)
+        if index != -1:
+            text = text[:index]
+    return text
+
+
+def mistral_local_call(messages: List[Union[UserMessage, SystemMessage, AssistantMessage]], local_model_cfg,
+                       on_token: Optional[Callable[[str], None]] = None, stop_on_json: bool = True,
+                       schema: Optional[Dict] = None, max_new_tokens: int = 1024, temperature: float = 0.7,
+                       stop: Optional[List[str]] = None) -> str:
     """
     Функция для вызова модели Mistral local с использованием библиотеки transformers.
+    Если передан on_token, генерация идет в отдельном потоке, а токены отдаются через TextIteratorStreamer.
+    stop_on_json - остановка генерации после закрытия первого JSON объекта
+    schema - JSON схема ответа, токены вне схемы маскируются при генерации (constrained decoding)
+    local_model_cfg = {"server": address} - генерация в общем model-server процессе (см. model_server.py)
+    local_model_cfg["scheduler"] - генерация через общий батч (см. batching.py)
+    local_model_cfg["prefix_cache"] - переиспользование KV-кеша общих префиксов промпта (см. prefix_cache.py)
+    max_new_tokens, temperature, stop - параметры маршрута агента (см. routing.py)
     """
+    if "server" in local_model_cfg:
+        return ModelServerClient(local_model_cfg["server"]).generate(
+            messages, on_token=on_token, stop_on_json=stop_on_json, schema=schema, max_new_tokens=max_new_tokens,
+            temperature=temperature, stop=stop, model=local_model_cfg.get("name", "mistral_local"))
+
     model = local_model_cfg["model"]
     tokenizer = local_model_cfg["tokenizer"]
-    prompt = tokenizer.apply_chat_template(_preprocess_context(messages), tokenize=False, add_generation_prompt=True)
+    chat = _preprocess_context(messages)
+    prompt = tokenizer.apply_chat_template(chat, tokenize=False, add_generation_prompt=True)
+    if "scheduler" in local_model_cfg:
+        return cut_stop(local_model_cfg["scheduler"].generate(
+            tokenizer(prompt).input_ids, max_new_tokens=max_new_tokens, do_sample=True, temperature=temperature,
+            top_p=0.95, on_token=on_token, stop_on_json=stop_on_json, schema=schema, stop=stop), stop)
     inputs = tokenizer(prompt, return_tensors="pt")
     device = next(model.parameters()).device
     inputs = {k: v.to(device) for k, v in inputs.items()}
 
+    generation_kwargs = dict(
+        **inputs,
+        max_new_tokens=max_new_tokens,
+        do_sample=True,
+        temperature=temperature,
+        top_p=0.95,
+        pad_token_id=tokenizer.eos_token_id
+    )
+    if stop:
+        generation_kwargs.update(stop_strings=stop, tokenizer=tokenizer)
+    prefix_cache = local_model_cfg.get("prefix_cache")
+    prompt_ids = inputs["input_ids"][0].tolist()
+    if prefix_cache is not None:
+        # generate сам пропустит уже закешированные позиции и посчитает prefill только для хвоста
+        cached_length, past_key_values = prefix_cache.lookup(prompt_ids)
+        logger.debug(f"Prefix cache: {cached_length}/{len(prompt_ids)} prompt tokens reused")
+        generation_kwargs.update(return_dict_in_generate=True,
+                                 past_key_values=past_key_values if past_key_values is not None else DynamicCache())
+    if stop_on_json:
+        generation_kwargs["stopping_criteria"] = StoppingCriteriaList(
+            [JsonStoppingCriteria(tokenizer, inputs["input_ids"].shape[1])])
+    if schema:
+        generation_kwargs["logits_processor"] = LogitsProcessorList(
+            [JsonSchemaLogitsProcessor(tokenizer, [schema], inputs["input_ids"].shape[1])])
+
+    if on_token:
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+        outputs = []
+        thread = Thread(target=_generate,
+                        kwargs=dict(model=model, streamer=streamer, outputs=outputs, errors=errors, **generation_kwargs))
+        thread.start()
+        chunks = []
+        for text in streamer:
+            if text:
+                chunks.append(text)
+                on_token(text)
+        thread.join()
+        if errors:
+            raise errors[0]
+        if prefix_cache is not None:
+            _store_prefixes(prefix_cache, tokenizer, chat, prompt_ids, outputs[0].past_key_values)
+        return cut_stop("".join(chunks), stop)
+
     with torch.no_grad():
-        tokens = model.generate(
-            **inputs,
-            max_new_tokens=1024,
-            do_sample=True,
-            temperature=0.7,
-            top_p=0.95,
-            pad_token_id=tokenizer.eos_token_id
-        )
+        tokens = model.generate(**generation_kwargs)
+    if prefix_cache is not None:
+        _store_prefixes(prefix_cache, tokenizer, chat, prompt_ids, tokens.past_key_values)
+        tokens = tokens.sequences
     output_text = tokenizer.decode(tokens[0], skip_special_tokens=True)
-    return output_text.split("assistant\n")[-1]
+    return cut_stop(output_text.split("assistant\n")[-1], stop)
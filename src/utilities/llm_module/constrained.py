@@ -0,0 +1,243 @@
+import json
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from transformers import LogitsProcessor
+
+from src.utilities.debug.logger import setup_logger
+
+logger = setup_logger("Constrained")
+
+_WHITESPACE = " \t\n\r"
+_ESCAPES = "\"\\/bfnrt"
+_BYTE_TOKEN = re.compile(r"<0x([0-9A-Fa-f]{2})>")
+
+# стек фреймов (кортежи), состояние неизменяемое - переход не копирует стек целиком
+State = Tuple[tuple, int]
+
+
+class JsonSchemaAutomaton:
+    """
+    Посимвольный автомат с магазинной памятью, принимающий префиксы JSON по схеме.
+    Поддерживается подмножество JSON Schema, которого хватает агентам:
+    object (properties в заданном порядке, все обязательные), array (items),
+    string (опционально enum), integer, boolean.
+    Объект с "variants" - размеченное объединение: первое свойство - строка-дискриминатор (enum),
+    после ее значения остальные свойства берутся из variants[значение]
+    Пробелы между токенами JSON разрешены, но не больше max_whitespace подряд,
+    чтобы модель не могла бесконечно генерировать отступы
+    """
+
+    def __init__(self, schema: Dict, max_whitespace: int = 16):
+        self.schema = schema
+        self.max_whitespace = max_whitespace
+
+    def initial(self) -> State:
+        return (("value", self.schema),), 0
+
+    @staticmethod
+    def is_complete(state: State) -> bool:
+        return not state[0]
+
+    def advance(self, state: State, text: str) -> Optional[State]:
+        stack, whitespace = state
+        for ch in text:
+            if not stack:
+                return None
+            if ch in _WHITESPACE and stack[-1][0] != "str":
+                whitespace += 1
+                if whitespace > self.max_whitespace:
+                    return None
+            else:
+                whitespace = 0
+            stack = self._step(stack, ch)
+            if stack is None:
+                return None
+        return stack, whitespace
+
+    def _step(self, stack: tuple, ch: str) -> Optional[tuple]:
+        frame = stack[-1]
+        kind = frame[0]
+        rest = stack[:-1]
+
+        if kind == "str":
+            _, enum, prefix, escape = frame
+            if escape:
+                return rest + (("str", enum, prefix, False),) if ch in _ESCAPES else None
+            if ch == "\\":
+                return None if enum else rest + (("str", enum, prefix, True),)
+            if ch == "\"":
+                if enum is not None and prefix not in enum:
+                    return None
+                if rest and rest[-1][0] == "obj" and "variants" in rest[-1][1]:
+                    # значение дискриминатора выбрало вариант объекта, дальше идут его свойства
+                    _, schema, index, phase = rest[-1]
+                    return rest[:-1] + (("obj", schema["variants"][prefix], index, phase),)
+                return rest
+            if ch < " ":
+                return None
+            if enum is None:
+                return stack
+            prefix += ch
+            if not any(option.startswith(prefix) for option in enum):
+                return None
+            return rest + (("str", enum, prefix, False),)
+
+        if kind == "lit":
+            remaining = frame[1]
+            if ch != remaining[0]:
+                return None
+            return rest if len(remaining) == 1 else rest + (("lit", remaining[1:]),)
+
+        if kind == "int":
+            digits = frame[1]
+            if ch.isdigit():
+                return rest + (("int", digits + 1),) if digits < 12 else None
+            if not digits or not rest:
+                return None
+            # число закончилось, символ обрабатывает родительский фрейм
+            return self._step(rest, ch)
+
+        if ch in _WHITESPACE:
+            return stack
+
+        if kind == "value":
+            return self._start_value(rest, frame[1], ch)
+
+        if kind == "obj":
+            _, schema, index, phase = frame
+            properties = list(schema.get("properties", {}).items())
+            if phase == "key":
+                if index >= len(properties):
+                    return rest if ch == "}" else None
+                if ch != "\"":
+                    return None
+                key = json.dumps(properties[index][0], ensure_ascii=False)[1:]
+                return rest + (("obj", schema, index, "colon"), ("lit", key))
+            if phase == "colon":
+                if ch != ":":
+                    return None
+                return rest + (("obj", schema, index, "after"), ("value", properties[index][1]))
+            if ch == "," and index + 1 < len(properties):
+                return rest + (("obj", schema, index + 1, "key"),)
+            if ch == "}" and index + 1 >= len(properties):
+                return rest
+            return None
+
+        if kind == "arr":
+            _, schema, phase = frame
+            if phase == "next":
+                if ch == ",":
+                    return rest + (("arr", schema, "item"),)
+                return rest if ch == "]" else None
+            if phase == "first" and ch == "]":
+                return rest
+            return self._start_value(rest + (("arr", schema, "next"),), schema["items"], ch)
+
+        return None
+
+    @staticmethod
+    def _start_value(stack: tuple, schema: Dict, ch: str) -> Optional[tuple]:
+        kind = schema["type"]
+        if kind == "object" and ch == "{":
+            return stack + (("obj", schema, 0, "key"),)
+        if kind == "array" and ch == "[":
+            return stack + (("arr", schema, "first"),)
+        if kind == "string" and ch == "\"":
+            enum = tuple(schema["enum"]) if "enum" in schema else None
+            return stack + (("str", enum, "", False),)
+        if kind == "integer" and (ch.isdigit() or ch == "-"):
+            return stack + (("int", int(ch.isdigit())),)
+        if kind == "boolean" and ch in "tf":
+            return stack + (("lit", "rue" if ch == "t" else "alse"),)
+        return None
+
+
+@lru_cache(maxsize=4)
+def _token_strings(tokenizer) -> Tuple[Optional[str], ...]:
+    """
+    Текст каждого токена словаря (один раз на токенайзер). Спец. токены и куски
+    многобайтовых символов - None, такие токены внутри JSON запрещены
+    """
+
+    special = set(tokenizer.all_special_ids)
+    pieces = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+    sentencepiece = any(piece and piece.startswith("▁") for piece in pieces)
+    strings = []
+    for token_id, piece in enumerate(pieces):
+        if piece is None or token_id in special:
+            strings.append(None)
+            continue
+        byte = _BYTE_TOKEN.fullmatch(piece)
+        if byte:
+            value = int(byte.group(1), 16)
+            strings.append(chr(value) if value < 128 else None)
+        elif sentencepiece:
+            strings.append(piece.replace("▁", " "))
+        else:
+            strings.append(tokenizer.convert_tokens_to_string([piece]))
+    return tuple(strings)
+
+
+class JsonSchemaLogitsProcessor(LogitsProcessor):
+    """
+    Маскирует токены, с которыми сгенерированный текст перестает быть префиксом JSON по схеме.
+    Кандидаты проверяются в порядке убывания логитов, пока не наберется top_k допустимых -
+    этого хватает для сэмплинга и не требует прохода по всему словарю на каждом шаге.
+    Когда объект закрыт, разрешен только eos, поэтому генерация останавливается на закрывающей скобке.
+    schemas - по схеме на строку батча (None - строка без ограничений)
+    """
+
+    def __init__(self, tokenizer, schemas: List[Optional[Dict]], prompt_length: int,
+                 top_k: int = 16, max_checks: int = 2048):
+        self.tokenizer = tokenizer
+        self.token_strings = _token_strings(tokenizer)
+        self.eos_token_id = tokenizer.eos_token_id
+        self.automata = [JsonSchemaAutomaton(schema) if schema else None for schema in schemas]
+        self.states: List[Optional[State]] = [automaton.initial() if automaton else None
+                                              for automaton in self.automata]
+        self.seen = prompt_length
+        self.top_k = top_k
+        self.max_checks = max_checks
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        new_tokens = input_ids[:, self.seen:].tolist()
+        self.seen = input_ids.shape[1]
+        masked = torch.full_like(scores, float("-inf"))
+        for row, automaton in enumerate(self.automata):
+            if automaton is None:
+                masked[row] = scores[row]
+                continue
+            state = self.states[row]
+            for token_id in new_tokens[row]:
+                if state is None or automaton.is_complete(state):
+                    break
+                text = self.token_strings[token_id]
+                state = automaton.advance(state, text) if text else None
+            self.states[row] = state
+
+            if state is None or automaton.is_complete(state):
+                masked[row, self.eos_token_id] = 0
+                continue
+            allowed = self._allowed(automaton, state, scores[row])
+            if not allowed:
+                logger.warning("No token satisfies the schema, releasing constraint")
+                masked[row] = scores[row]
+                continue
+            masked[row, allowed] = scores[row, allowed]
+        return masked
+
+    def _allowed(self, automaton: JsonSchemaAutomaton, state: State, scores: torch.FloatTensor) -> List[int]:
+        order = torch.argsort(scores, descending=True).tolist()
+        allowed = []
+        for checked, token_id in enumerate(order):
+            if checked >= self.max_checks and allowed:
+                break
+            text = self.token_strings[token_id]
+            if text and automaton.advance(state, text) is not None:
+                allowed.append(token_id)
+                if len(allowed) >= self.top_k:
+                    break
+        return allowed
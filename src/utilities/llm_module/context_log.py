@@ -0,0 +1,88 @@
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from mistralai.models import AssistantMessage, UserMessage
+
+from src.utilities.llm_module.context_manager import collapse_dump, is_diagram_dump
+from src.utilities.llm_module.llm_constants import AGENT_VIEWS
+
+_MESSAGE_TYPES = {"user": UserMessage, "assistant": AssistantMessage}
+
+
+class ContextView(Sequence):
+    """
+    История диалога глазами одного агента: последовательность сообщений поверх общего журнала.
+    Хранит только индексы событий, сообщения создаются при обращении, поэтому context manager,
+    которому нужен лишь хвост истории, не копирует весь журнал на каждый вызов.
+    Свои ответы агент видит как есть (JSON), чужие - короткой заметкой (текст вопроса clarifier и т.п.)
+    """
+
+    def __init__(self, log: "ContextLog", role: str, indices: List[int]):
+        self.log = log
+        self.role = role
+        self.indices = indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self._message(i) for i in self.indices[item]]
+        return self._message(self.indices[item])
+
+    def __iter__(self) -> Iterator:
+        return (self._message(i) for i in self.indices)
+
+    def __reversed__(self) -> Iterator:
+        return (self._message(i) for i in reversed(self.indices))
+
+    def _message(self, index: int):
+        agent, role, content, note = self.log.events[index]
+        if note is not None and agent != self.role:
+            content = note
+        return _MESSAGE_TYPES[role](content=content)
+
+
+class ContextLog:
+    """
+    Общий компактный журнал диалога сессии: события [агент, роль, текст, заметка для других агентов].
+    Какие события видит агент, задает AGENT_VIEWS; индексы представлений ведутся при записи.
+    Из дампов диаграмм в журнале остается только последний (актуальные версии - в state["bpmn"])
+    """
+
+    def __init__(self, events: Optional[List[List]] = None):
+        self.events: List[List] = []
+        self._views: Dict[str, List[int]] = {role: [] for role in AGENT_VIEWS}
+        self._last_dump: Optional[int] = None
+        for event in events or []:
+            self._append(event)
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def record(self, agent: str, role: str, content: str, note: Optional[str] = None) -> None:
+        self._append([agent, role, content, note])
+
+    def _append(self, event: List) -> None:
+        index = len(self.events)
+        self.events.append(event)
+        agent, role, content, _ = event
+        if is_diagram_dump(role, content):
+            if self._last_dump is not None:
+                previous = self.events[self._last_dump]
+                previous[2] = collapse_dump(previous[1], previous[2])
+            self._last_dump = index
+        for view, agents in AGENT_VIEWS.items():
+            # agent "" - события из сессий до разделения истории, видны всем
+            if agent in agents or agent == "":
+                self._views[view].append(index)
+
+    def view(self, role: str) -> ContextView:
+        return ContextView(self, role, self._views.setdefault(role, []))
+
+    def to_list(self) -> List[List]:
+        return self.events
+
+    @classmethod
+    def from_list(cls, events: List[List]) -> "ContextLog":
+        # старый формат [роль, текст] - общая история без разделения по агентам
+        return cls([event if len(event) == 4 else ["", event[0], event[1], None] for event in events])
@@ -0,0 +1,117 @@
+import re
+from functools import lru_cache
+from typing import List, Sequence
+
+from src.utilities.llm_module.json_stream import extract_json
+
+# запрос редактора/ремонтника с полной диаграммой (см. Editor._user_message)
+_DIAGRAM_REQUEST = re.compile(r"^Current diagram:\n.*?\n\nUser request: ", re.DOTALL)
+_COLLAPSED_REQUEST = "Current diagram: (older version, omitted)\n\nUser request: "
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str, tokenizer=None) -> int:
+    """
+    Число токенов сообщения токенизатором модели; без токенизатора (Mistral API, model-server) -
+    оценка по длине, ~3 символа на токен для смеси кириллицы и латиницы
+    """
+
+    if tokenizer is None:
+        return len(text) // 3 + 1
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def is_diagram_dump(role: str, content: str) -> bool:
+    """
+    Дамп диаграммы: ответ x6processor/editor (диаграмма или операции) или запрос редактора с текущей диаграммой
+    """
+
+    if role == "user":
+        return content.startswith("Current diagram:\n")
+    if role != "assistant" or ('"nodes"' not in content and '"ops"' not in content):
+        return False
+    try:
+        response = extract_json(content)
+    except Exception:
+        return False
+    return isinstance(response, dict) and ("nodes" in response or "ops" in response)
+
+
+def collapse_dump(role: str, content: str) -> str:
+    """
+    Короткая пометка вместо устаревшего дампа диаграммы
+    """
+
+    if role == "user":
+        return _DIAGRAM_REQUEST.sub(_COLLAPSED_REQUEST, content, count=1)
+    response = extract_json(content)
+    if "ops" in response:
+        return f"[{len(response.get('ops') or [])} edit operations, applied to an older version]"
+    return (f"[diagram with {len(response.get('nodes') or [])} nodes and {len(response.get('edges') or [])} "
+            f"edges, superseded by a later version]")
+
+
+class ContextManager:
+    """
+    Бюджет токенов на историю диалога одного агента. Если история не влезает, последние реплики
+    (не меньше текущего запроса) идут как есть в пределах 3/4 бюджета, а более старые сворачиваются
+    в выжимку - первые summary_chars символов каждой реплики, от новых к старым, пока хватает бюджета.
+    Выжимка приклеивается к первому оставленному сообщению пользователя, чередование ролей не ломается.
+    Сам журнал (state["context"]) не меняется
+    """
+
+    def __init__(self, budget: int, tokenizer=None, summary_chars: int = 200):
+        self.budget = budget
+        self.tokenizer = tokenizer
+        self.summary_chars = summary_chars
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.tokenizer)
+
+    def fit(self, history: Sequence) -> List:
+        """
+        История идет с конца, поэтому считаются токены только той части, что попадает в запрос
+        (history может быть ленивым представлением журнала, см. context_log.py)
+        """
+
+        n = len(history)
+        counts: List[int] = []
+        total = 0
+        for message in reversed(history):
+            counts.append(self.count(message.content))
+            total += counts[-1]
+            if total > self.budget:
+                break
+        else:
+            return list(history)
+        # counts[k] - токены сообщения history[n - 1 - k]
+        start = n - 1
+        used = counts[0]
+        while n - start < len(counts) and used + counts[n - start] <= self.budget * 3 // 4:
+            used += counts[n - start]
+            start -= 1
+        while start < n - 1 and history[start].role != "user":
+            used -= counts[n - 1 - start]
+            start += 1
+        tail = history[start:]
+
+        lines: List[str] = []
+        remaining = self.budget - used
+        for index in range(start - 1, -1, -1):
+            line = self._summary_line(history[index])
+            cost = self.count(line)
+            if cost > remaining:
+                break
+            lines.append(line)
+            remaining -= cost
+        if lines:
+            summary = "\n".join(reversed(lines))
+            tail[0] = type(tail[0])(content=f"Summary of the earlier conversation:\n{summary}\n\n{tail[0].content}")
+        return tail
+
+    def _summary_line(self, message) -> str:
+        text = " ".join(message.content.replace(_COLLAPSED_REQUEST, "").split())
+        if len(text) > self.summary_chars:
+            text = text[:self.summary_chars] + "…"
+        return f"{message.role}: {text}"
+
@@ -0,0 +1,431 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+_BITS = 5
+_MASK = (1 << _BITS) - 1
+_HASH_MASK = (1 << 64) - 1
+_MISSING = object()
+
+
+class _Leaf:
+    __slots__ = ("hash", "key", "value")
+
+    def __init__(self, hash_: int, key, value):
+        self.hash = hash_
+        self.key = key
+        self.value = value
+
+
+class _Collision:
+    """
+    Ключи с одинаковым полным хешем
+    """
+
+    __slots__ = ("hash", "leaves")
+
+    def __init__(self, hash_: int, leaves: Tuple[_Leaf, ...]):
+        self.hash = hash_
+        self.leaves = leaves
+
+
+class _Node:
+    __slots__ = ("bitmap", "children")
+
+    def __init__(self, bitmap: int, children: tuple):
+        self.bitmap = bitmap
+        self.children = children
+
+    def child(self, bit: int):
+        if not self.bitmap & bit:
+            return None
+        return self.children[bin(self.bitmap & (bit - 1)).count("1")]
+
+
+_EMPTY_NODE = _Node(0, ())
+
+
+class PersistentMap:
+    """
+    Неизменяемый словарь на HAMT (hash array mapped trie): set/delete возвращают новую карту
+    за O(log32 n), копируя только путь от корня до листа, остальные поддеревья общие со старой картой.
+    diff двух версий пропускает общие поддеревья, поэтому стоит O(изменений), а не O(n)
+    """
+
+    __slots__ = ("_root", "_size")
+
+    def __init__(self, root: _Node = _EMPTY_NODE, size: int = 0):
+        self._root = root
+        self._size = size
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __iter__(self) -> Iterator:
+        for key, _ in self.items():
+            yield key
+
+    def get(self, key, default=None):
+        hash_ = hash(key) & _HASH_MASK
+        node, shift = self._root, 0
+        while True:
+            if isinstance(node, _Node):
+                node = node.child(1 << ((hash_ >> shift) & _MASK))
+                shift += _BITS
+            elif isinstance(node, _Leaf):
+                return node.value if node.key == key else default
+            elif isinstance(node, _Collision):
+                for leaf in node.leaves:
+                    if leaf.key == key:
+                        return leaf.value
+                return default
+            else:
+                return default
+
+    def set(self, key, value) -> "PersistentMap":
+        root, added = _set(self._root, 0, _Leaf(hash(key) & _HASH_MASK, key, value))
+        if root is self._root:
+            return self
+        return PersistentMap(root, self._size + added)
+
+    def delete(self, key) -> "PersistentMap":
+        root = _delete(self._root, 0, hash(key) & _HASH_MASK, key)
+        if root is self._root:
+            return self
+        return PersistentMap(root if root is not None else _EMPTY_NODE, self._size - 1)
+
+    def items(self) -> Iterator[Tuple[Any, Any]]:
+        return _items(self._root)
+
+    def diff(self, other: "PersistentMap") -> Iterator[Tuple[Any, Any, Any]]:
+        """
+        (ключ, старое значение, новое значение) для ключей, отличающихся в other; отсутствие - _MISSING
+        """
+
+        return _diff(self._root, other._root)
+
+
+def _set(node, shift: int, leaf: _Leaf):
+    """
+    Возвращает (новый узел, 1 если ключ добавлен); если ничего не поменялось - тот же узел
+    """
+
+    if isinstance(node, _Collision):
+        if node.hash == leaf.hash:
+            for i, existing in enumerate(node.leaves):
+                if existing.key == leaf.key:
+                    if existing.value is leaf.value:
+                        return node, 0
+                    return _Collision(node.hash, node.leaves[:i] + (leaf,) + node.leaves[i + 1:]), 0
+            return _Collision(node.hash, node.leaves + (leaf,)), 1
+        return _set(_wrap(node, shift), shift, leaf)
+
+    bit = 1 << ((leaf.hash >> shift) & _MASK)
+    index = bin(node.bitmap & (bit - 1)).count("1")
+    if not node.bitmap & bit:
+        return _Node(node.bitmap | bit, node.children[:index] + (leaf,) + node.children[index:]), 1
+    child = node.children[index]
+    if isinstance(child, _Leaf):
+        if child.key == leaf.key:
+            if child.value is leaf.value:
+                return node, 0
+            new_child, added = leaf, 0
+        else:
+            new_child, added = _merge(child, leaf, shift + _BITS), 1
+    else:
+        new_child, added = _set(child, shift + _BITS, leaf)
+        if new_child is child:
+            return node, 0
+    return _Node(node.bitmap, node.children[:index] + (new_child,) + node.children[index + 1:]), added
+
+
+def _merge(first: _Leaf, second: _Leaf, shift: int):
+    if first.hash == second.hash:
+        return _Collision(first.hash, (first, second))
+    first_bit = 1 << ((first.hash >> shift) & _MASK)
+    second_bit = 1 << ((second.hash >> shift) & _MASK)
+    if first_bit == second_bit:
+        return _Node(first_bit, (_merge(first, second, shift + _BITS),))
+    children = (first, second) if first_bit < second_bit else (second, first)
+    return _Node(first_bit | second_bit, children)
+
+
+def _wrap(collision: _Collision, shift: int) -> _Node:
+    return _Node(1 << ((collision.hash >> shift) & _MASK), (collision,))
+
+
+def _delete(node, shift: int, hash_: int, key):
+    """
+    Новый узел без ключа: None, если узел опустел, лист - если в узле остался один лист
+    """
+
+    if isinstance(node, _Collision):
+        leaves = tuple(leaf for leaf in node.leaves if leaf.key != key)
+        if len(leaves) == len(node.leaves):
+            return node
+        return leaves[0] if len(leaves) == 1 else _Collision(node.hash, leaves)
+
+    bit = 1 << ((hash_ >> shift) & _MASK)
+    if not node.bitmap & bit:
+        return node
+    index = bin(node.bitmap & (bit - 1)).count("1")
+    child = node.children[index]
+    if isinstance(child, _Leaf):
+        if child.key != key:
+            return node
+        new_child = None
+    else:
+        new_child = _delete(child, shift + _BITS, hash_, key)
+        if new_child is child:
+            return node
+    if new_child is None:
+        children = node.children[:index] + node.children[index + 1:]
+        if not children:
+            return None
+        if len(children) == 1 and isinstance(children[0], _Leaf) and shift:
+            return children[0]
+        return _Node(node.bitmap & ~bit, children)
+    if len(node.children) == 1 and isinstance(new_child, _Leaf) and shift:
+        return new_child
+    return _Node(node.bitmap, node.children[:index] + (new_child,) + node.children[index + 1:])
+
+
+def _items(node) -> Iterator[Tuple[Any, Any]]:
+    if isinstance(node, _Leaf):
+        yield node.key, node.value
+    elif isinstance(node, _Collision):
+        for leaf in node.leaves:
+            yield leaf.key, leaf.value
+    elif node is not None:
+        for child in node.children:
+            yield from _items(child)
+
+
+def _diff(old, new) -> Iterator[Tuple[Any, Any, Any]]:
+    if old is new:
+        return
+    if isinstance(old, _Node) and isinstance(new, _Node):
+        for position in range(1 << _BITS):
+            bit = 1 << position
+            if (old.bitmap | new.bitmap) & bit:
+                yield from _diff(old.child(bit), new.child(bit))
+        return
+    # лист против поддерева - поддеревья маленькие, сравниваем содержимое
+    before = dict(_items(old))
+    after = dict(_items(new))
+    for key, value in before.items():
+        new_value = after.get(key, _MISSING)
+        if new_value is _MISSING or new_value is not value and new_value != value:
+            yield key, value, new_value
+    for key, value in after.items():
+        if key not in before:
+            yield key, _MISSING, value
+
+
+class HistoryError(LookupError):
+    """
+    Нет версии для undo/redo/checkout
+    """
+
+
+class _Version:
+    __slots__ = ("nodes", "edges", "parent", "seq")
+
+    def __init__(self, nodes: PersistentMap, edges: PersistentMap, parent: Optional[int], seq: int):
+        # значения карт - (порядковый номер, элемент), порядок узлов и ребер в диаграмме сохраняется
+        self.nodes = nodes
+        self.edges = edges
+        self.parent = parent
+        self.seq = seq
+
+
+def _edge_keys(edges: List[Dict]) -> Iterator[Tuple[str, Dict]]:
+    seen = set()
+    for edge in edges:
+        key = base = f"{edge['source']}->{edge['target']}"
+        duplicate = 1
+        while key in seen:
+            duplicate += 1
+            key = f"{base}#{duplicate}"
+        seen.add(key)
+        yield key, edge
+
+
+class DiagramHistory:
+    """
+    Версии диаграммы сессии с общими (неизменяемыми) картами узлов и ребер: новая версия хранит
+    только измененные элементы, остальное разделяется с родителем.
+    * head - текущая версия, view() - ее диаграмма за O(1) только для чтения, latest() - копия для правки,
+      is_empty() - проверка без копирования
+    * commit - новая версия от head, undo/redo - по родителю и обратно, checkout - любая версия
+    * diff - изменения между двумя версиями
+    Сериализуется дельтами от родителя (to_dict/from_dict)
+    """
+
+    def __init__(self):
+        self._versions: List[_Version] = [_Version(PersistentMap(), PersistentMap(), None, 0)]
+        self.head = 0
+        self._redo: List[int] = []
+        self._latest = self._materialize(self._versions[0])
+
+    def __len__(self) -> int:
+        return len(self._versions)
+
+    def is_empty(self) -> bool:
+        return not self._latest["nodes"]
+
+    def view(self, version: Optional[int] = None) -> Dict:
+        """
+        Диаграмма версии (по умолчанию head) без копирования: элементы общие с историей,
+        поэтому результат только для чтения (сериализация, раскладка, patches.apply_patch)
+        """
+
+        if version is None or version == self.head:
+            return self._latest
+        return self._materialize(self._version(version))
+
+    def latest(self) -> Dict:
+        return _copy(self._latest)
+
+    def get(self, version: int) -> Dict:
+        return _copy(self.view(version))
+
+    def commit(self, diagram: Dict) -> int:
+        """
+        Новая версия от head; если диаграмма не изменилась, возвращается head
+        """
+
+        base = self._versions[self.head]
+        seq = base.seq
+        nodes = base.nodes
+        present = set()
+        for node in diagram.get("nodes", []):
+            key = str(node["id"])
+            present.add(key)
+            existing = nodes.get(key)
+            if existing is None:
+                nodes = nodes.set(key, (seq, node))
+                seq += 1
+            elif existing[1] != node:
+                nodes = nodes.set(key, (existing[0], node))
+        for key in [key for key in nodes if key not in present]:
+            nodes = nodes.delete(key)
+
+        edges = base.edges
+        present = set()
+        for key, edge in _edge_keys(diagram.get("edges", [])):
+            present.add(key)
+            existing = edges.get(key)
+            if existing is None:
+                edges = edges.set(key, (seq, edge))
+                seq += 1
+            elif existing[1] != edge:
+                edges = edges.set(key, (existing[0], edge))
+        for key in [key for key in edges if key not in present]:
+            edges = edges.delete(key)
+
+        if nodes is base.nodes and edges is base.edges:
+            return self.head
+        self._versions.append(_Version(nodes, edges, self.head, seq))
+        self.head = len(self._versions) - 1
+        self._redo.clear()
+        self._latest = self._materialize(self._versions[self.head])
+        return self.head
+
+    def undo(self) -> int:
+        parent = self._versions[self.head].parent
+        if parent is None:
+            raise HistoryError("Nothing to undo")
+        self._redo.append(self.head)
+        self._move(parent)
+        return self.head
+
+    def redo(self) -> int:
+        if not self._redo:
+            raise HistoryError("Nothing to redo")
+        self._move(self._redo.pop())
+        return self.head
+
+    def checkout(self, version: int) -> int:
+        self._version(version)
+        self._redo.clear()
+        self._move(version)
+        return self.head
+
+    def diff(self, old: int, new: int) -> Dict[str, list]:
+        """
+        Изменения от версии old к new: added/removed/changed узлы и added/removed ребра
+        """
+
+        before, after = self._version(old), self._version(new)
+        result = {"added_nodes": [], "removed_nodes": [], "changed_nodes": [], "added_edges": [], "removed_edges": []}
+        for _, old_value, new_value in before.nodes.diff(after.nodes):
+            if old_value is _MISSING:
+                result["added_nodes"].append(new_value[1])
+            elif new_value is _MISSING:
+                result["removed_nodes"].append(old_value[1])
+            else:
+                result["changed_nodes"].append(new_value[1])
+        for _, old_value, new_value in before.edges.diff(after.edges):
+            if old_value is not _MISSING:
+                result["removed_edges"].append(old_value[1])
+            if new_value is not _MISSING:
+                result["added_edges"].append(new_value[1])
+        return result
+
+    def to_dict(self) -> Dict:
+        versions = []
+        for version in self._versions[1:]:
+            parent = self._versions[version.parent]
+            delta = {"parent": version.parent, "seq": version.seq}
+            for name in ("nodes", "edges"):
+                changes = list(getattr(parent, name).diff(getattr(version, name)))
+                delta[name] = {key: list(value) for key, _, value in changes if value is not _MISSING}
+                delta[f"removed_{name}"] = [key for key, _, value in changes if value is _MISSING]
+            versions.append(delta)
+        return {"versions": versions, "head": self.head, "redo": list(self._redo)}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "DiagramHistory":
+        history = cls()
+        for delta in data["versions"]:
+            parent = history._versions[delta["parent"]]
+            maps = {}
+            for name in ("nodes", "edges"):
+                current = getattr(parent, name)
+                for key, (seq, value) in delta[name].items():
+                    current = current.set(key, (seq, value))
+                for key in delta[f"removed_{name}"]:
+                    current = current.delete(key)
+                maps[name] = current
+            history._versions.append(_Version(maps["nodes"], maps["edges"], delta["parent"], delta["seq"]))
+        history._redo = list(data.get("redo", []))
+        history._move(data["head"])
+        return history
+
+    def _version(self, version: int) -> _Version:
+        if not 0 <= version < len(self._versions):
+            raise HistoryError(f"Version {version} not found")
+        return self._versions[version]
+
+    def _move(self, version: int) -> None:
+        self.head = version
+        self._latest = self._materialize(self._versions[version])
+
+    @staticmethod
+    def _materialize(version: _Version) -> Dict:
+        return {"nodes": _ordered(version.nodes), "edges": _ordered(version.edges)}
+
+
+def _copy(diagram: Dict) -> Dict:
+    """
+    Элементы версий разделяются между версиями, наружу отдается копия, чтобы правка на месте
+    не меняла историю
+    """
+
+    return {"nodes": [dict(node) for node in diagram["nodes"]], "edges": [dict(edge) for edge in diagram["edges"]]}
+
+
+def _ordered(elements: PersistentMap) -> List[Dict]:
+    return [element for _, (_, element) in sorted(elements.items(), key=lambda item: item[1][0])]
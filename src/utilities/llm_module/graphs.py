@@ -1,9 +1,16 @@
-from src.utilities.llm_module.call_functions import mistral_call, mistral_local_call
 from src.utilities.llm_module.states import generation
 import logging
+import threading
+from typing import Callable, Dict, Optional
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, START, END
 from src.utilities.llm_module.states import GenerationState
-from src.utilities.llm_module.agents import Verifier, Clarifier, X6Processor, Editor
+from src.utilities.llm_module.agents import Verifier, Clarifier, X6Processor, Editor, Repairer
+from src.utilities.llm_module.llm_constants import GENERATION_NUM_ITERATIONS
+from src.utilities.llm_module.patches import PatchError, apply_editor_response
+from src.utilities.llm_module.preclassifier import get_preclassifier, rejection_message
+from src.utilities.llm_module.routing import resolve_route
+from src.utilities.llm_module.validator import repair_diagram
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -15,11 +22,68 @@ if not logger.handlers:
     logger.addHandler(ch)
 
 
+EventCallback = Callable[[str, Dict], None]
+
+
+def _agent_kwargs(config: RunnableConfig, node: str) -> Dict:
+    """
+    Режим LLM приходит в ноды через config["configurable"] при вызове графа,
+    поэтому один скомпилированный граф обслуживает все запросы. Бэкенд и параметры генерации
+    агента берутся из таблицы маршрутов (см. routing.py), configurable["llm_call"] подменяет
+    бэкенд всех агентов (заглушки в тестах).
+    Если передан on_event, токены агента транслируются как события "token"
+    """
+
+    configurable = config.get("configurable", {})
+    on_event = configurable.get("on_event")
+    on_token = None
+    if on_event:
+        def on_token(text: str):
+            on_event("token", {"node": node, "text": text})
+    if configurable.get("llm_call"):
+        backend = {"llm_call": configurable["llm_call"], "local_model_cfg": configurable.get("local_model_cfg")}
+    else:
+        backend = resolve_route(node, configurable["mode"], configurable.get("local_model_cfg"))
+    return dict(backend, on_token=on_token)
+
+
+def _commit_validated(state: GenerationState, result: Dict, diagram, allow_empty: bool = False) -> None:
+    """
+    Диаграмма агента проходит детерминированную починку и уходит в историю версий,
+    в result остается номер версии, отчет валидатора - в agents_result["validator"].
+    allow_empty - правка редактора может удалить диаграмму целиком, это не ошибка
+    """
+
+    diagram, report = repair_diagram(diagram, allow_empty=allow_empty)
+    if report["fixed"]:
+        logger.info(f"Validator fixed: {report['fixed']}")
+    if report["unfixable"]:
+        logger.warning(f"Validator could not fix: {report['unfixable']}")
+    state["agents_result"].setdefault("validator", []).append({"flag": not report["unfixable"], "content": report})
+    result["version"] = state["bpmn"].commit(diagram)
+
+
+def _reject_patch(state: GenerationState, result: Dict, error: PatchError) -> None:
+    logger.warning(f"Patch rejected: {error}")
+    result["flag"] = False
+    result["version"] = state["bpmn"].head
+    state["agents_result"].setdefault("validator", []).append(
+        {"flag": False, "content": {"fixed": [], "unfixable": [f"edit operations could not be applied: {error}"]}})
+
+
+def _emit(config: RunnableConfig, event: str, data: Dict) -> None:
+    on_event = config.get("configurable", {}).get("on_event")
+    if on_event:
+        on_event(event, data)
+
+
 class GenerationGraph:
 
     def __init__(self, mode="local", local_model_cfg: dict = None):
         """
         В графе используются состояния с фикс. схемой (см. states.py)
+        Граф компилируется один раз при создании, ноды не хранят состояние запроса,
+        так что объект можно переиспользовать (см. get_generation_graph)
         """
 
         self.graph = StateGraph(GenerationState)
@@ -29,6 +93,7 @@ class GenerationGraph:
                 "Local model configuration is required when mode is set to 'local'")
         self.local_model_cfg = local_model_cfg
         self._build_graph()
+        self.compiled = self.compile()
 
     def _build_graph(self):
         """
@@ -40,6 +105,7 @@ class GenerationGraph:
         self.graph.add_node("x6processor", self.x6processor_node)
         self.graph.add_node("editor", self.editor_node)
         self.graph.add_node("bpmn_condition", self.bpmn_condition_node)
+        self.graph.add_node("repairer", self.repairer_node)
 
         self.graph.add_conditional_edges(START, self.entry_condition,
                                          {
@@ -48,8 +114,11 @@ class GenerationGraph:
                                              "bpmn_condition": "bpmn_condition"
                                          })
 
-        self.graph.add_edge("x6processor", END)
-        self.graph.add_edge("editor", END)
+        for node in ["x6processor", "editor", "repairer"]:
+            self.graph.add_conditional_edges(node, self.validation_condition, {
+                "repairer": "repairer",
+                END: END
+            })
 
         self.graph.add_conditional_edges("verifier", self.verifier_condition,
                                          {
@@ -67,21 +136,30 @@ class GenerationGraph:
             "x6processor": "x6processor"
         })
 
-    def __call__(self, state: GenerationState) -> GenerationState:
+    def __call__(self, state: GenerationState, on_event: Optional[EventCallback] = None) -> GenerationState:
         """
         __call__ - Дандер, который позволяет использовать объект класса как функцию
         Пример:
             generator = GenerationGraph()
             state = generation("Сделай мне диаграмму BPMN для процесса найма сотрудников")
             state = generator(state)
+        on_event(event, data) - опциональный колбэк прогресса: события "node" (старт/конец ноды)
+        и "token" (инкрементальные токены агента), вызывается из потока генерации
         """
 
         logger.info(f"Processing state: {state}")
-        graph = self.compile()
-        state = graph.invoke(state)
+        state = self.compiled.invoke(state, config=self.invocation_config(on_event))
         logger.info(f"State after processing: {state}")
         return state
 
+    def invocation_config(self, on_event: Optional[EventCallback] = None) -> RunnableConfig:
+        """
+        Конфиг вызова графа, через него нодам передается режим LLM и колбэк событий
+        """
+
+        local_model_cfg = self.local_model_cfg if self.mode == "local" else None
+        return {"configurable": {"mode": self.mode, "local_model_cfg": local_model_cfg, "on_event": on_event}}
+
     def compile(self):
         """
         Для использования граф надо скомпилировать, это не занимает времени почти
@@ -116,7 +194,8 @@ class GenerationGraph:
         logger.info(f"Entry condition met for {last}")
         return last
 
-    def verifier_node(self, state: GenerationState):
+    @staticmethod
+    def verifier_node(state: GenerationState, config: RunnableConfig):
         """
         Нода верификации блочит запросы, не связанные с bpmn. Скорее всего, я потом verifier ноду просто
         началом сделаю или сделаю отдельную ноду, с отдельным агентом (промптом), который будет верифицировать,
@@ -127,16 +206,24 @@ class GenerationGraph:
         """
 
         state["last"].append(["generator", "verifier"])
+        _emit(config, "node", {"node": "verifier", "status": "start"})
         logger.info("Verifier agent is processing")
-        llm_call = mistral_local_call if self.mode == "local" else mistral_call
-        if self.local_model_cfg and llm_call == mistral_local_call:
-            local_model_cfg = self.local_model_cfg
+        user_input = state["user_input"][-1]
+        classifier = get_preclassifier()
+        decision, source = classifier.classify(user_input) if classifier else (None, "llm")
+        if decision is not None:
+            # уверенный случай решается правилами/моделью без генерации
+            logger.info(f"Verifier short-circuited by {source}: {decision}")
+            state["agents_result"]["verifier"].append(
+                {"flag": decision, "content": "nothing" if decision else rejection_message(user_input)})
         else:
-            local_model_cfg = None
-        verifier = Verifier(
-            context=state["context"], llm_call=llm_call, local_model_cfg=local_model_cfg)
-        state = verifier(state)
+            verifier = Verifier(context=state["context"], **_agent_kwargs(config, "verifier"))
+            state = verifier(state)
+            # ответ из кеша - уже записанное решение, повтор раздул бы счетчики модели
+            if classifier and not verifier.cache_hit:
+                classifier.record(user_input, bool(state["agents_result"]["verifier"][-1]["flag"]))
         logger.info("Verifier agent process ended")
+        _emit(config, "node", {"node": "verifier", "status": "end"})
         return state
 
     @staticmethod
@@ -150,7 +237,8 @@ class GenerationGraph:
             return "clarifier"
         return END
 
-    def clarifier_node(self, state: GenerationState):
+    @staticmethod
+    def clarifier_node(state: GenerationState, config: RunnableConfig):
         """
         Нода кларификации формирует обратную связь от LLM к юзеру
         Пример:
@@ -162,21 +250,18 @@ class GenerationGraph:
         """
 
         state["last"].append(["generator", "clarifier"])
+        _emit(config, "node", {"node": "clarifier", "status": "start"})
         logger.info("Clarifier agent is processing")
         if state["clarification_num_iterations"] <= 0:
             state["await_user_input"] = False
+            _emit(config, "node", {"node": "clarifier", "status": "end"})
             return state
-        llm_call = mistral_local_call if self.mode == "local" else mistral_call
-        if self.local_model_cfg and llm_call == mistral_local_call:
-            local_model_cfg = self.local_model_cfg
-        else:
-            local_model_cfg = None
-        clarifier = Clarifier(
-            context=state["context"], llm_call=llm_call, local_model_cfg=local_model_cfg)
+        clarifier = Clarifier(context=state["context"], **_agent_kwargs(config, "clarifier"))
         state = clarifier(state)
         state["clarification_num_iterations"] -= 1
         state["await_user_input"] = True
         logger.info("Clarifier agent process ended")
+        _emit(config, "node", {"node": "clarifier", "status": "end"})
         return state
 
     @staticmethod
@@ -193,7 +278,8 @@ class GenerationGraph:
             logger.info("Clarification iterations ended")
             return "bpmn_condition"
 
-    def x6processor_node(self, state: GenerationState):
+    @staticmethod
+    def x6processor_node(state: GenerationState, config: RunnableConfig):
         """
         Нода генерации графа, отличается от editor:
         во-первых, промптом
@@ -201,21 +287,21 @@ class GenerationGraph:
         """
 
         state["last"].append(["generator", "x6processor"])
+        # у каждой генерации свои попытки починки, исчерпанные прошлым ходом не переходят
+        state["generation_num_iterations"] = GENERATION_NUM_ITERATIONS
+        _emit(config, "node", {"node": "x6processor", "status": "start"})
         logger.info("X6Processor agent is processing")
-        llm_call = mistral_local_call if self.mode == "local" else mistral_call
-        if self.local_model_cfg and llm_call == mistral_local_call:
-            local_model_cfg = self.local_model_cfg
-        else:
-            local_model_cfg = None
-        x6processor = X6Processor(
-            context=state["context"], llm_call=llm_call, local_model_cfg=local_model_cfg)
+        x6processor = X6Processor(context=state["context"], **_agent_kwargs(config, "x6processor"))
         state = x6processor(state)
-        state["bpmn"].append(state["agents_result"]
-                             ["x6processor"][-1]["content"])
+        # диаграмма уходит в историю версий, в результате агента остается ссылка на версию
+        result = state["agents_result"]["x6processor"][-1]
+        _commit_validated(state, result, result.pop("content"))
         logger.info("X6Processor agent process ended")
+        _emit(config, "node", {"node": "x6processor", "status": "end"})
         return state
 
-    def editor_node(self, state: GenerationState):
+    @staticmethod
+    def editor_node(state: GenerationState, config: RunnableConfig):
         """
         Нода редакции графа. Обе ноды (x6processor, editor) работают
         только со структурой графа, т.е. существованием нод и их связями,
@@ -223,19 +309,62 @@ class GenerationGraph:
         """
 
         state["last"].append(["generator", "editor"])
+        # у каждой генерации свои попытки починки, исчерпанные прошлым ходом не переходят
+        state["generation_num_iterations"] = GENERATION_NUM_ITERATIONS
+        _emit(config, "node", {"node": "editor", "status": "start"})
         logger.info("Editor agent is processing")
-        llm_call = mistral_local_call if self.mode == "local" else mistral_call
-        if self.local_model_cfg and llm_call == mistral_local_call:
-            local_model_cfg = self.local_model_cfg
-        else:
-            local_model_cfg = None
-        editor = Editor(
-            context=state["context"], llm_call=llm_call, local_model_cfg=local_model_cfg)
+        editor = Editor(context=state["context"], **_agent_kwargs(config, "editor"))
         state = editor(state)
-        state["bpmn"].append(state["agents_result"]["editor"][-1]["content"])
+        # редактор отвечает операциями, диаграмма собирается применением патча к последней версии
+        result = state["agents_result"]["editor"][-1]
+        response = result.pop("content")
+        result["ops"] = response.get("ops", [])
+        try:
+            _commit_validated(state, result, apply_editor_response(state["bpmn"].view(), response),
+                              allow_empty=True)
+        except PatchError as e:
+            _reject_patch(state, result, e)
         logger.info("Editor agent process ended")
+        _emit(config, "node", {"node": "editor", "status": "end"})
         return state
 
+    @staticmethod
+    def repairer_node(state: GenerationState, config: RunnableConfig):
+        """
+        Точечная LLM-починка того, что не исправил валидатор: агенту уходят диаграмма и список проблем,
+        он отвечает операциями правки. Итоговая версия записывается в результат x6processor/editor,
+        поэтому наружу уходит уже исправленная диаграмма. Попыток - generation_num_iterations
+        """
+
+        _emit(config, "node", {"node": "repairer", "status": "start"})
+        logger.info("Repairer agent is processing")
+        state["generation_num_iterations"] -= 1
+        repairer = Repairer(context=state["context"], **_agent_kwargs(config, "repairer"))
+        state = repairer(state)
+        response = state["agents_result"]["repairer"][-1].pop("content")
+        target = state["agents_result"][state["last"][-1][1]][-1]
+        try:
+            _commit_validated(state, target, apply_editor_response(state["bpmn"].view(), response),
+                              allow_empty=state["last"][-1][1] == "editor")
+        except PatchError as e:
+            _reject_patch(state, target, e)
+        logger.info("Repairer agent process ended")
+        _emit(config, "node", {"node": "repairer", "status": "end"})
+        return state
+
+    @staticmethod
+    def validation_condition(state: GenerationState) -> str:
+        """
+        После x6processor/editor/repairer: если валидатор нашел неисправимое и попытки есть - в repairer
+        """
+
+        if state["agents_result"]["validator"][-1]["flag"]:
+            return END
+        if state["generation_num_iterations"] <= 0:
+            logger.warning("Repair iterations ended, returning diagram as is")
+            return END
+        return "repairer"
+
     @staticmethod
     def bpmn_condition_node(state: GenerationState):
         """
@@ -254,19 +383,49 @@ class GenerationGraph:
         """
 
         logger.info("Generation agent check")
-        if state["bpmn"][-1] != {"nodes": [], "edges": []}:
+        if not state["bpmn"].is_empty():
             logger.info("BPMN is present")
             return "editor"
         logger.info("BPMN is not present")
         return "x6processor"
 
 
+_GRAPH_CACHE: Dict[tuple, GenerationGraph] = {}
+_GRAPH_CACHE_LOCK = threading.Lock()
+
+
+def _model_cfg_key(local_model_cfg: Optional[Dict]) -> tuple:
+    """
+    Объекты модели/токенайзера не хешируются, поэтому ключ - их идентичность
+    """
+
+    if not local_model_cfg:
+        return ()
+    return tuple(sorted((key, id(value)) for key, value in local_model_cfg.items()))
+
+
+def get_generation_graph(mode: str = "local", local_model_cfg: dict = None) -> GenerationGraph:
+    """
+    Скомпилированный граф на процесс, кешируется по (mode, конфиг модели)
+    """
+
+    key = (mode, _model_cfg_key(local_model_cfg))
+    graph = _GRAPH_CACHE.get(key)
+    if graph is None:
+        with _GRAPH_CACHE_LOCK:
+            graph = _GRAPH_CACHE.get(key)
+            if graph is None:
+                graph = GenerationGraph(mode=mode, local_model_cfg=local_model_cfg)
+                _GRAPH_CACHE[key] = graph
+    return graph
+
+
 def test(user_input: str, mode: str, local_model_cfg=None, state: GenerationState = None) -> GenerationState:
     """
     Пример использования графа
     """
 
-    generator = GenerationGraph(mode=mode, local_model_cfg=local_model_cfg)
+    generator = get_generation_graph(mode=mode, local_model_cfg=local_model_cfg)
     if state:
         state["user_input"].append(user_input)
     else:
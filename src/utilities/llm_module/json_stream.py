@@ -0,0 +1,139 @@
+import json
+from typing import Dict, List, Optional
+
+_CLOSERS = {"{": "}", "[": "]"}
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+class JsonStreamExtractor:
+    """
+    Инкрементальный поиск первого сбалансированного JSON объекта в потоке токенов модели.
+    Все до первой "{" (```json, приветствия и т.п.) пропускается, все после закрывающей "}" игнорируется.
+    feed возвращает True, как только объект закрылся - генерацию можно останавливать.
+
+    Пример:
+        extractor = JsonStreamExtractor()
+        for token in stream:
+            if extractor.feed(token):
+                break
+        data = extractor.result()
+    """
+
+    def __init__(self):
+        self._chars: List[str] = []
+        self._stack: List[str] = []
+        self._quote: Optional[str] = None
+        self._escape = False
+        self.closed = False
+
+    @property
+    def started(self) -> bool:
+        return bool(self._chars)
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chars)
+
+    def feed(self, chunk: str) -> bool:
+        if self.closed:
+            return True
+        for ch in chunk:
+            if not self._chars:
+                if ch != "{":
+                    continue
+            self._chars.append(ch)
+            if self._quote:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == self._quote:
+                    self._quote = None
+            elif ch in ("\"", "'"):
+                self._quote = ch
+            elif ch in _CLOSERS:
+                self._stack.append(_CLOSERS[ch])
+            elif ch in ("}", "]") and self._stack:
+                if self._stack[-1] == ch:
+                    self._stack.pop()
+                if not self._stack:
+                    self.closed = True
+                    return True
+        return False
+
+    def result(self) -> Dict:
+        """
+        Разбор накопленного объекта с починкой типичных дефектов.
+        Если поток оборвался (max_new_tokens), незакрытые строки и скобки дописываются
+        """
+
+        if not self._chars:
+            raise json.JSONDecodeError("No JSON object found", "", 0)
+        text = self.text
+        if not self.closed:
+            if self._quote:
+                text += self._quote
+            text += "".join(reversed(self._stack))
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            data = json.loads(repair_json(text))
+        if not isinstance(data, dict):
+            raise ValueError("Response is not a JSON object")
+        return data
+
+
+def repair_json(text: str) -> str:
+    """
+    Починка типичных ошибок LLM вне строк: одинарные кавычки, висячие запятые, True/False/None
+    """
+
+    out = []
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if ch in ("\"", "'"):
+            j = i + 1
+            chars = []
+            while j < n and text[j] != ch:
+                if text[j] == "\\" and j + 1 < n:
+                    chars.append(text[j:j + 2])
+                    j += 2
+                    continue
+                # внутри одинарных кавычек двойные нужно экранировать
+                chars.append("\\\"" if text[j] == "\"" else text[j])
+                j += 1
+            body = "".join(chars)
+            if ch == "'":
+                body = body.replace("\\'", "'")
+            out.append(f"\"{body}\"")
+            i = j + 1
+            continue
+        if ch.isalpha():
+            j = i
+            while j < n and text[j].isalpha():
+                j += 1
+            word = text[i:j]
+            out.append(_PY_LITERALS.get(word, word))
+            i = j
+            continue
+        if ch == ",":
+            j = i + 1
+            while j < n and text[j].isspace():
+                j += 1
+            if j < n and text[j] in "}]":
+                i += 1
+                continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def extract_json(raw: str) -> Dict:
+    """
+    Первый JSON объект из полного ответа модели
+    """
+
+    extractor = JsonStreamExtractor()
+    extractor.feed(raw)
+    return extractor.result()
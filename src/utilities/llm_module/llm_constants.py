@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -122,107 +123,80 @@ system_editing_prompt = """
 You are an assistant who updates BPMN diagrams based on user requests.
 
 You will receive:
-1. A BPMN diagram in JSON format with `nodes` and `edges`.
+1. The current BPMN diagram in JSON format with `nodes` and `edges`.
 2. A user request in natural language.
 
-Your job is to return the **updated diagram** in JSON format that reflects the requested change.
+Your job is to return the **list of edit operations** that turn the current diagram into the requested one.
+Do NOT repeat the whole diagram - only the changes.
 
 ✅ Output format:
+{"ops": [operation, ...]}
+
+Allowed operations:
+- {"op": "add_node", "id": new unique integer id, "shape": "event" | "activity" | "gateway", "label": "..."}
+- {"op": "remove_node", "id": id} - incident edges are removed automatically
+- {"op": "relabel", "id": id, "label": "new label"}
+- {"op": "add_edge", "source": id, "target": id}
+- {"op": "remove_edge", "source": id, "target": id}
+
+Rules:
 - JSON only (no explanations, no markdown)
-- Only allowed shapes: ["event", "activity", "gateway"]
+- Use only ids that exist in the current diagram or were added earlier in the same list
+- New node ids must be greater than every existing id
 - All node labels must match the language of the user's request.
-- Maintain logical correctness of the diagram.
-- Node IDs must remain unique and increment consistently.
+- Maintain logical correctness of the diagram: a new node must be connected.
 
 ⛔ Never:
 - Add text outside the JSON
 - Use invalid JSON
-- Add unconnected nodes
+- Return the full diagram
 - Mix languages in labels
 
 ---
 
-✅ GOOD EXAMPLE 1  
-Input Diagram:
-{
-  "nodes": [
-    {"id": 1, "shape": "activity", "label": "Заполнение анкеты"},
-    {"id": 2, "shape": "activity", "label": "Проверка заявки"},
-    {"id": 3, "shape": "gateway", "label": "Одобрено?"}
-  ],
-  "edges": [
-    {"source": 1, "target": 2},
-    {"source": 2, "target": 3}
-  ]
-}
+✅ GOOD EXAMPLE 1
+Current diagram:
+{"nodes":[{"id":1,"shape":"activity","label":"Заполнение анкеты"},{"id":2,"shape":"activity","label":"Проверка заявки"},{"id":3,"shape":"gateway","label":"Одобрено?"}],"edges":[{"source":1,"target":2},{"source":2,"target":3}]}
 
-User Request: Добавь задачу "Верификация логистики" между "Проверка заявки" и "Одобрено?".
+User request: Добавь задачу "Верификация логистики" между "Проверка заявки" и "Одобрено?".
 
 Output:
-{
-  "nodes": [
-    {"id": 1, "shape": "activity", "label": "Заполнение анкеты"},
-    {"id": 2, "shape": "activity", "label": "Проверка заявки"},
-    {"id": 4, "shape": "activity", "label": "Верификация логистики"},
-    {"id": 3, "shape": "gateway", "label": "Одобрено?"}
-  ],
-  "edges": [
-    {"source": 1, "target": 2},
-    {"source": 2, "target": 4},
-    {"source": 4, "target": 3}
-  ]
-}
+{"ops": [
+  {"op": "add_node", "id": 4, "shape": "activity", "label": "Верификация логистики"},
+  {"op": "remove_edge", "source": 2, "target": 3},
+  {"op": "add_edge", "source": 2, "target": 4},
+  {"op": "add_edge", "source": 4, "target": 3}
+]}
 
 ---
 
-❌ BAD EXAMPLE 1  
-User Request: Добавь задачу "Логистика"
+✅ GOOD EXAMPLE 2
+Current diagram:
+{"nodes":[{"id":1,"shape":"event","label":"Получение информации"},{"id":2,"shape":"activity","label":"Проверка заявки"},{"id":3,"shape":"event","label":"Завершение"}],"edges":[{"source":1,"target":2},{"source":2,"target":3}]}
 
-Output:
-{
-  "nodes": [
-    {"id": 5, "shape": "activity", "label": "Логистика"}
-  ],
-  "edges": []
-}
+User request: Удали задачу "Проверка заявки" и переименуй "Завершение" в "Конец".
 
-Why it's bad:
-- Node is not connected to anything.
-- Original diagram is missing.
-- Output is not a valid update.
+Output:
+{"ops": [
+  {"op": "remove_node", "id": 2},
+  {"op": "add_edge", "source": 1, "target": 3},
+  {"op": "relabel", "id": 3, "label": "Конец"}
+]}
 
 ---
 
-✅ GOOD EXAMPLE 2  
+❌ BAD EXAMPLE
+User request: Добавь задачу "Логистика"
 
-Input:
-{
-  "nodes": [
-    {"id": 1, "shape": "event", "label": "Получение информации"},
-    {"id": 2, "shape": "activity", "label": "Проверка заявки"},
-    {"id": 3, "shape": "gateway", "label": "Одобрено?"}
-  ],
-  "edges": [
-    {"source": 1, "target": 2},
-    {"source": 1, "target": 3}
-  ]
-}
-
-User Request: Удали задачу "Проверка заявки".
 Output:
-{
-  "nodes": [
-    {"id": 1, "shape": "event", "label": "Получение информации"},
-    {"id": 3, "shape": "end", "label": "Завершение"}
-  ],
-  "edges": [
-    {"source": 1, "target": 3}
-  ]
-}
+{"ops": [{"op": "add_node", "id": 5, "shape": "activity", "label": "Логистика"}]}
+
+Why it's bad:
+- Node is not connected to anything.
 
 ---
 
-Make sure your output is always a single, valid, and updated JSON object.
+Make sure your output is always a single valid JSON object with the "ops" list.
 Labels in diagram should be in language has
 """
 
@@ -233,6 +207,78 @@ PROMPTS = {
     "x6processing": system_x6processing_prompt,
     "editing": system_editing_prompt
 }
+BPMN_SHAPES = ["event", "activity", "gateway"]
+
+
+def _edit_op(op: str, **properties) -> dict:
+    return {"type": "object", "properties": {"op": {"type": "string", "enum": [op]}, **properties}}
+
+
+# операции редактора (см. patches.py), вариант объекта выбирается по значению "op"
+EDIT_OP_SCHEMA = {
+    "type": "object",
+    "properties": {"op": {"type": "string", "enum": ["add_node", "remove_node", "relabel", "add_edge", "remove_edge"]}},
+    "variants": {
+        "add_node": _edit_op("add_node", id={"type": "integer"}, shape={"type": "string", "enum": BPMN_SHAPES},
+                             label={"type": "string"}),
+        "remove_node": _edit_op("remove_node", id={"type": "integer"}),
+        "relabel": _edit_op("relabel", id={"type": "integer"}, label={"type": "string"}),
+        "add_edge": _edit_op("add_edge", source={"type": "integer"}, target={"type": "integer"}),
+        "remove_edge": _edit_op("remove_edge", source={"type": "integer"}, target={"type": "integer"}),
+    }
+}
+# JSON схемы ответов агентов для constrained decoding локальной модели (см. constrained.py)
+AGENT_SCHEMAS = {
+    "verifier": {
+        "type": "object",
+        "properties": {
+            "is_bpmn_request": {"type": "boolean"},
+            "content": {"type": "string"}
+        }
+    },
+    "clarifier": {
+        "type": "object",
+        "properties": {
+            "await_user_input": {"type": "boolean"},
+            "content": {"type": "string"}
+        }
+    },
+    "x6processor": {
+        "type": "object",
+        "properties": {
+            "nodes": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "integer"},
+                        "shape": {"type": "string", "enum": BPMN_SHAPES},
+                        "label": {"type": "string"}
+                    }
+                }
+            },
+            "edges": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "source": {"type": "integer"},
+                        "target": {"type": "integer"}
+                    }
+                }
+            }
+        }
+    }
+}
+AGENT_SCHEMAS["editor"] = {
+    "type": "object",
+    "properties": {
+        "ops": {"type": "array", "items": EDIT_OP_SCHEMA}
+    }
+}
+AGENT_SCHEMAS["repairer"] = AGENT_SCHEMAS["editor"]
+LOCAL_CONSTRAINED_DECODING = os.getenv("LOCAL_CONSTRAINED_DECODING", "False").lower() in ("1", "true", "yes")
+
 CLARIFICATION_NUM_ITERATIONS = 1
 GENERATION_NUM_ITERATIONS = 2
 
@@ -243,7 +289,88 @@ mistral_local_model = os.getenv("MISTRAL_LOCAL_MODEL")
 
 MODELS = {
     "mistral_api": mistral_api_model,
-    "mistral_local": mistral_local_model
+    "mistral_local": mistral_local_model or "solidrust/Nous-Hermes-2-Mistral-7B-DPO-AWQ",
+    "tiny_local": os.getenv("TINY_LOCAL_MODEL") or None
+}
+
+# local - модель в процессе воркера (или в model-server, если задан MODEL_SERVER_ADDRESS), api - Mistral API
+LLM_MODE = os.getenv("LLM_MODE", "api")
+# маршрутизация агентов по бэкендам (см. routing.py): backend - local | tiny | api, None - режим графа (LLM_MODE),
+# model - имя модели Mistral API для backend=api. AGENT_ROUTES (JSON {роль: {поле: значение}}) переопределяет поля,
+# например AGENT_ROUTES={"verifier": {"backend": "tiny"}, "clarifier": {"backend": "api", "model": "mistral-small-latest"}}
+AGENT_ROUTES = {
+    "verifier": {"backend": None, "model": None, "max_new_tokens": 128, "temperature": 0.3, "stop": []},
+    "clarifier": {"backend": None, "model": None, "max_new_tokens": 256, "temperature": 0.7, "stop": []},
+    "x6processor": {"backend": None, "model": None, "max_new_tokens": 1024, "temperature": 0.7, "stop": []},
+    "editor": {"backend": None, "model": None, "max_new_tokens": 512, "temperature": 0.7, "stop": []},
+    "repairer": {"backend": None, "model": None, "max_new_tokens": 512, "temperature": 0.3, "stop": []},
+}
+for _role, _route in json.loads(os.getenv("AGENT_ROUTES") or "{}").items():
+    AGENT_ROUTES.setdefault(_role, dict(AGENT_ROUTES["x6processor"])).update(_route)
+# какие события общего журнала диалога видит каждый агент (см. context_log.py): x6processor нужны
+# уточняющие вопросы clarifier, редактору и ремонтнику - только правки, текущая диаграмма есть в запросе
+AGENT_VIEWS = {
+    "verifier": ["verifier"],
+    "clarifier": ["clarifier"],
+    "x6processor": ["clarifier", "x6processor"],
+    "editor": ["editor", "repairer"],
+    "repairer": ["editor", "repairer"],
+}
+# бюджет токенов истории диалога на агента без системного промпта (см. context_manager.py),
+# CONTEXT_BUDGETS (JSON {роль: токены}) переопределяет значения
+CONTEXT_CFG = {
+    "budgets": {"verifier": 1024, "clarifier": 2048, "x6processor": 4096, "editor": 4096, "repairer": 4096,
+                **json.loads(os.getenv("CONTEXT_BUDGETS") or "{}")},
+    "summary_chars": int(os.getenv("CONTEXT_SUMMARY_CHARS", 200)),
+}
+# continuous batching вызовов локальной модели из разных сессий (см. batching.py)
+LOCAL_BATCHING_CFG = {
+    "enabled": os.getenv("LOCAL_BATCHING", "False").lower() in ("1", "true", "yes"),
+    "max_batch_size": int(os.getenv("LOCAL_BATCH_MAX_SIZE", 8)),
+    "max_wait_ms": float(os.getenv("LOCAL_BATCH_MAX_WAIT_MS", 10)),
+}
+# бюджет памяти под KV-кеш общих префиксов промпта в МБ, 0 - выключено (см. prefix_cache.py)
+LOCAL_PREFIX_CACHE_MB = int(os.getenv("LOCAL_PREFIX_CACHE_MB", 0))
+# unix-сокет общего процесса с моделями (python -m src.utilities.services.model_server)
+MODEL_SERVER_ADDRESS = os.getenv("MODEL_SERVER_ADDRESS") or None
+# общий секрет сервера и воркеров: по сокету ходят pickle-объекты, поэтому без ключа сервер не стартует
+MODEL_SERVER_AUTHKEY = os.getenv("MODEL_SERVER_AUTHKEY", "").encode() or None
+
+# пул соединений, повторы и предохранитель клиента API (см. mistral_client.py)
+MISTRAL_CLIENT_CFG = {
+    "model": mistral_api_model,
+    "server_url": os.getenv("MISTRAL_SERVER_URL") or None,
+    "timeout": float(os.getenv("MISTRAL_TIMEOUT", 60)),
+    "max_connections": int(os.getenv("MISTRAL_MAX_CONNECTIONS", 20)),
+    "max_attempts": int(os.getenv("MISTRAL_MAX_ATTEMPTS", 4)),
+    "backoff_base": float(os.getenv("MISTRAL_BACKOFF_BASE", 0.5)),
+    "backoff_max": float(os.getenv("MISTRAL_BACKOFF_MAX", 8)),
+    "deadline": float(os.getenv("MISTRAL_DEADLINE", 90)),
+    "breaker_threshold": int(os.getenv("MISTRAL_BREAKER_THRESHOLD", 5)),
+    "breaker_reset": float(os.getenv("MISTRAL_BREAKER_RESET", 30)),
+}
+
+# кеш ответов verifier/clarifier (см. response_cache.py), RESPONSE_CACHE_DB_PATH - второй уровень на диске
+RESPONSE_CACHE_CFG = {
+    "enabled": os.getenv("RESPONSE_CACHE", "True").lower() in ("1", "true", "yes"),
+    "max_size": int(os.getenv("RESPONSE_CACHE_MAX_SIZE", 2048)),
+    "ttl": float(os.getenv("RESPONSE_CACHE_TTL", 86400)),
+    "path": os.getenv("RESPONSE_CACHE_DB_PATH") or None,
+}
+
+# пре-классификатор перед verifier (см. preclassifier.py): модель включается, когда в журнале
+# решений LLM набирается PRECLASSIFIER_MIN_SAMPLES примеров каждого класса.
+# PRECLASSIFIER_THRESHOLD - порог сигмоиды среднего по n-граммам отношения правдоподобий, выше которого
+# запрос отклоняется без LLM (почти дословные повторы отклоненных ~0.75, незнакомые запросы ~0.5-0.6)
+PRECLASSIFIER_CFG = {
+    "enabled": os.getenv("PRECLASSIFIER", "True").lower() in ("1", "true", "yes"),
+    "threshold": float(os.getenv("PRECLASSIFIER_THRESHOLD", 0.75)),
+    "min_samples": int(os.getenv("PRECLASSIFIER_MIN_SAMPLES", 50)),
+    "log_path": os.getenv("PRECLASSIFIER_LOG_PATH") or None,
+}
+PRECLASSIFIER_REJECTIONS = {
+    "ru": "Я умею строить только BPMN диаграммы 🙂 Опишите процесс, который нужно отобразить!",
+    "en": "I can only build BPMN diagrams 🙂 Describe a process you want to see!",
 }
 
 X6_CANVAS_SHAPE = [800, 450]
@@ -0,0 +1,238 @@
+import asyncio
+import random
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, List, Optional
+
+import httpx
+from mistralai import Mistral
+from mistralai.models import SDKError
+
+from src.utilities.debug.logger import setup_logger
+from src.utilities.llm_module.llm_constants import MISTRAL_API_KEY, MISTRAL_CLIENT_CFG
+
+logger = setup_logger("MistralClient")
+
+
+class MistralUnavailableError(RuntimeError):
+    """
+    API Mistral не ответило за отведенный бюджет попыток/времени
+    """
+
+
+class CircuitOpenError(MistralUnavailableError):
+    """
+    Предохранитель разомкнут: API недавно падало, запрос отклонен без обращения к сети
+    """
+
+
+class CircuitBreaker:
+    """
+    Классический предохранитель:
+    * closed - запросы идут, считаем подряд идущие ошибки
+    * open - после failure_threshold ошибок подряд все запросы сразу отклоняются на reset_timeout секунд
+    * half-open - по истечении reset_timeout пропускаем один пробный запрос,
+      успех замыкает предохранитель, ошибка снова размыкает
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probe_in_flight:
+                raise CircuitOpenError("Mistral API circuit is open")
+            self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probe_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"Mistral API circuit opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+class RetryPolicy:
+    """
+    Экспоненциальная задержка с full jitter: sleep = uniform(0, min(max_delay, base_delay * 2 ** attempt)),
+    ограничение и по числу попыток, и по общему времени (deadline) на вызов
+    """
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5,
+                 max_delay: float = 8.0, deadline: float = 60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    Повторяем только то, что может пройти со второго раза: сетевые ошибки, таймауты, 429 и 5xx.
+    Остальные 4xx (невалидный ключ, запрос) повторять бессмысленно
+    """
+
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, SDKError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+class MistralClient:
+    """
+    Общий на процесс клиент Mistral с пулом соединений (sync и async httpx клиенты),
+    повторами с backoff и предохранителем
+    """
+
+    def __init__(self, api_key: Optional[str], model: str, server_url: Optional[str] = None,
+                 timeout: float = 60.0, max_connections: int = 20,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None):
+        self.model = model
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        limits = httpx.Limits(max_connections=max_connections,
+                              max_keepalive_connections=max_connections)
+        self.client = Mistral(
+            api_key=api_key,
+            server_url=server_url,
+            client=httpx.Client(limits=limits, timeout=timeout),
+            async_client=httpx.AsyncClient(limits=limits, timeout=timeout),
+        )
+
+    def _timeout_ms(self, started: float) -> int:
+        remaining = self.retry_policy.deadline - (time.monotonic() - started)
+        return max(1, int(min(self.timeout, remaining) * 1000))
+
+    def _next_delay(self, attempt: int, started: float, error: Exception) -> float:
+        """
+        Задержка перед следующей попыткой, исключение если бюджет исчерпан
+        """
+
+        if not _is_retryable(error):
+            raise error
+        if attempt + 1 >= self.retry_policy.max_attempts:
+            raise MistralUnavailableError(
+                f"Mistral API failed after {attempt + 1} attempts: {error}") from error
+        delay = self.retry_policy.delay(attempt)
+        if time.monotonic() - started + delay >= self.retry_policy.deadline:
+            raise MistralUnavailableError(
+                f"Mistral API deadline of {self.retry_policy.deadline}s exceeded: {error}") from error
+        logger.warning(f"Mistral API call failed (attempt {attempt + 1}), retry in {delay:.2f}s: {error}")
+        return delay
+
+    def _record_error(self, error: Exception) -> None:
+        # невалидный запрос (4xx) значит, что API доступно, предохранитель не трогаем
+        if _is_retryable(error):
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
+    def complete(self, messages: List, **params) -> str:
+        started = time.monotonic()
+        params.setdefault("model", self.model)
+        for attempt in range(self.retry_policy.max_attempts):
+            self.circuit_breaker.before_call()
+            try:
+                response = self.client.chat.complete(
+                    messages=messages, timeout_ms=self._timeout_ms(started), **params)
+            except Exception as e:
+                self._record_error(e)
+                time.sleep(self._next_delay(attempt, started, e))
+                continue
+            self.circuit_breaker.record_success()
+            return response.choices[0].message.content
+
+    def stream(self, messages: List, on_token: Optional[Callable[[str], None]] = None,
+               until: Optional[Callable[[str], bool]] = None, **params) -> str:
+        """
+        Стриминг ответа через on_token, возвращает полный текст.
+        until(chunk) -> True обрывает поток (закрываем соединение, API перестает генерировать).
+        Повторяем только до первого полученного токена, иначе клиент увидит дубли
+        """
+
+        started = time.monotonic()
+        params.setdefault("model", self.model)
+        for attempt in range(self.retry_policy.max_attempts):
+            self.circuit_breaker.before_call()
+            chunks = []
+            try:
+                with self.client.chat.stream(messages=messages, timeout_ms=self._timeout_ms(started),
+                                             **params) as events:
+                    for event in events:
+                        text = event.data.choices[0].delta.content
+                        if isinstance(text, str) and text:
+                            chunks.append(text)
+                            if on_token:
+                                on_token(text)
+                            if until and until(text):
+                                break
+            except Exception as e:
+                self._record_error(e)
+                if chunks:
+                    raise MistralUnavailableError(f"Mistral API stream interrupted: {e}") from e
+                time.sleep(self._next_delay(attempt, started, e))
+                continue
+            self.circuit_breaker.record_success()
+            return "".join(chunks)
+
+    async def complete_async(self, messages: List, **params) -> str:
+        started = time.monotonic()
+        params.setdefault("model", self.model)
+        for attempt in range(self.retry_policy.max_attempts):
+            self.circuit_breaker.before_call()
+            try:
+                response = await self.client.chat.complete_async(
+                    messages=messages, timeout_ms=self._timeout_ms(started), **params)
+            except Exception as e:
+                self._record_error(e)
+                await asyncio.sleep(self._next_delay(attempt, started, e))
+                continue
+            self.circuit_breaker.record_success()
+            return response.choices[0].message.content
+
+
+@lru_cache()
+def get_mistral_client() -> MistralClient:
+    cfg = MISTRAL_CLIENT_CFG
+    return MistralClient(
+        api_key=MISTRAL_API_KEY,
+        model=cfg["model"],
+        server_url=cfg["server_url"],
+        timeout=cfg["timeout"],
+        max_connections=cfg["max_connections"],
+        retry_policy=RetryPolicy(max_attempts=cfg["max_attempts"], base_delay=cfg["backoff_base"],
+                                 max_delay=cfg["backoff_max"], deadline=cfg["deadline"]),
+        circuit_breaker=CircuitBreaker(failure_threshold=cfg["breaker_threshold"],
+                                       reset_timeout=cfg["breaker_reset"]),
+    )
@@ -0,0 +1,92 @@
+from typing import Dict, List
+
+from src.utilities.llm_module.llm_constants import BPMN_SHAPES
+
+
+class PatchError(ValueError):
+    """
+    Операция правки не применима к текущей диаграмме (нет узла, дубликат, неизвестная операция)
+    """
+
+
+def apply_patch(diagram: Dict, ops: List[Dict]) -> Dict:
+    """
+    Применяет операции редактора к диаграмме {"nodes": [...], "edges": [...]} и возвращает новую диаграмму,
+    исходная не меняется. Патч атомарный: при первой невалидной операции бросается PatchError.
+
+    Операции:
+    * {"op": "add_node", "id": 5, "shape": "activity", "label": "..."} - id можно не указывать, тогда max + 1
+    * {"op": "remove_node", "id": 5} - вместе с инцидентными ребрами
+    * {"op": "relabel", "id": 5, "label": "..."}
+    * {"op": "add_edge", "source": 1, "target": 5}
+    * {"op": "remove_edge", "source": 1, "target": 5}
+    """
+
+    if not isinstance(ops, list):
+        raise PatchError("ops must be a list")
+    nodes = {str(node["id"]): dict(node) for node in diagram.get("nodes", [])}
+    edges = [dict(edge) for edge in diagram.get("edges", [])]
+
+    def edge_index(source: str, target: str) -> int:
+        for i, edge in enumerate(edges):
+            if str(edge["source"]) == source and str(edge["target"]) == target:
+                return i
+        return -1
+
+    for number, op in enumerate(ops):
+        if not isinstance(op, dict):
+            raise PatchError(f"op #{number} is not an object")
+        kind = op.get("op")
+        try:
+            if kind == "add_node":
+                node_id = op.get("id")
+                if node_id is None:
+                    node_id = max((int(key) for key in nodes if key.lstrip("-").isdigit()), default=0) + 1
+                if str(node_id) in nodes:
+                    raise PatchError(f"node {node_id} already exists")
+                shape = op.get("shape", "activity")
+                if shape not in BPMN_SHAPES:
+                    raise PatchError(f"unknown shape {shape!r}")
+                nodes[str(node_id)] = {"id": node_id, "shape": shape, "label": op.get("label", "")}
+            elif kind == "remove_node":
+                node_id = str(op["id"])
+                if node_id not in nodes:
+                    raise PatchError(f"node {node_id} not found")
+                del nodes[node_id]
+                edges = [edge for edge in edges if node_id not in (str(edge["source"]), str(edge["target"]))]
+            elif kind == "relabel":
+                node_id = str(op["id"])
+                if node_id not in nodes:
+                    raise PatchError(f"node {node_id} not found")
+                nodes[node_id]["label"] = op["label"]
+            elif kind == "add_edge":
+                source, target = str(op["source"]), str(op["target"])
+                for end in (source, target):
+                    if end not in nodes:
+                        raise PatchError(f"node {end} not found")
+                if edge_index(source, target) >= 0:
+                    raise PatchError(f"edge {source}->{target} already exists")
+                edges.append({"source": nodes[source]["id"], "target": nodes[target]["id"]})
+            elif kind == "remove_edge":
+                i = edge_index(str(op["source"]), str(op["target"]))
+                if i < 0:
+                    raise PatchError(f"edge {op['source']}->{op['target']} not found")
+                del edges[i]
+            else:
+                raise PatchError(f"unknown op {kind!r}")
+        except KeyError as e:
+            raise PatchError(f"op #{number} ({kind}) is missing {e.args[0]!r}")
+
+    return {"nodes": list(nodes.values()), "edges": edges}
+
+
+def apply_editor_response(diagram: Dict, response: Dict) -> Dict:
+    """
+    Ответ редактора - {"ops": [...]}; полная диаграмма {"nodes", "edges"} (старый формат) принимается как есть
+    """
+
+    if "ops" in response:
+        return apply_patch(diagram, response["ops"])
+    if "nodes" in response and "edges" in response:
+        return response
+    raise PatchError("editor response has neither ops nor a diagram")
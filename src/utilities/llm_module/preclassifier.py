@@ -0,0 +1,168 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+import langid
+
+from src.utilities.debug.logger import setup_logger
+from src.utilities.llm_module.llm_constants import PRECLASSIFIER_CFG, PRECLASSIFIER_REJECTIONS
+from src.utilities.llm_module.response_cache import normalize_text
+
+logger = setup_logger("PreClassifier")
+
+# явный запрос на BPMN/бизнес-процесс - LLM тут всегда отвечает true
+_ACCEPT_RULES = re.compile(
+    r"\bbpmn\b|\bбпмн\b|бизнес[- ]?процесс|business[- ]process|\bworkflow\b|блок[- ]?схем|flow[- ]?chart"
+    r"|(диаграмм|схем|модел)\w* (процесса|процедуры)|process (diagram|model|map)")
+# сообщение целиком из приветствий/благодарностей - точно не запрос диаграммы
+_SMALL_TALK = {
+    "привет", "здравствуй", "здравствуйте", "добрый день", "добрый вечер", "доброе утро", "спасибо", "пока",
+    "как дела", "кто ты", "ты кто", "hi", "hello", "hey", "thanks", "thank you", "bye", "how are you", "who are you",
+}
+
+
+class NgramNaiveBayes:
+    """
+    Мультиномиальный наивный байес по символьным n-граммам нормализованного текста.
+    Обучается онлайн, одно обновление - O(длина текста)
+    """
+
+    def __init__(self, n_min: int = 2, n_max: int = 4):
+        self.n_min = n_min
+        self.n_max = n_max
+        self.counts = {True: defaultdict(int), False: defaultdict(int)}
+        self.totals = {True: 0, False: 0}
+        self.docs = {True: 0, False: 0}
+        self.vocabulary = set()
+
+    def _ngrams(self, text: str):
+        text = f" {normalize_text(text)} "
+        for n in range(self.n_min, self.n_max + 1):
+            for i in range(len(text) - n + 1):
+                yield text[i:i + n]
+
+    def update(self, text: str, label: bool) -> None:
+        counts = self.counts[label]
+        for gram in self._ngrams(text):
+            counts[gram] += 1
+            self.totals[label] += 1
+            self.vocabulary.add(gram)
+        self.docs[label] += 1
+
+    def predict(self, text: str) -> Tuple[bool, float]:
+        """
+        :return: метка и уверенность - сигмоида среднего по n-граммам логарифма отношения правдоподобий.
+        Сумма по всем n-граммам (апостериорная вероятность наивного байеса) растет с длиной текста
+        и почти для любого запроса дает ~1.0, поэтому порог по ней ничего не отсекает
+        """
+
+        vocabulary = len(self.vocabulary) + 1
+        true_counts, true_denominator = self.counts[True], self.totals[True] + vocabulary
+        false_counts, false_denominator = self.counts[False], self.totals[False] + vocabulary
+        ratio, grams = 0.0, 0
+        for gram in self._ngrams(text):
+            ratio += math.log((true_counts.get(gram, 0) + 1) / true_denominator)
+            ratio -= math.log((false_counts.get(gram, 0) + 1) / false_denominator)
+            grams += 1
+        ratio /= max(grams, 1)
+        label = ratio >= 0
+        return label, 1 / (1 + math.exp(-abs(ratio)))
+
+
+class PreClassifier:
+    """
+    Дешевый ярус перед LLM-верификатором: правила, затем n-граммная модель, обученная на решениях
+    самого верификатора (журнал PRECLASSIFIER_LOG_PATH). Уверенные случаи решаются без генерации,
+    неоднозначные (None) уходят в LLM, и ее ответ дообучает модель.
+    Модель только отклоняет: ложный отказ пользователь сразу видит и переформулирует, а ложное
+    принятие запускает всю генерацию на постороннем запросе, поэтому принятие - за правилами и LLM
+    """
+
+    def __init__(self, threshold: float = 0.75, min_samples: int = 50, log_path: Optional[str] = None):
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.log_path = log_path
+        self.model = NgramNaiveBayes()
+        self._lock = threading.Lock()
+        self._routes = {"rule_accept": 0, "rule_reject": 0, "model_reject": 0, "llm": 0}
+        if log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    self.model.update(record["text"], bool(record["label"]))
+                except (ValueError, KeyError):
+                    continue
+        logger.info(f"Trained on logged verifier decisions: {self.model.docs}")
+
+    def classify(self, text: str) -> Tuple[Optional[bool], str]:
+        """
+        :return: (решение или None, если нужна LLM; источник решения - rule | model | llm)
+        """
+
+        normalized = normalize_text(text)
+        if _ACCEPT_RULES.search(normalized):
+            return self._route(True, "rule")
+        if not re.search(r"\w", normalized) or normalized in _SMALL_TALK:
+            return self._route(False, "rule")
+        with self._lock:
+            if min(self.model.docs.values()) < self.min_samples:
+                self._routes["llm"] += 1
+                return None, "llm"
+            label, confidence = self.model.predict(text)
+            # передача в LLM считается здесь: ответ может прийти из кеша и до record не дойти
+            if label or confidence < self.threshold:
+                self._routes["llm"] += 1
+                return None, "llm"
+        return self._route(False, "model")
+
+    def _route(self, label: bool, source: str) -> Tuple[bool, str]:
+        with self._lock:
+            self._routes[f"{source}_{'accept' if label else 'reject'}"] += 1
+        return label, source
+
+    def record(self, text: str, label: bool) -> None:
+        """
+        Решение LLM-верификатора: дообучение модели и запись в журнал
+        (свои решения классификатора не пишутся, чтобы модель не училась на себе)
+        """
+
+        with self._lock:
+            self.model.update(text, label)
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"text": text, "label": label}, ensure_ascii=False) + "\n")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = sum(self._routes.values())
+            stats = dict(self._routes, samples_accept=self.model.docs[True], samples_reject=self.model.docs[False])
+        stats["short_circuit_rate"] = round(1 - stats["llm"] / total, 4) if total else 0.0
+        return stats
+
+
+def rejection_message(text: str) -> str:
+    return PRECLASSIFIER_REJECTIONS.get(langid.classify(text)[0], PRECLASSIFIER_REJECTIONS["en"])
+
+
+@lru_cache()
+def get_preclassifier() -> Optional[PreClassifier]:
+    """
+    Общий пре-классификатор процесса, None если выключен (PRECLASSIFIER=False)
+    """
+
+    if not PRECLASSIFIER_CFG["enabled"]:
+        return None
+    return PreClassifier(threshold=PRECLASSIFIER_CFG["threshold"], min_samples=PRECLASSIFIER_CFG["min_samples"],
+                         log_path=PRECLASSIFIER_CFG["log_path"])
@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+LegacyCache = Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+
+class PrefixCache:
+    """
+    Кеш past key/values по префиксам токенов промпта с LRU вытеснением по бюджету памяти.
+    Держим два вида префиксов:
+    * системный промпт агента - общий для всех сессий
+    * весь промпт прошлого вызова - следующий ход той же сессии начинается с него
+      (история растет только дописыванием ответа и нового сообщения пользователя)
+    Тогда prefill на ходу стоит только новые токены, а не весь диалог
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[int, int], Tuple[Tuple[int, ...], LegacyCache, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, token_ids: List[int]) -> Tuple[int, Optional[DynamicCache]]:
+        """
+        Самый длинный закешированный строгий префикс token_ids: (длина, кеш для generate).
+        Кеш новый на каждый вызов, generate дописывает в него не трогая сохраненные тензоры
+        """
+
+        with self._lock:
+            lengths = sorted({length for length, _ in self._entries if length < len(token_ids)}, reverse=True)
+            for length in lengths:
+                prefix = tuple(token_ids[:length])
+                key = (length, hash(prefix))
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == prefix:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return length, DynamicCache.from_legacy_cache(entry[1])
+            self.misses += 1
+        return 0, None
+
+    def store(self, token_ids: List[int], cache: DynamicCache, length: int) -> None:
+        """
+        Сохраняет первые length позиций кеша как префикс token_ids[:length]
+        """
+
+        if length <= 0:
+            return
+        prefix = tuple(token_ids[:length])
+        key = (length, hash(prefix))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+        # clone, иначе срез держит в памяти весь тензор вместе со сгенерированными токенами
+        layers = tuple((k[:, :, :length].clone(), v[:, :, :length].clone()) for k, v in cache.to_legacy_cache())
+        size = sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in layers)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._entries[key] = (prefix, layers, size)
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.used_bytes -= evicted
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "used_bytes": self.used_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+def common_prefix_length(a: List[int], b: List[int]) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from src.utilities.debug.logger import setup_logger
+from src.utilities.llm_module.llm_constants import RESPONSE_CACHE_CFG
+
+logger = setup_logger("ResponseCache")
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s.!?…]+$")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Нормализация запроса для ключа кеша: регистр, ё/е, пробелы и финальная пунктуация не важны
+    """
+
+    text = unicodedata.normalize("NFKC", text).lower().replace("ё", "е")
+    return _TRAILING_PUNCTUATION.sub("", _SPACES.sub(" ", text).strip())
+
+
+def cache_key(role: str, model: Optional[str], messages: List) -> str:
+    """
+    Ключ ответа агента: роль + модель + версия промпта (хеш текста системного сообщения)
+    + нормализованные сообщения диалога
+    """
+
+    payload = [role, model or ""]
+    for message in messages:
+        content = message.content if message.role == "system" else normalize_text(message.content)
+        payload.append([message.role, content])
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Кеш сырых ответов LLM для агентов без побочных эффектов (verifier, clarifier):
+    LRU в памяти с TTL и опциональный второй уровень в sqlite, общий для воркеров и
+    переживающий рестарт. Промах в памяти и попадание на диске поднимает запись в память
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 86400, path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._data: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "sets": 0}
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with self._connection() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[0] > now:
+                    self._data.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return item[1]
+                del self._data[key]
+        if self.path:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            if row is not None:
+                self._remember(key, row[0], row[1])
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                return row[0]
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        with self._lock:
+            self._stats["sets"] += 1
+        if self.path:
+            with self._connection() as conn:
+                conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+                conn.execute("INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                             (key, value, expires_at))
+
+    def _remember(self, key: str, value: str, expires_at: float) -> None:
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats, size=len(self._data))
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+@lru_cache()
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Общий кеш ответов процесса, None если выключен (RESPONSE_CACHE=False)
+    """
+
+    if not RESPONSE_CACHE_CFG["enabled"]:
+        return None
+    logger.info(f"Response cache: max_size={RESPONSE_CACHE_CFG['max_size']}, ttl={RESPONSE_CACHE_CFG['ttl']}, "
+                f"disk={RESPONSE_CACHE_CFG['path'] or 'off'}")
+    return ResponseCache(max_size=RESPONSE_CACHE_CFG["max_size"], ttl=RESPONSE_CACHE_CFG["ttl"],
+                         path=RESPONSE_CACHE_CFG["path"])
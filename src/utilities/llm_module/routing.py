@@ -0,0 +1,48 @@
+from typing import Callable, Dict, Optional
+
+from src.utilities.debug.logger import setup_logger
+from src.utilities.llm_module.call_functions import mistral_call, mistral_local_call
+from src.utilities.llm_module.llm_constants import AGENT_ROUTES, MODELS
+from src.utilities.services.model_registry import get_local_model_cfg
+
+logger = setup_logger("AgentRouting")
+
+
+class RoutedCall:
+    """
+    llm_call агента с параметрами генерации его маршрута (max_new_tokens, temperature, stop, модель API).
+    model_id - имя модели маршрута, входит в ключ кеша ответов (см. response_cache.py)
+    """
+
+    def __init__(self, llm_call: Callable, model_id: Optional[str], **params):
+        self.llm_call = llm_call
+        self.model_id = model_id
+        self.params = params
+
+    def __call__(self, messages, **kwargs) -> str:
+        return self.llm_call(messages=messages, **kwargs, **self.params)
+
+    def __repr__(self) -> str:
+        return f"RoutedCall({self.llm_call.__name__}, {self.model_id}, {self.params})"
+
+
+def resolve_route(role: str, mode: str, local_model_cfg: Optional[Dict]) -> Dict:
+    """
+    Бэкенд агента по таблице AGENT_ROUTES: {"llm_call", "local_model_cfg"} для конструктора агента.
+    Маршрут без backend идет в режим графа (mode и его local_model_cfg), local при графе в режиме api
+    и tiny грузят модели из реестра лениво
+    """
+
+    route = AGENT_ROUTES.get(role, AGENT_ROUTES["x6processor"])
+    backend = route["backend"] or mode
+    params = dict(max_new_tokens=route["max_new_tokens"], temperature=route["temperature"], stop=route["stop"])
+    if backend == "api":
+        model = route["model"] or MODELS["mistral_api"]
+        return {"llm_call": RoutedCall(mistral_call, model, model=model, **params), "local_model_cfg": None}
+    if backend == "tiny":
+        return {"llm_call": RoutedCall(mistral_local_call, MODELS["tiny_local"], **params),
+                "local_model_cfg": get_local_model_cfg(name="tiny_local")}
+    if backend == "local":
+        return {"llm_call": RoutedCall(mistral_local_call, MODELS["mistral_local"], **params),
+                "local_model_cfg": local_model_cfg if mode == "local" else get_local_model_cfg()}
+    raise ValueError(f"Unknown backend {backend!r} for agent {role}")
@@ -1,47 +1,92 @@
-from src.utilities.llm_module.llm_constants import X6_CANVAS_SHAPE
-from typing import List
+from src.utilities.llm_module.src.layout import LayeredLayout
+from typing import Dict, List, Optional, Tuple
 
-def x6_layout(graph: dict) -> List[dict]:
-    max_width, max_height = X6_CANVAS_SHAPE
-    padding = 50  # Отступ от краев холста
+_layout = LayeredLayout()
+
+
+def x6_layout(graph: dict, previous: Optional[List[dict]] = None) -> List[dict]:
+    """
+    X6 ячейки диаграммы. Если передана прошлая раскладка (ячейки предыдущего ответа),
+    узлы, которые в ней уже были, сохраняют позиции, а новые встраиваются рядом с соседями
+    """
 
     nodes = graph["nodes"]
     edges = graph["edges"]
-    n = len(nodes)
-
-    # Определяем количество строк и колонок в сетке
-    cols = max(1, round(n ** 0.5))
-    rows = (n + cols - 1) // cols
 
-    # Расстояние между центрами узлов
-    grid_width = (max_width - 2 * padding) / cols
-    grid_height = (max_height - 2 * padding) / rows
+    if previous:
+        # Инкрементальная раскладка: клиент не перерисовывает холст после правки
+        previous_positions = {cell["id"]: (cell["position"]["x"], cell["position"]["y"])
+                              for cell in previous if "position" in cell}
+        previous_vertices = {(cell["source"], cell["target"]): [(p["x"], p["y"]) for p in cell.get("vertices", [])]
+                             for cell in previous if "source" in cell}
+        positions, vertices = _layout.incremental(nodes, edges, previous_positions, previous_vertices)
+    else:
+        # Послойная раскладка по потоку процесса, у ребер ортогональные изломы
+        positions, vertices = _layout(nodes, edges)
 
     result = []
+    seen = set()
 
-    for idx, node in enumerate(nodes):
-        row = idx // cols
-        col = idx % cols
-
-        # Центр каждой ячейки + padding
-        x = padding + col * grid_width + grid_width / 2
-        y = padding + row * grid_height + grid_height / 2
+    for node in nodes:
+        node_id = str(node["id"])
+        if node_id in seen:
+            continue
+        seen.add(node_id)
+        x, y = positions[node_id]
 
         result.append({
-            "id": str(node["id"]),
+            "id": node_id,
             "shape": node.get("shape", "rect"),
             "width": node.get("width", 100),
             "height": node.get("height", 60),
-            "position": {"x": round(x, 2), "y": round(y, 2)},
+            "position": {"x": x, "y": y},
             "label": node.get("label", "")
         })
 
-    for i, edge in enumerate(edges, start=1):
+    # id ребра строится из концов, чтобы между ходами одно и то же ребро сохраняло id
+    edge_ids = set()
+    for edge, points in zip(edges, vertices):
+        source, target = str(edge["source"]), str(edge["target"])
+        edge_id = base_id = f"{source}->{target}"
+        duplicate = 1
+        while edge_id in edge_ids:
+            duplicate += 1
+            edge_id = f"{base_id}#{duplicate}"
+        edge_ids.add(edge_id)
         result.append({
-            "id": str(len(nodes) + i),
+            "id": edge_id,
             "shape": "bpmn-edge",
-            "source": str(edge["source"]),
-            "target": str(edge["target"])
+            "source": source,
+            "target": target,
+            "vertices": [{"x": x, "y": y} for x, y in points]
         })
 
-    return result
\ No newline at end of file
+    return result
+
+
+def layout_diff(previous: List[dict], cells: List[dict]) -> Dict[str, list]:
+    """
+    Минимальная правка холста X6 между двумя раскладками:
+    added - новые ячейки, moved - ячейки, у которых поменялись позиция, изломы или подпись
+    (клиент заменяет их целиком), removed - id удаленных ячеек
+    """
+
+    before = {cell["id"]: cell for cell in previous}
+    after = {cell["id"] for cell in cells}
+    return {
+        "added": [cell for cell in cells if cell["id"] not in before],
+        "moved": [cell for cell in cells if cell["id"] in before and before[cell["id"]] != cell],
+        "removed": [cell_id for cell_id in before if cell_id not in after],
+    }
+
+
+def render_diagram(state: Dict, diagram: dict, incremental: bool) -> Tuple[List[dict], Optional[Dict[str, list]]]:
+    """
+    Раскладка диаграммы сессии: при incremental позиции берутся от прошлой отданной раскладки
+    и возвращается diff для клиента. Ячейки запоминаются в state["layout"]
+    """
+
+    previous = state.get("layout") if incremental else None
+    cells = x6_layout(diagram, previous)
+    state["layout"] = cells
+    return cells, layout_diff(previous, cells) if previous is not None else None
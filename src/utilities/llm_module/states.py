@@ -1,11 +1,18 @@
 from typing_extensions import TypedDict
 from src.utilities.llm_module.llm_constants import CLARIFICATION_NUM_ITERATIONS, GENERATION_NUM_ITERATIONS
+from mistralai.models import SystemMessage, UserMessage, AssistantMessage
+from src.utilities.llm_module.context_log import ContextLog
+from src.utilities.llm_module.diagram_history import DiagramHistory
 from typing import List, Dict, Union
+import json
+import zlib
 
 
 class AgentResult(TypedDict, total=False):
     flag: bool
     content: Union[str, Dict]
+    ops: List[Dict]
+    version: int
 
 
 class BaseState(TypedDict):
@@ -18,22 +25,28 @@ class BaseState(TypedDict):
     * last - List[List[str]] - полезный аргумент, хранящий срабатывание агентов, в виде списка с именем графа и
     именем агента, который сработал, например: ["generator", "verifier"], ["generator", "clarifier"] и т.д.
 
-    * context - List[dict] - все сообщения в типизации UserMessage, AssistantMessage и SystemMessage (возможно придется менять
-    для локального инференса
+    * context - ContextLog - общий журнал диалога: события [агент, роль, текст, заметка], каждый агент
+    видит из него только свои сообщения и нужные ему чужие (AGENT_VIEWS, см. context_log.py)
 
-    * bpmn - List[List[dict]] - список диаграмм, полученных от генератора или редактора. Если одной из диаграмм не
-    присваиваются координаты (ошибка генерации на стороне LLM), то можно вернуть предыдущую диаграмму из списка
+    * bpmn - DiagramHistory - версии диаграмм, полученных от генератора или редактора, с общими неизменившимися
+    узлами и ребрами. Текущая диаграмма - bpmn.view() (чтение) или bpmn.latest() (копия),
+    к предыдущим можно вернуться через undo/checkout
 
     * agents_result - Dict[str, List[AgentResult]] - словарь, который хранит все результаты агентов
+    (x6processor и editor хранят не диаграмму, а номер версии в bpmn - "version")
 
     * await_user_input - флаг, указывающий на ожидание инпута (служебный)
+
+    * layout - List[dict] - X6 ячейки последней отданной диаграммы (с позициями), от них считается
+    инкрементальная раскладка после правки редактором
     """
     user_input: List[str]
     last: List[List[str]]
-    context: List[dict]
-    bpmn: List[Dict]
+    context: ContextLog
+    bpmn: DiagramHistory
     agents_result: Dict[str, List[AgentResult]]
     await_user_input: bool
+    layout: List[dict]
 
 
 class GenerationState(BaseState):
@@ -47,8 +60,8 @@ class GenerationState(BaseState):
     Assistant: Какие процессы?
     User: Разные
     Assistant: {Генерация графа}
-    generation_num_iterations - гиперпараметр (опционально), указывающий на кол-во повторных генераций,
-    при инвалидности предыдущих (сейчас не используется)
+    generation_num_iterations - гиперпараметр (опционально), указывающий на кол-во попыток починки диаграммы
+    через LLM (repairer), если валидатор не смог исправить ее сам; восстанавливается в начале каждой генерации
     """
     clarification_num_iterations: int
     generation_num_iterations: int
@@ -56,8 +69,8 @@ class GenerationState(BaseState):
 
 def generation(user_input: str,
                last: List[List[str]] = None,
-               context: List[dict] = None,
-               bpmn: List[Dict] = None,
+               context: ContextLog = None,
+               bpmn: DiagramHistory = None,
                agents_result: Dict[str, List[AgentResult]] = None,
                await_user_input: bool = False) -> GenerationState:
     """
@@ -66,15 +79,48 @@ def generation(user_input: str,
     return {
         "user_input": [user_input],
         "last": last if last is not None else [],
-        "context": context if context is not None else [],
-        "bpmn": bpmn if bpmn is not None else [{"nodes": [], "edges": []}],
+        "context": context if context is not None else ContextLog(),
+        "bpmn": bpmn if bpmn is not None else DiagramHistory(),
         "agents_result": agents_result if agents_result is not None else {
             "clarifier": [],
             "verifier": [],
             "x6processor": [],
             "editor": [],
+            "validator": [],
+            "repairer": [],
         },
         "await_user_input": await_user_input,
+        "layout": [],
         "clarification_num_iterations": CLARIFICATION_NUM_ITERATIONS,
         "generation_num_iterations": GENERATION_NUM_ITERATIONS
     }
+
+
+MESSAGE_TYPES = {
+    "system": SystemMessage,
+    "user": UserMessage,
+    "assistant": AssistantMessage,
+}
+
+
+def dump_state(state: GenerationState) -> bytes:
+    """
+    Компактная сериализация состояния: журнал диалога - список событий,
+    история диаграмм - к дельтам между версиями, json без пробелов и сжатие zlib
+    """
+
+    data = dict(state)
+    data["context"] = state["context"].to_list()
+    data["bpmn"] = state["bpmn"].to_dict()
+    return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def load_state(data: bytes) -> GenerationState:
+    """
+    Обратная операция к dump_state
+    """
+
+    state = json.loads(zlib.decompress(data).decode("utf-8"))
+    state["context"] = ContextLog.from_list(state["context"])
+    state["bpmn"] = DiagramHistory.from_dict(state["bpmn"])
+    return state
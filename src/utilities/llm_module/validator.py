@@ -0,0 +1,150 @@
+from typing import Dict, List, Tuple
+
+from src.utilities.llm_module.llm_constants import BPMN_SHAPES
+
+# типичные имена фигур, которые модель пишет вместо разрешенных
+_SHAPE_ALIASES = {
+    "start": "event", "end": "event", "startevent": "event", "endevent": "event", "start_event": "event",
+    "end_event": "event", "intermediateevent": "event",
+    "task": "activity", "usertask": "activity", "servicetask": "activity", "process": "activity",
+    "subprocess": "activity", "action": "activity", "step": "activity",
+    "decision": "gateway", "exclusivegateway": "gateway", "parallelgateway": "gateway",
+    "inclusivegateway": "gateway", "condition": "gateway",
+}
+
+
+def repair_diagram(diagram, allow_empty: bool = False) -> Tuple[Dict, Dict[str, List[str]]]:
+    """
+    Детерминированная проверка и починка диаграммы {"nodes", "edges"} за линейное время.
+    Возвращает исправленную диаграмму и отчет:
+    * fixed - что исправлено (узлы без id, дубликаты id, неизвестные фигуры, висячие/повторные ребра,
+      отсутствующие стартовое и конечное события)
+    * unfixable - что без LLM не исправить (пустая диаграмма, несвязные части процесса)
+    allow_empty - пустая диаграмма допустима: пользователь попросил редактора удалить все
+    (дальше bpmn_condition отправит следующий запрос в x6processor).
+    Исходная диаграмма не меняется
+    """
+
+    fixed: List[str] = []
+    unfixable: List[str] = []
+    if not isinstance(diagram, dict):
+        return {"nodes": [], "edges": []}, {"fixed": [], "unfixable": ["response is not a diagram object"]}
+    raw_nodes = diagram.get("nodes") if isinstance(diagram.get("nodes"), list) else []
+    raw_edges = diagram.get("edges") if isinstance(diagram.get("edges"), list) else []
+
+    # узлы: id приводятся к int, если это число; без id и с повторным id получают новый
+    nodes: List[Dict] = []
+    index: Dict[str, Dict] = {}
+    numeric = [_as_int(node.get("id")) for node in raw_nodes if isinstance(node, dict)]
+    next_id = max((value for value in numeric if value is not None), default=0) + 1
+    for node in raw_nodes:
+        if not isinstance(node, dict):
+            fixed.append("dropped a node that is not an object")
+            continue
+        node = dict(node)
+        node_id = node.get("id")
+        if isinstance(node_id, str) and _as_int(node_id) is not None:
+            node_id = int(node_id)
+        if node_id is None or isinstance(node_id, (dict, list, bool)) or str(node_id) in index:
+            reason = "without id" if node_id is None or isinstance(node_id, (dict, list, bool)) \
+                else f"with duplicate id {node_id}"
+            fixed.append(f"node {reason} renumbered to {next_id}")
+            node_id = next_id
+            next_id += 1
+        node["id"] = node_id
+        shape = node.get("shape")
+        if shape not in BPMN_SHAPES:
+            node["shape"] = _SHAPE_ALIASES.get(str(shape).lower().replace(" ", ""), "activity")
+            fixed.append(f"node {node_id}: shape {shape!r} replaced with {node['shape']!r}")
+        if not isinstance(node.get("label"), str):
+            node["label"] = "" if node.get("label") is None else str(node["label"])
+        index[str(node_id)] = node
+        nodes.append(node)
+
+    # ребра: только между существующими узлами, без петель и повторов
+    edges: List[Dict] = []
+    seen = set()
+    for edge in raw_edges:
+        if not isinstance(edge, dict) or "source" not in edge or "target" not in edge:
+            fixed.append("dropped a malformed edge")
+            continue
+        source, target = str(edge["source"]), str(edge["target"])
+        if source not in index or target not in index:
+            fixed.append(f"dropped edge {source}->{target} to a missing node")
+            continue
+        if source == target:
+            fixed.append(f"dropped self-loop on {source}")
+            continue
+        if (source, target) in seen:
+            fixed.append(f"dropped duplicate edge {source}->{target}")
+            continue
+        seen.add((source, target))
+        edges.append({"source": index[source]["id"], "target": index[target]["id"]})
+
+    if not nodes:
+        if not allow_empty:
+            unfixable.append("diagram has no nodes")
+        return {"nodes": nodes, "edges": edges}, {"fixed": fixed, "unfixable": unfixable}
+
+    components = _components(index, edges)
+    if components > 1:
+        unfixable.append(f"diagram is split into {components} disconnected parts, connect them into one process")
+        return {"nodes": nodes, "edges": edges}, {"fixed": fixed, "unfixable": unfixable}
+
+    indegree = {key: 0 for key in index}
+    outdegree = {key: 0 for key in index}
+    for edge in edges:
+        outdegree[str(edge["source"])] += 1
+        indegree[str(edge["target"])] += 1
+
+    sources = [key for key in index if not indegree[key]]
+    if not any(index[key]["shape"] == "event" for key in sources):
+        start = {"id": next_id, "shape": "event", "label": ""}
+        next_id += 1
+        # при цикле без истоков стартуем с первого узла
+        for key in sources or [str(nodes[0]["id"])]:
+            edges.append({"source": start["id"], "target": index[key]["id"]})
+        nodes.insert(0, start)
+        fixed.append(f"added start event {start['id']}")
+
+    sinks = [key for key in index if not outdegree[key]]
+    if not any(index[key]["shape"] == "event" for key in sinks):
+        end = {"id": next_id, "shape": "event", "label": ""}
+        for key in sinks or [str(nodes[-1]["id"])]:
+            edges.append({"source": index[key]["id"], "target": end["id"]})
+        nodes.append(end)
+        fixed.append(f"added end event {end['id']}")
+
+    return {"nodes": nodes, "edges": edges}, {"fixed": fixed, "unfixable": unfixable}
+
+
+def _as_int(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        return int(value)
+    return None
+
+
+def _components(index: Dict[str, Dict], edges: List[Dict]) -> int:
+    """
+    Число слабосвязных компонент (система непересекающихся множеств)
+    """
+
+    parent = {key: key for key in index}
+
+    def find(key: str) -> str:
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    components = len(parent)
+    for edge in edges:
+        a, b = find(str(edge["source"])), find(str(edge["target"]))
+        if a != b:
+            parent[a] = b
+            components -= 1
+    return components
@@ -1,80 +1,264 @@
-import os
-import numpy as np
-import pyaudio
+import shutil
+import subprocess
 import time
-from pydub import AudioSegment
+import wave
+from typing import List, Optional, Tuple
 
-SILENCE_THRESHOLD = -40
-SILENCE_DURATION = 3000
+import decouple
+import numpy as np
 
-class AudioService:
+SAMPLE_RATE = 16000
+# порог тишины в dBFS (0 - максимальная громкость int16) и длительность паузы, после которой фраза закончена
+SILENCE_THRESHOLD = decouple.config("VAD_THRESHOLD_DBFS", default=-40, cast=float)
+SILENCE_DURATION = decouple.config("VAD_SILENCE_MS", default=700, cast=int)
+MAX_UTTERANCE_SECONDS = decouple.config("VAD_MAX_UTTERANCE_SECONDS", default=30, cast=float)
+# обрезка тишины по краям загруженных записей - с порогом ниже, чем у VAD, чтобы не срезать тихую речь
+TRIM_THRESHOLD = decouple.config("AUDIO_TRIM_THRESHOLD_DBFS", default=-50, cast=float)
+FFMPEG_BINARY = decouple.config("FFMPEG_BINARY", default="") or "ffmpeg"
+# начальный размер буфера декодирования - минута звука, дальше растет вдвое
+_DECODE_BUFFER_SECONDS = 60
 
-    def __init__(self, chunk_size:int = 1024, sample_format=pyaudio.paInt16, channels:int = 1, rate:int = 44100):
-        self.audio = pyaudio.PyAudio()
-        self.stream = None
-        self.is_recording = False
-        self.audio_data = []
-        self.chunk_size = chunk_size
-        self.sample_format = sample_format
-        self.channels = channels
-        self.rate = rate
 
+def to_float32(pcm: bytes) -> np.ndarray:
+    """
+    PCM int16 little-endian -> float32 [-1, 1] без промежуточных копий, кроме самого приведения типа
+    """
 
-    def detect_silence(self, audio_chunk: np.ndarray) -> bool:
+    return np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+
+
+def dbfs(frames: np.ndarray) -> np.ndarray:
+    """
+    Громкость каждой строки frames (float32 [-1, 1]) в dBFS, одним векторным проходом
+    """
+
+    rms = np.sqrt(np.mean(np.square(frames), axis=-1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def resample(audio: np.ndarray, rate: int, target: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Передискретизация в target: при кратных частотах (48к, 32к -> 16к) - усреднение окном,
+    которое заодно режет наложение спектра, иначе линейная интерполяция
+    """
+
+    if rate == target:
+        return audio
+    if rate % target == 0:
+        factor = rate // target
+        usable = len(audio) - len(audio) % factor
+        return audio[:usable].reshape(-1, factor).mean(axis=1, dtype=np.float32)
+    length = int(round(len(audio) * target / rate))
+    return np.interp(np.arange(length) * (rate / target), np.arange(len(audio)), audio).astype(np.float32)
+
+
+def decode_audio(audio_file: str, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Декодирование записи любого формата в float32 моно sample_rate. ffmpeg сам передискретизирует
+    и сводит каналы на лету и пишет сырые сэмплы в pipe, они читаются прямо в память numpy-массива
+    (readinto, без промежуточных bytes и WAV на диске), так что в памяти только 16 кГц моно.
+    Без ffmpeg - декодер faster_whisper (PyAV), результат тот же
+    """
+
+    if shutil.which(FFMPEG_BINARY) is None:
+        from faster_whisper import decode_audio as av_decode_audio
+
+        return av_decode_audio(audio_file, sampling_rate=sample_rate)
+
+    command = [FFMPEG_BINARY, "-nostdin", "-v", "error", "-threads", "0", "-i", audio_file,
+               "-f", "f32le", "-ac", "1", "-ar", str(sample_rate), "-"]
+    buffer = np.empty(sample_rate * _DECODE_BUFFER_SECONDS, dtype=np.float32)
+    size = 0  # прочитано байт
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        while True:
+            if size == buffer.nbytes:
+                grown = np.empty(len(buffer) * 2, dtype=np.float32)
+                grown[:len(buffer)] = buffer
+                buffer = grown
+            read = process.stdout.readinto(memoryview(buffer).cast("B")[size:])
+            if not read:
+                break
+            size += read
+        error = process.stderr.read()
+    if process.returncode:
+        raise ValueError(f"Не удалось декодировать аудио: {error.decode(errors='replace').strip()}")
+    return buffer[:size // 4]
+
+
+def trim_silence(audio: np.ndarray, sample_rate: int = SAMPLE_RATE, threshold_dbfs: float = TRIM_THRESHOLD,
+                 frame_ms: int = 30, pad_ms: int = 200) -> Tuple[np.ndarray, float]:
+    """
+    Обрезка тишины в начале и конце записи с запасом pad_ms по краям. Громкость фреймов считается
+    векторно блоками по минуте, чтобы не держать копию всей записи. Возвращает срез без копирования
+    и сдвиг начала в секундах, чтобы время сегментов считалось от начала исходной записи.
+    Если громче порога нет ничего, запись остается как есть - решать, есть ли там речь, будет Whisper
+    """
+
+    frame = sample_rate * frame_ms // 1000
+    count = len(audio) // frame
+    if not count:
+        return audio, 0.0
+    frames = audio[:count * frame].reshape(count, frame)
+    block = 60 * 1000 // frame_ms
+    levels = np.concatenate([dbfs(frames[i:i + block]) for i in range(0, count, block)])
+    voiced = np.flatnonzero(levels > threshold_dbfs)
+    if not len(voiced):
+        return audio, 0.0
+    pad = sample_rate * pad_ms // 1000
+    start = max(voiced[0] * frame - pad, 0)
+    end = min((voiced[-1] + 1) * frame + pad, len(audio))
+    return audio[start:end], start / sample_rate
+
+
+class VoiceActivityDetector:
+    """
+    Нарезка потока PCM на фразы по тишине. Сэмплы пишутся в кольцевой буфер на max_utterance_s,
+    громкость считается векторно сразу по всем целым фреймам пришедшего куска. Кусок длиннее секунды
+    пишется и разбирается по секунде, чтобы не затереть в буфере начало еще не отрезанной фразы.
+    Фраза начинается с первого фрейма громче threshold_dbfs (с запасом preroll_ms перед ним)
+    и заканчивается, когда тишина длится silence_ms; слишком длинная фраза режется принудительно
+    """
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, frame_ms: int = 30,
+                 threshold_dbfs: float = SILENCE_THRESHOLD, silence_ms: int = SILENCE_DURATION,
+                 min_speech_ms: int = 250, preroll_ms: int = 200, max_utterance_s: float = MAX_UTTERANCE_SECONDS):
+        self.sample_rate = sample_rate
+        self.frame = sample_rate * frame_ms // 1000
+        self.threshold_dbfs = threshold_dbfs
+        self.silence_frames = max(1, silence_ms // frame_ms)
+        self.min_speech = sample_rate * min_speech_ms // 1000
+        self.preroll = sample_rate * preroll_ms // 1000
+        self.max_utterance = int(sample_rate * max_utterance_s)
+        self.step = sample_rate
+        # фраза с запасом preroll, недоразобранный хвост меньше фрейма и один новый кусок
+        self.buffer = np.zeros(self.max_utterance + self.preroll + self.frame + self.step, dtype=np.float32)
+        self.written = 0  # сэмплов записано всего (абсолютная позиция конца буфера)
+        self.analyzed = 0  # сэмплов, уже разобранных на фреймы
+        self.start: Optional[int] = None  # начало текущей фразы (с запасом preroll)
+        self.voiced_start = 0
+        self.voiced_end = 0
+        self.silent_frames = 0
+
+    @property
+    def in_speech(self) -> bool:
+        return self.start is not None
+
+    def _write(self, samples: np.ndarray) -> None:
+        size = len(self.buffer)
+        position = self.written % size
+        head = min(len(samples), size - position)
+        self.buffer[position:position + head] = samples[:head]
+        self.buffer[:len(samples) - head] = samples[head:]
+        self.written += len(samples)
+
+    def _read(self, start: int, end: int) -> np.ndarray:
+        size = len(self.buffer)
+        start = max(start, self.written - size)
+        first, last = start % size, end % size
+        if end - start <= 0:
+            return np.zeros(0, dtype=np.float32)
+        if first < last:
+            return self.buffer[first:last].copy()
+        return np.concatenate((self.buffer[first:], self.buffer[:last]))
+
+    def feed(self, samples: np.ndarray) -> List[np.ndarray]:
         """
-        Определяет, является ли аудиочасть тишиной.
+        :param samples: float32 сэмплы потока
+        :return: законченные фразы (float32, sample_rate)
         """
 
-        rms = np.sqrt(np.mean(np.square(audio_chunk)))
-        return rms < SILENCE_THRESHOLD
+        utterances = []
+        for offset in range(0, len(samples), self.step):
+            utterances.extend(self._feed(samples[offset:offset + self.step]))
+        return utterances
 
-    def record_audio(self):
+    def _feed(self, samples: np.ndarray) -> List[np.ndarray]:
+        self._write(samples)
+        count = (self.written - self.analyzed) // self.frame
+        if not count:
+            return []
+        frames = self._read(self.analyzed, self.analyzed + count * self.frame).reshape(count, self.frame)
+        voiced = dbfs(frames) > self.threshold_dbfs
 
-        stream = self.audio.open(format=self.sample_format,
-                            channels=self.channels,
-                            rate=self.rate,
-                            input=True,
-                            frames_per_buffer=self.chunk_size)
+        utterances = []
+        for index, is_voiced in enumerate(voiced):
+            frame_start = self.analyzed + index * self.frame
+            frame_end = frame_start + self.frame
+            if is_voiced:
+                if self.start is None:
+                    self.start = max(frame_start - self.preroll, self.written - len(self.buffer), 0)
+                    self.voiced_start = frame_start
+                self.voiced_end = frame_end
+                self.silent_frames = 0
+            elif self.start is not None:
+                self.silent_frames += 1
+                if self.silent_frames >= self.silence_frames:
+                    utterances.extend(self._cut(self.voiced_end))
+            if self.start is not None and frame_end - self.start >= self.max_utterance:
+                utterances.extend(self._cut(frame_end))
+                # речь продолжается без паузы - следующая фраза начинается сразу после отрезанной
+                self.start = self.voiced_start = frame_end
+        self.analyzed += count * self.frame
+        return utterances
 
-        frames = []
-        silence_start = None
+    def flush(self) -> List[np.ndarray]:
+        """
+        Конец потока: недоговоренная фраза отдается как есть
+        """
 
-        self.is_recording = True
-        print("Запись аудио...")
+        return self._cut(self.voiced_end) if self.start is not None else []
 
-        while self.is_recording:
-            audio_data = np.frombuffer(stream.read(self.chunk_size), dtype=np.int16)
-            frames.append(audio_data)
+    def _cut(self, end: int) -> List[np.ndarray]:
+        start, self.start, self.silent_frames = self.start, None, 0
+        if end - self.voiced_start < self.min_speech:
+            return []
+        return [self._read(start, end)]
 
-            if self.detect_silence(audio_data):
-                if silence_start is None:
-                    silence_start = time.time()
-                elif (time.time() - silence_start) * 1000 >= SILENCE_DURATION:
-                    print("Обнаружена тишина, завершение записи...")
-                    break
-            else:
-                silence_start = None
 
-        stream.stop_stream()
-        stream.close()
-        self.audio.terminate()
+class AudioService:
+    """
+    Запись запроса с локального микрофона (PyAudio) до паузы, для отладки без браузера
+    """
 
-        self.audio_data = np.concatenate(frames)
-        print("Запись завершена.")
+    def __init__(self, chunk_size: int = 1024, channels: int = 1, rate: int = SAMPLE_RATE):
+        self.chunk_size = chunk_size
+        self.channels = channels
+        self.rate = rate
 
-        audio_segment = AudioSegment(
-            self.audio_data.tobytes(),
-            frame_rate=self.rate,
-            sample_width=self.audio.get_sample_size(self.sample_format),
-            channels=self.channels
-        )
+    def detect_silence(self, audio_chunk: np.ndarray) -> bool:
+        """
+        Определяет, является ли аудиочасть тишиной (float32 [-1, 1], порог в dBFS)
+        """
 
+        return bool(dbfs(audio_chunk) < SILENCE_THRESHOLD)
 
-        audio_path = f"../audio/{int(time.time())}.wav"
-        audio_segment.export(audio_path, format="wav")
+    def record_audio(self, audio_path: Optional[str] = None) -> str:
+        import pyaudio
 
-        return audio_path
+        audio = pyaudio.PyAudio()
+        stream = audio.open(format=pyaudio.paInt16,
+                            channels=self.channels,
+                            rate=self.rate,
+                            input=True,
+                            frames_per_buffer=self.chunk_size)
+        detector = VoiceActivityDetector(sample_rate=self.rate, silence_ms=3000)
+        print("Запись аудио...")
 
+        utterances: List[np.ndarray] = []
+        try:
+            while not utterances:
+                utterances = detector.feed(to_float32(stream.read(self.chunk_size)))
+        finally:
+            stream.stop_stream()
+            stream.close()
+            audio.terminate()
+        print("Обнаружена тишина, запись завершена.")
 
+        audio_path = audio_path or f"../audio/{int(time.time())}.wav"
+        with wave.open(audio_path, "wb") as file:
+            file.setnchannels(self.channels)
+            file.setsampwidth(2)
+            file.setframerate(self.rate)
+            file.writeframes((np.clip(utterances[0], -1, 1) * 32767).astype("<i2").tobytes())
 
-AudioService().record_audio()
\ No newline at end of file
+        return audio_path
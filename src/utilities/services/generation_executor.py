@@ -0,0 +1,93 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict
+
+from src.config.manager import settings
+from src.utilities.debug.logger import setup_logger
+from src.utilities.services.model_registry import transcription_workers
+
+logger = setup_logger("GenerationExecutor")
+
+
+class ExecutorSaturatedError(RuntimeError):
+    """
+    Все слоты (выполняемые + очередь) заняты, запрос нужно отклонить (429)
+    """
+
+
+class BoundedExecutor:
+    """
+    Пул потоков для блокирующей генерации (вызовы LLM, torch generate) и транскрипции, чтобы они не
+    занимали event loop uvicorn. Одновременно выполняется max_in_flight задач, еще
+    max_queue ждут в очереди, все что сверху - отклоняется сразу
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, name: str = "generation"):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=name)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> asyncio.Future:
+        """
+        Ставит задачу в пул и сразу возвращает future event loop'а,
+        ExecutorSaturatedError бросается синхронно, до начала ответа клиенту
+        """
+
+        return asyncio.wrap_future(self.submit_threadsafe(fn, *args, **kwargs))
+
+    def submit_threadsafe(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        То же без event loop - для цепочек задач из потоков пулов (транскрипция -> генерация)
+        """
+
+        with self._lock:
+            if self._pending >= self.max_in_flight + self.max_queue:
+                logger.warning(f"Executor {self.name} saturated: {self._pending} pending tasks")
+                raise ExecutorSaturatedError(f"{self.name.capitalize()} executor is saturated")
+            self._pending += 1
+
+        future = self._executor.submit(functools.partial(fn, *args, **kwargs))
+        # слот освобождается только когда задача реально завершилась в потоке,
+        # даже если клиент отключился и корутина была отменена
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        return await self.submit(fn, *args, **kwargs)
+
+    def _release(self, _) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            pending = self._pending
+        return {
+            "in_flight": min(pending, self.max_in_flight),
+            "queued": max(0, pending - self.max_in_flight),
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+        }
+
+
+@lru_cache()
+def get_generation_executor() -> BoundedExecutor:
+    return BoundedExecutor(max_in_flight=settings.GENERATION_MAX_IN_FLIGHT,
+                           max_queue=settings.GENERATION_MAX_QUEUE)
+
+
+@lru_cache()
+def get_transcription_executor() -> BoundedExecutor:
+    """
+    Пул транскрипции: по воркеру на WHISPER_CPU_THREADS ядер, так что пропускная способность
+    упирается в процессор, а не в очередь запросов (модель одна, см. get_whisper_model)
+    """
+
+    return BoundedExecutor(max_in_flight=transcription_workers(), max_queue=settings.TRANSCRIPTION_MAX_QUEUE,
+                           name="transcription")
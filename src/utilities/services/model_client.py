@@ -0,0 +1,53 @@
+from multiprocessing.connection import Client
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from src.utilities.llm_module.llm_constants import MODEL_SERVER_AUTHKEY
+
+
+class ModelServerError(RuntimeError):
+    """
+    Ошибка на стороне model-server процесса
+    """
+
+
+class ModelServerClient:
+    """
+    Клиент общего процесса с моделями (см. model_server.py). Соединение по unix-сокету
+    открывается на каждый запрос - это дешево и не требует синхронизации между потоками воркера
+    """
+
+    def __init__(self, address: str, authkey: Optional[bytes] = MODEL_SERVER_AUTHKEY):
+        if not authkey:
+            raise ValueError("MODEL_SERVER_AUTHKEY is not set: it must match the key of the model server")
+        self.address = address
+        self.authkey = authkey
+
+    def _request(self, request: Dict, on_token: Optional[Callable[[str], None]] = None):
+        with Client(self.address, authkey=self.authkey) as conn:
+            conn.send(request)
+            while True:
+                reply = conn.recv()
+                if "token" in reply:
+                    if on_token:
+                        on_token(reply["token"])
+                    continue
+                if "error" in reply:
+                    raise ModelServerError(reply["error"])
+                return reply["result"]
+
+    def generate(self, messages: List, on_token: Optional[Callable[[str], None]] = None, **kwargs) -> str:
+        """
+        Аналог mistral_local_call, kwargs (stop_on_json, schema, ...) передаются как есть
+        """
+
+        return self._request({
+            "op": "generate",
+            "messages": [[message.role, message.content] for message in messages],
+            "stream": on_token is not None,
+            "kwargs": kwargs,
+        }, on_token)
+
+    def transcribe(self, audio_file: Union[str, np.ndarray], **kwargs) -> str:
+        return self._request({"op": "transcribe", "audio_file": audio_file, "kwargs": kwargs})
@@ -0,0 +1,134 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import decouple
+import torch
+
+from src.utilities.debug.logger import setup_logger
+from src.utilities.llm_module.llm_constants import (LOCAL_BATCHING_CFG, LOCAL_PREFIX_CACHE_MB, MODELS,
+                                                     MODEL_SERVER_ADDRESS)
+
+logger = setup_logger("ModelRegistry")
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+WHISPER_MODEL_SIZE = decouple.config("WHISPER_MODEL_SIZE", default="small", cast=str)
+WHISPER_COMPUTE_TYPE = decouple.config("WHISPER_COMPUTE_TYPE", default="int8", cast=str)
+WHISPER_CPU_THREADS = decouple.config("WHISPER_CPU_THREADS", default=4, cast=int)
+# 0 - по числу ядер: os.cpu_count() // WHISPER_CPU_THREADS
+TRANSCRIPTION_WORKERS = decouple.config("TRANSCRIPTION_WORKERS", default=0, cast=int)
+
+_lock = threading.Lock()
+_local_model_cfgs: Dict[str, Dict] = {}
+_whisper_models: Dict[Tuple[str, str, str], object] = {}
+
+
+def get_local_model_cfg(use_server: bool = True, name: str = "mistral_local") -> Dict:
+    """
+    Конфиг локальной модели для mistral_local_call, веса грузятся при первом обращении.
+    Если задан MODEL_SERVER_ADDRESS, воркер моделей не грузит вовсе, а ходит в общий
+    model-server процесс: {"server": address}
+    При LOCAL_BATCHING в конфиг добавляется BatchScheduler, при LOCAL_PREFIX_CACHE_MB - PrefixCache.
+    В обоих случаях модель грузится без fused слоев: у них собственный KV-кеш, DynamicCache им не передать
+    name - ключ MODELS: mistral_local (основная AWQ модель) или tiny_local (маленькая модель
+    для коротких ответов, см. routing.py)
+    """
+
+    if use_server and MODEL_SERVER_ADDRESS:
+        return {"server": MODEL_SERVER_ADDRESS, "name": name}
+    if name == "tiny_local":
+        return _get_tiny_model_cfg()
+    if name not in _local_model_cfgs:
+        with _lock:
+            if name not in _local_model_cfgs:
+                from awq import AutoAWQForCausalLM
+                from transformers import AutoTokenizer
+
+                from src.utilities.llm_module.batching import BatchScheduler
+                from src.utilities.llm_module.prefix_cache import PrefixCache
+
+                model_path = MODELS[name]
+                batching = LOCAL_BATCHING_CFG["enabled"]
+                prefix_cache = LOCAL_PREFIX_CACHE_MB > 0
+                logger.info(f"Loading local model {model_path}")
+                cfg = {
+                    "model": AutoAWQForCausalLM.from_quantized(model_path, fuse_layers=not (batching or prefix_cache)),
+                    "tokenizer": AutoTokenizer.from_pretrained(model_path, trust_remote_code=True),
+                }
+                if batching:
+                    cfg["scheduler"] = BatchScheduler(
+                        cfg["model"], cfg["tokenizer"],
+                        max_batch_size=LOCAL_BATCHING_CFG["max_batch_size"],
+                        max_wait_ms=LOCAL_BATCHING_CFG["max_wait_ms"])
+                if prefix_cache:
+                    cfg["prefix_cache"] = PrefixCache(LOCAL_PREFIX_CACHE_MB * 1024 * 1024)
+                _local_model_cfgs[name] = cfg
+                logger.info("Local model loaded")
+    return _local_model_cfgs[name]
+
+
+def _get_tiny_model_cfg() -> Dict:
+    """
+    Маленькая модель (TINY_LOCAL_MODEL) грузится обычным transformers без AWQ,
+    батчинг и кеш префиксов ей не нужны - ответы в пару десятков токенов
+    """
+
+    if "tiny_local" not in _local_model_cfgs:
+        with _lock:
+            if "tiny_local" not in _local_model_cfgs:
+                from transformers import AutoModelForCausalLM, AutoTokenizer
+
+                model_path = MODELS["tiny_local"]
+                if not model_path:
+                    raise ValueError("TINY_LOCAL_MODEL is required for agents routed to the tiny backend")
+                logger.info(f"Loading tiny model {model_path}")
+                model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype="auto").to(DEVICE)
+                model.eval()
+                _local_model_cfgs["tiny_local"] = {
+                    "model": model,
+                    "tokenizer": AutoTokenizer.from_pretrained(model_path, trust_remote_code=True),
+                    "name": "tiny_local",
+                }
+                logger.info("Tiny model loaded")
+    return _local_model_cfgs["tiny_local"]
+
+
+def transcription_workers() -> int:
+    """
+    Число параллельных транскрипций (TRANSCRIPTION_WORKERS, по умолчанию ядра / WHISPER_CPU_THREADS)
+    """
+
+    return TRANSCRIPTION_WORKERS or max(1, (os.cpu_count() or 1) // WHISPER_CPU_THREADS)
+
+
+def get_whisper_model(size: str = WHISPER_MODEL_SIZE, compute_type: str = WHISPER_COMPUTE_TYPE,
+                      device: str = DEVICE):
+    """
+    WhisperModel, загружается при первом обращении и кешируется по (size, compute_type, device).
+    num_workers = числу воркеров пула транскрипции, чтобы одна модель декодировала их параллельно
+    """
+
+    key = (size, compute_type, device)
+    model = _whisper_models.get(key)
+    if model is None:
+        with _lock:
+            model = _whisper_models.get(key)
+            if model is None:
+                from faster_whisper import WhisperModel
+
+                workers = transcription_workers()
+                logger.info(f"Loading whisper model {size} ({compute_type}, {device}, {workers} workers)")
+                model = WhisperModel(size, compute_type=compute_type, device=device,
+                                     cpu_threads=WHISPER_CPU_THREADS, num_workers=workers)
+                _whisper_models[key] = model
+    return model
+
+
+def loaded_whisper_models() -> list:
+    """
+    Какие (size, compute_type, device) Whisper уже загружены в процессе
+    """
+
+    with _lock:
+        return [list(key) for key in _whisper_models]
@@ -0,0 +1,100 @@
+import os
+import threading
+from contextlib import nullcontext
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Connection, Listener
+from typing import Dict, Optional
+
+from src.utilities.debug.logger import setup_logger
+from src.utilities.llm_module.call_functions import mistral_local_call
+from src.utilities.llm_module.llm_constants import MODEL_SERVER_ADDRESS, MODEL_SERVER_AUTHKEY
+from src.utilities.llm_module.states import MESSAGE_TYPES
+from src.utilities.services.model_registry import get_local_model_cfg, get_whisper_model
+from src.utilities.services.transcription import TranscriptionService
+
+logger = setup_logger("ModelServer")
+
+
+class ModelServer:
+    """
+    Отдельный процесс, который владеет весами LLM и Whisper. Воркеры uvicorn ходят сюда по
+    unix-сокету (ModelServerClient), поэтому копия весов одна при любом BACKEND_SERVER_WORKERS.
+
+    Запросы приходят pickle-объектами, поэтому подключиться может только владелец процесса (сокет 0600)
+    и только со знанием MODEL_SERVER_AUTHKEY.
+
+    Запуск:
+        MODEL_SERVER_ADDRESS=/tmp/bpmn-models.sock MODEL_SERVER_AUTHKEY=<секрет> \
+            python -m src.utilities.services.model_server
+    """
+
+    def __init__(self, address: str, authkey: Optional[bytes] = MODEL_SERVER_AUTHKEY):
+        if not authkey:
+            raise ValueError("MODEL_SERVER_AUTHKEY is not set: the model server refuses to start without a secret")
+        self.address = address
+        self.authkey = authkey
+        # generate на одной модели из нескольких потоков не потокобезопасен (кеш fused слоев AWQ)
+        self.llm_lock = threading.Lock()
+
+    def load(self) -> None:
+        get_local_model_cfg(use_server=False)
+        get_whisper_model()
+
+    def serve_forever(self) -> None:
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        # сокет сразу создается с правами 0600, без окна между bind и chmod
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        os.chmod(self.address, 0o600)
+        with listener:
+            logger.info(f"Model server listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, OSError) as e:
+                    logger.warning(f"Rejected connection: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: Connection) -> None:
+        with conn:
+            try:
+                request = conn.recv()
+                if request["op"] == "generate":
+                    result = self._generate(request, conn)
+                elif request["op"] == "transcribe":
+                    result = self._transcribe(request)
+                else:
+                    raise ValueError(f"Unknown operation: {request['op']}")
+                conn.send({"result": result})
+            except (EOFError, BrokenPipeError):
+                logger.warning("Client disconnected")
+            except Exception as e:
+                logger.exception(f"Request failed: {e}")
+                try:
+                    conn.send({"error": f"{type(e).__name__}: {e}"})
+                except OSError:
+                    pass
+
+    def _generate(self, request: Dict, conn: Connection) -> str:
+        messages = [MESSAGE_TYPES[role](content=content) for role, content in request["messages"]]
+        on_token = (lambda text: conn.send({"token": text})) if request["stream"] else None
+        local_model_cfg = get_local_model_cfg(use_server=False, name=request["kwargs"].pop("model", "mistral_local"))
+        # с планировщиком батчей параллельные запросы как раз и нужны, он сам владеет моделью
+        with nullcontext() if "scheduler" in local_model_cfg else self.llm_lock:
+            return mistral_local_call(messages, local_model_cfg, on_token=on_token, **request["kwargs"])
+
+    @staticmethod
+    def _transcribe(request: Dict) -> str:
+        service = TranscriptionService(model=get_whisper_model())
+        return service.transcribe(request["audio_file"], **request["kwargs"])
+
+
+if __name__ == "__main__":
+    server = ModelServer(MODEL_SERVER_ADDRESS or "/tmp/bpmn-models.sock")
+    server.load()
+    server.serve_forever()
@@ -0,0 +1,209 @@
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional
+
+from src.config.manager import settings
+from src.utilities.debug.logger import setup_logger
+from src.utilities.llm_module.states import GenerationState, dump_state, load_state
+
+logger = setup_logger("SessionStore")
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+class KeyedLock:
+    """
+    Отдельный лок на каждый ключ; запись удаляется, когда лок никто не держит и не ждет
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, List] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def __call__(self, key: str) -> Iterator[None]:
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+
+class SessionStore(ABC):
+    """
+    Хранилище состояний графа генерации, ключ - id сессии (чата).
+    Состояния хранятся в сериализованном виде (см. states.dump_state), поэтому
+    get всегда отдает новую копию и параллельные запросы не делят один объект.
+    Чтение-изменение-запись состояния (get -> граф -> set) делается под lock(session_id),
+    иначе из двух параллельных запросов одной сессии выживет только последняя запись
+    """
+
+    def __init__(self):
+        self._session_locks = KeyedLock()
+
+    @contextmanager
+    def lock(self, session_id: str) -> Iterator[None]:
+        with self._session_locks(session_id):
+            yield
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[GenerationState]:
+        ...
+
+    @abstractmethod
+    def set(self, session_id: str, state: GenerationState) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        ...
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    LRU в памяти процесса с вытеснением по TTL (время с последнего обращения)
+    и по количеству сессий
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600):
+        super().__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[GenerationState]:
+        with self._lock:
+            self._evict_expired()
+            item = self._data.get(session_id)
+            if item is None:
+                return None
+            self._data[session_id] = (time.monotonic(), item[1])
+            self._data.move_to_end(session_id)
+        return load_state(item[1])
+
+    def set(self, session_id: str, state: GenerationState) -> None:
+        data = dump_state(state)
+        with self._lock:
+            self._data[session_id] = (time.monotonic(), data)
+            self._data.move_to_end(session_id)
+            while len(self._data) > self.max_size:
+                evicted, _ = self._data.popitem(last=False)
+                logger.debug(f"Session {evicted} evicted (max size)")
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._data.pop(session_id, None)
+
+    def _evict_expired(self) -> None:
+        """
+        Записи упорядочены по времени обращения, поэтому просроченные всегда в начале
+        """
+
+        deadline = time.monotonic() - self.ttl
+        while self._data:
+            session_id, (touched, _) = next(iter(self._data.items()))
+            if touched >= deadline:
+                break
+            self._data.popitem(last=False)
+            logger.debug(f"Session {session_id} evicted (ttl)")
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Хранилище на локальном диске, переживает рестарт и общее для всех воркеров uvicorn.
+    Лок сессии общий для воркеров: flock на один из lock_stripes файлов рядом с базой
+    (файлов фиксированное число, сессии с одним номером просто ждут друг друга)
+    """
+
+    def __init__(self, path: str, ttl: float = 3600, lock_stripes: int = 256):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.lock_stripes = lock_stripes
+        self._lock_dir = f"{os.path.abspath(path)}.locks"
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        os.makedirs(self._lock_dir, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 соединения нельзя делить между потоками, держим по одному на поток
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def lock(self, session_id: str) -> Iterator[None]:
+        stripe = zlib.crc32(session_id.encode("utf-8")) % self.lock_stripes
+        with super().lock(session_id), open(os.path.join(self._lock_dir, f"{stripe}.lock"), "a") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def get(self, session_id: str) -> Optional[GenerationState]:
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?",
+                         (time.time() - self.ttl,))
+            row = conn.execute("SELECT data FROM sessions WHERE id = ?",
+                               (session_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE sessions SET updated_at = ? WHERE id = ?",
+                         (time.time(), session_id))
+        return load_state(row[0])
+
+    def set(self, session_id: str, state: GenerationState) -> None:
+        data = dump_state(state)
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, updated_at) VALUES (?, ?, ?)",
+                (session_id, data, time.time()))
+
+    def delete(self, session_id: str) -> None:
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+
+@lru_cache()
+def get_session_store() -> SessionStore:
+    """
+    Бэкенд выбирается через SESSION_STORE_BACKEND (memory | sqlite)
+    """
+
+    backend = settings.SESSION_STORE_BACKEND
+    if backend == "memory":
+        return InMemorySessionStore(max_size=settings.SESSION_MAX_SIZE,
+                                    ttl=settings.SESSION_TTL_SECONDS)
+    if backend == "sqlite":
+        return SQLiteSessionStore(path=settings.SESSION_DB_PATH,
+                                  ttl=settings.SESSION_TTL_SECONDS)
+    raise ValueError(f"Unknown session store backend: {backend}")
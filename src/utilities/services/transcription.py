@@ -1,22 +1,84 @@
-from faster_whisper import WhisperModel
-import torch
-from tqdm import tqdm
+import hashlib
+import json
+from functools import lru_cache
+from typing import Dict, Iterator, Optional, Union
 
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+import decouple
+import numpy as np
 
+from src.utilities.llm_module.llm_constants import MODEL_SERVER_ADDRESS
+from src.utilities.llm_module.response_cache import ResponseCache
+from src.utilities.services.audio_service import SAMPLE_RATE, decode_audio, trim_silence
+from src.utilities.services.model_client import ModelServerClient
+from src.utilities.services.model_registry import WHISPER_COMPUTE_TYPE, WHISPER_MODEL_SIZE, get_whisper_model
+
+# записи не длиннее WHISPER_BATCH_MAX_SECONDS декодируются батчами VAD-фрагментов
+WHISPER_BATCH_SIZE = decouple.config("WHISPER_BATCH_SIZE", default=8, cast=int)
+WHISPER_BATCH_MAX_SECONDS = decouple.config("WHISPER_BATCH_MAX_SECONDS", default=300, cast=float)
+# пусто - язык определяется по записи
+WHISPER_LANGUAGE = decouple.config("WHISPER_LANGUAGE", default="") or None
+# кеш транскриптов по хешу содержимого записи, TRANSCRIPT_CACHE_DB_PATH - второй уровень на диске
+TRANSCRIPT_CACHE_MAX_SIZE = decouple.config("TRANSCRIPT_CACHE_MAX_SIZE", default=1024, cast=int)
+TRANSCRIPT_CACHE_TTL = decouple.config("TRANSCRIPT_CACHE_TTL", default=7 * 86400, cast=float)
+TRANSCRIPT_CACHE_DB_PATH = decouple.config("TRANSCRIPT_CACHE_DB_PATH", default="") or None
+
+
+def transcript_key(audio_hash: str, beam_size: int = 5, language: Optional[str] = WHISPER_LANGUAGE) -> str:
+    """
+    Ключ транскрипта: sha256 содержимого записи + модель + параметры декодирования
+    """
+
+    payload = [audio_hash, f"{WHISPER_MODEL_SIZE}/{WHISPER_COMPUTE_TYPE}", beam_size, language or ""]
+    return hashlib.sha256(json.dumps(payload).encode("utf-8")).hexdigest()
+
+
+@lru_cache()
+def get_transcript_cache() -> ResponseCache:
+    """
+    Сегменты транскриптов (JSON) загруженных записей: повторная загрузка того же файла
+    (ретрай клиента) не транскрибируется заново
+    """
+
+    return ResponseCache(max_size=TRANSCRIPT_CACHE_MAX_SIZE, ttl=TRANSCRIPT_CACHE_TTL, path=TRANSCRIPT_CACHE_DB_PATH)
 
-model = WhisperModel("small", compute_type='int8', device=DEVICE)
 
 class TranscriptionService:
-    def __init__(self, model: WhisperModel = model):
+    def __init__(self, model=None):
+        """
+        model - WhisperModel, если не передан, берется при первой транскрипции из реестра
+        (или запрос уходит в model-server, если задан MODEL_SERVER_ADDRESS)
+        """
         self.model = model
 
-    def transcribe(self, audio_file: str) -> str:
-        segments, _ = self.model.transcribe(audio_file, beam_size=5)
-        result = []
+    def iter_segments(self, audio_file: Union[str, np.ndarray], beam_size: int = 5) -> Iterator[Dict]:
+        """
+        audio_file - путь к записи или уже готовый массив float32 16 кГц моно (фраза из потока с микрофона).
+        Сегменты {"start", "end", "text"} по мере декодирования (faster_whisper отдает их лениво).
+        Короткие записи идут через BatchedInferencePipeline: речь режется VAD на фрагменты,
+        которые декодируются батчем за один проход; длинные - последовательно, чтобы не держать
+        признаки всей записи в памяти. model-server отвечает целым текстом, он приходит одним сегментом
+        """
+        if self.model is None and MODEL_SERVER_ADDRESS:
+            text = ModelServerClient(MODEL_SERVER_ADDRESS).transcribe(audio_file, beam_size=beam_size)
+            yield {"start": 0.0, "end": None, "text": text}
+            return
+
+        from faster_whisper import BatchedInferencePipeline
 
-        # Оборачиваем цикл в tqdm для отображения прогресса
-        for segment in tqdm(segments, desc="Транскрипция в процессе...", unit="сегмент"):
-            result.append(segment.text)
+        model = self.model or get_whisper_model()
+        # файл декодируется один раз, дальше модель работает с массивом 16 кГц без тишины по краям
+        audio = audio_file if isinstance(audio_file, np.ndarray) else decode_audio(audio_file)
+        audio, offset = trim_silence(audio)
+        if not len(audio):
+            return
+        if len(audio) <= WHISPER_BATCH_MAX_SECONDS * SAMPLE_RATE:
+            # у пайплайна есть состояние между сегментами, поэтому он свой на каждый вызов (создание дешевое)
+            segments, _ = BatchedInferencePipeline(model=model).transcribe(
+                audio, beam_size=beam_size, language=WHISPER_LANGUAGE, batch_size=WHISPER_BATCH_SIZE)
+        else:
+            segments, _ = model.transcribe(audio, beam_size=beam_size, language=WHISPER_LANGUAGE)
+        for segment in segments:
+            yield {"start": segment.start + offset, "end": segment.end + offset, "text": segment.text}
 
-        return " ".join(result)
\ No newline at end of file
+    def transcribe(self, audio_file: Union[str, np.ndarray], beam_size: int = 5) -> str:
+        return " ".join(segment["text"].strip() for segment in self.iter_segments(audio_file, beam_size))
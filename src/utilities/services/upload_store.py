@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Dict, Iterable
+
+from src.config.manager import settings
+from src.utilities.debug.logger import setup_logger
+
+logger = setup_logger("UploadStore")
+
+PARTIAL_SUFFIX = ".part"
+
+
+class UploadStore:
+    """
+    Загруженные записи, адресуемые содержимым: файл лежит под sha256 своих байт, поэтому повторная
+    загрузка того же файла не занимает место, а только обновляет время файла.
+    Сборка мусора удаляет файлы старше max_age и, если каталог больше max_bytes, самые старые сверх квоты.
+    Файлы моложе grace и файлы незавершенных задач не трогаются
+    """
+
+    def __init__(self, directory: str, max_age: float, max_bytes: int, gc_interval: float = 600,
+                 grace: float = 300):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.gc_interval = gc_interval
+        self.grace = grace
+        self._lock = threading.Lock()
+        self._last_gc = 0.0
+        self._stats = {"stored": 0, "deduplicated": 0, "collected": 0, "collected_bytes": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def partial_path(self) -> str:
+        return os.path.join(self.directory, f"{os.urandom(8).hex()}{PARTIAL_SUFFIX}")
+
+    def commit(self, partial_path: str, digest: str, extension: str) -> str:
+        """
+        Дописанный файл встает на место по хешу; если такой уже есть - дубликат удаляется
+        """
+
+        path = os.path.join(self.directory, f"{digest}{extension}")
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(partial_path)
+                os.utime(path)
+                self._stats["deduplicated"] += 1
+            else:
+                os.replace(partial_path, path)
+                self._stats["stored"] += 1
+        return path
+
+    def collect(self, protected: Iterable[str] = ()) -> None:
+        """
+        :param protected: пути, которые нельзя удалять (записи задач в работе)
+        """
+
+        protected = {os.path.abspath(path) for path in protected}
+        now = time.time()
+        with self._lock:
+            files = []
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and os.path.abspath(entry.path) not in protected:
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+            files.sort()
+            total = sum(size for _, size, _ in files)
+            for mtime, size, path in files:
+                age = now - mtime
+                if age < self.grace or (age <= self.max_age and total <= self.max_bytes):
+                    continue
+                # недописанные файлы (обрыв загрузки, рестарт) удаляются только по возрасту
+                if age <= self.max_age and path.endswith(PARTIAL_SUFFIX):
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self._stats["collected"] += 1
+                self._stats["collected_bytes"] += size
+        logger.info(f"Upload dir collected: {total / (1024 * 1024):.1f} MB left")
+
+    def maybe_collect(self, protected: Callable[[], Iterable[str]]) -> None:
+        """
+        Сборка мусора не чаще раза в gc_interval, вызывается после загрузок
+        """
+
+        with self._lock:
+            if time.monotonic() - self._last_gc < self.gc_interval:
+                return
+            self._last_gc = time.monotonic()
+        self.collect(protected())
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+
+@lru_cache()
+def get_upload_store() -> UploadStore:
+    return UploadStore(settings.UPLOAD_AUDIO_DIR,
+                       max_age=settings.UPLOAD_MAX_AGE_SECONDS, max_bytes=settings.UPLOAD_DIR_QUOTA_BYTES,
+                       gc_interval=settings.UPLOAD_GC_INTERVAL_SECONDS)
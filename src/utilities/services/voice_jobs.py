@@ -0,0 +1,293 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from src.config.manager import settings
+
+# после этих событий задача больше ничего не публикует
+TERMINAL_EVENTS = ("result", "error")
+
+
+class VoiceJob:
+    """
+    Задача голосового запроса: загруженный файл -> транскрипция -> генерация
+    (без session_id - только транскрипция). Статусы: queued, transcribing, generating, done, error.
+    События прогресса (status, segment, node, token, result, error) публикуются через реестр задач:
+    он хранит состояние задачи и отдает события подписчикам (SSE), в том числе из других воркеров
+    """
+
+    def __init__(self, session_id: Optional[str], audio_file: str, audio_hash: Optional[str] = None,
+                 registry: Optional["VoiceJobRegistry"] = None, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.session_id = session_id
+        self.audio_file = audio_file
+        self.audio_hash = audio_hash
+        self.status = "queued"
+        self.segments: List[str] = []
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.updated_at = time.time()
+        self._registry = registry
+        self._lock = threading.Lock()
+
+    @property
+    def transcript(self) -> str:
+        return " ".join(segment.strip() for segment in self.segments)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "error")
+
+    def publish(self, event: str, data: Dict) -> None:
+        """
+        Потокобезопасно: вызывается из потока транскрипции/генерации
+        """
+
+        with self._lock:
+            self.updated_at = time.time()
+            if event == "segment":
+                self.segments.append(data["text"])
+            elif event == "result":
+                self.status, self.result = "done", data
+            elif event == "error":
+                self.status, self.error = "error", data["detail"]
+            elif event == "status":
+                self.status = data["status"]
+            if self._registry is not None:
+                self._registry.publish(self, event, data)
+
+
+class VoiceJobRegistry(ABC):
+    """
+    Задачи голосовых запросов, законченные задачи удаляются через ttl
+    после последнего события (клиент успевает забрать результат)
+    """
+
+    def __init__(self, ttl: float = 3600):
+        self.ttl = ttl
+
+    def create(self, session_id: Optional[str], audio_file: str, audio_hash: Optional[str] = None) -> VoiceJob:
+        job = VoiceJob(session_id, audio_file, audio_hash, registry=self)
+        self._add(job)
+        return job
+
+    @abstractmethod
+    def _add(self, job: VoiceJob) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[VoiceJob]:
+        """
+        Текущее состояние задачи (для задач другого воркера - снимок)
+        """
+
+    @abstractmethod
+    def active_files(self) -> List[str]:
+        """
+        Записи незавершенных задач - их нельзя удалять из каталога загрузок
+        """
+
+    @abstractmethod
+    def publish(self, job: VoiceJob, event: str, data: Dict) -> None:
+        """
+        Вызывается из job.publish под локом задачи, поля задачи уже обновлены
+        """
+
+    @abstractmethod
+    def events(self, job: VoiceJob) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        События задачи: уже случившиеся и дальше новые, до result/error
+        """
+
+
+class InMemoryVoiceJobRegistry(VoiceJobRegistry):
+    """
+    Задачи в памяти процесса - только для одного воркера (BACKEND_SERVER_WORKERS=1)
+    """
+
+    def __init__(self, ttl: float = 3600):
+        super().__init__(ttl)
+        self._jobs: "OrderedDict[str, VoiceJob]" = OrderedDict()
+        self._events: Dict[str, List[Tuple[str, Dict]]] = {}
+        self._subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, job: VoiceJob) -> None:
+        with self._lock:
+            self._evict_expired()
+            self._jobs[job.id] = job
+            self._events[job.id] = []
+            self._subscribers[job.id] = []
+
+    def get(self, job_id: str) -> Optional[VoiceJob]:
+        with self._lock:
+            self._evict_expired()
+            return self._jobs.get(job_id)
+
+    def active_files(self) -> List[str]:
+        with self._lock:
+            return [job.audio_file for job in self._jobs.values() if not job.finished]
+
+    def publish(self, job: VoiceJob, event: str, data: Dict) -> None:
+        with self._lock:
+            # токены генерации не копятся: опоздавшему подписчику хватит итогового result
+            if event != "token" and job.id in self._events:
+                self._events[job.id].append((event, data))
+            subscribers = list(self._subscribers.get(job.id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+
+    async def events(self, job: VoiceJob) -> AsyncIterator[Tuple[str, Dict]]:
+        queue: asyncio.Queue = asyncio.Queue()
+        with job._lock, self._lock:
+            for item in self._events.get(job.id, ()):
+                queue.put_nowait(item)
+            self._subscribers.setdefault(job.id, []).append((asyncio.get_running_loop(), queue))
+        try:
+            while True:
+                event, data = await queue.get()
+                yield event, data
+                if event in TERMINAL_EVENTS:
+                    return
+        finally:
+            with self._lock:
+                self._subscribers[job.id] = [(loop, q) for loop, q in self._subscribers.get(job.id, ())
+                                             if q is not queue]
+
+    def _evict_expired(self) -> None:
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and now - job.updated_at > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+            self._events.pop(job_id, None)
+            self._subscribers.pop(job_id, None)
+
+
+class SQLiteVoiceJobRegistry(VoiceJobRegistry):
+    """
+    Задачи и их события в SQLite, общие для всех воркеров uvicorn: задачу выполняет воркер,
+    который ее принял, а статус и SSE отдает любой. Подписчик опрашивает таблицу событий
+    раз в poll_interval. Незаконченная задача без событий дольше ttl считается брошенной
+    (воркер упал) и удаляется, чтобы ее запись не держалась в каталоге загрузок вечно
+    """
+
+    def __init__(self, path: str, ttl: float = 3600, poll_interval: float = 0.1):
+        super().__init__(ttl)
+        self.path = path
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS voice_jobs ("
+                "id TEXT PRIMARY KEY, session_id TEXT, audio_file TEXT NOT NULL, audio_hash TEXT, "
+                "status TEXT NOT NULL, segments TEXT NOT NULL, result TEXT, error TEXT, updated_at REAL NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS voice_job_events ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, event TEXT NOT NULL, "
+                "data TEXT NOT NULL)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS voice_job_events_job ON voice_job_events (job_id, seq)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 соединения нельзя делить между потоками, держим по одному на поток
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _add(self, job: VoiceJob) -> None:
+        with self._connection() as conn:
+            self._evict_expired(conn)
+            conn.execute(
+                "INSERT INTO voice_jobs (id, session_id, audio_file, audio_hash, status, segments, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.session_id, job.audio_file, job.audio_hash, job.status, "[]", job.updated_at))
+
+    def get(self, job_id: str) -> Optional[VoiceJob]:
+        conn = self._connection()
+        with conn:
+            self._evict_expired(conn)
+            row = conn.execute(
+                "SELECT session_id, audio_file, audio_hash, status, segments, result, error, updated_at "
+                "FROM voice_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        session_id, audio_file, audio_hash, status, segments, result, error, updated_at = row
+        # снимок для чтения: публикует только воркер, который выполняет задачу
+        job = VoiceJob(session_id, audio_file, audio_hash, job_id=job_id)
+        job.status, job.segments, job.error, job.updated_at = status, json.loads(segments), error, updated_at
+        job.result = json.loads(result) if result is not None else None
+        return job
+
+    def active_files(self) -> List[str]:
+        rows = self._connection().execute(
+            "SELECT audio_file FROM voice_jobs WHERE status NOT IN ('done', 'error')").fetchall()
+        return [row[0] for row in rows]
+
+    def publish(self, job: VoiceJob, event: str, data: Dict) -> None:
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE voice_jobs SET status = ?, segments = ?, result = ?, error = ?, updated_at = ? "
+                "WHERE id = ?",
+                (job.status, json.dumps(job.segments, ensure_ascii=False),
+                 json.dumps(job.result, ensure_ascii=False) if job.result is not None else None,
+                 job.error, job.updated_at, job.id))
+            conn.execute("INSERT INTO voice_job_events (job_id, event, data) VALUES (?, ?, ?)",
+                         (job.id, event, json.dumps(data, ensure_ascii=False)))
+
+    def _read_events(self, job_id: str, after: int) -> Optional[List[Tuple[int, str, str]]]:
+        """
+        События после seq after; None - задачи больше нет (удалена по ttl)
+        """
+
+        conn = self._connection()
+        rows = conn.execute(
+            "SELECT seq, event, data FROM voice_job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+            (job_id, after)).fetchall()
+        if not rows and conn.execute("SELECT 1 FROM voice_jobs WHERE id = ?", (job_id,)).fetchone() is None:
+            return None
+        return rows
+
+    async def events(self, job: VoiceJob) -> AsyncIterator[Tuple[str, Dict]]:
+        after = 0
+        while True:
+            rows = await run_in_threadpool(self._read_events, job.id, after)
+            if rows is None:
+                return
+            for after, event, data in rows:
+                yield event, json.loads(data)
+                if event in TERMINAL_EVENTS:
+                    return
+            if not rows:
+                await asyncio.sleep(self.poll_interval)
+
+    def _evict_expired(self, conn: sqlite3.Connection) -> None:
+        expired = [row[0] for row in conn.execute(
+            "SELECT id FROM voice_jobs WHERE updated_at < ?", (time.time() - self.ttl,))]
+        for job_id in expired:
+            conn.execute("DELETE FROM voice_job_events WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM voice_jobs WHERE id = ?", (job_id,))
+
+
+@lru_cache()
+def get_voice_jobs() -> VoiceJobRegistry:
+    """
+    Хранилище задач следует SESSION_STORE_BACKEND: при sqlite задачи лежат в той же базе, что и сессии
+    """
+
+    if settings.SESSION_STORE_BACKEND == "sqlite":
+        return SQLiteVoiceJobRegistry(path=settings.SESSION_DB_PATH, ttl=settings.VOICE_JOB_TTL_SECONDS)
+    return InMemoryVoiceJobRegistry(ttl=settings.VOICE_JOB_TTL_SECONDS)
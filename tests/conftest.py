@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# обязательные настройки сервера (src/config/settings/base.py) для импорта модулей в тестах
+os.environ.setdefault("BACKEND_SERVER_HOST", "127.0.0.1")
+os.environ.setdefault("BACKEND_SERVER_PORT", "8000")
+os.environ.setdefault("BACKEND_SERVER_WORKERS", "1")
+os.environ.setdefault("IS_ALLOWED_CREDENTIALS", "True")
+os.environ.setdefault("UPLOAD_AUDIO_DIR", os.path.join(ROOT_DIR, ".pytest_cache", "uploads"))
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "bench: замеры производительности, запуск: pytest -m bench -s")
+
+
+def pytest_collection_modifyitems(config, items):
+    # бенчмарки долгие и зависят от машины - только по явному -m bench
+    if "bench" in (config.option.markexpr or ""):
+        return
+    skip = pytest.mark.skip(reason="бенчмарк, запуск: pytest -m bench -s")
+    for item in items:
+        if "bench" in item.keywords:
+            item.add_marker(skip)
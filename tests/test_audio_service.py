@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from src.utilities.services.audio_service import SAMPLE_RATE, VoiceActivityDetector
+
+
+def _stream(*parts):
+    """
+    Сигнал из отрезков (секунды, громкий ли): тон 440 Гц или тишина
+    """
+
+    chunks = []
+    for seconds, voiced in parts:
+        t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+        chunks.append((0.3 * np.sin(2 * np.pi * 440 * t) if voiced else np.zeros_like(t)).astype(np.float32))
+    return np.concatenate(chunks)
+
+
+def _feed(detector, audio, chunk):
+    utterances = []
+    for offset in range(0, len(audio), chunk):
+        utterances.extend(detector.feed(audio[offset:offset + chunk]))
+    return utterances + detector.flush()
+
+
+@pytest.mark.parametrize("chunk", [480, 4000, SAMPLE_RATE * 3, SAMPLE_RATE * 20])
+def test_chunk_size_does_not_change_utterances(chunk):
+    audio = _stream((1, False), (3, True), (1, False), (2, True), (2, False))
+    expected = _feed(VoiceActivityDetector(max_utterance_s=5), audio, 480)
+    utterances = _feed(VoiceActivityDetector(max_utterance_s=5), audio, chunk)
+    assert [len(u) for u in expected] == [len(u) for u in utterances]
+    assert all(np.array_equal(a, b) for a, b in zip(expected, utterances))
+    # фраза целиком, с запасом preroll перед началом
+    assert len(utterances) == 2 and len(utterances[0]) >= 3 * SAMPLE_RATE
+
+
+def test_large_chunk_keeps_start_of_long_utterance():
+    audio = _stream((1, False), (4.5, True), (1, False))
+    detector = VoiceActivityDetector(max_utterance_s=5)
+    (utterance,) = _feed(detector, audio, len(audio))
+    # первый громкий фрейм - тот, в который попало начало тона, перед ним запас preroll
+    start = SAMPLE_RATE // detector.frame * detector.frame - detector.preroll
+    assert len(utterance) > 4.5 * SAMPLE_RATE
+    assert np.array_equal(utterance, audio[start:start + len(utterance)])
+
+
+def test_forced_cut_of_long_speech():
+    audio = _stream((12, True), (1, False))
+    utterances = _feed(VoiceActivityDetector(max_utterance_s=5), audio, len(audio))
+    assert [round(len(u) / SAMPLE_RATE) for u in utterances] == [5, 5, 2]
+    assert np.array_equal(np.concatenate(utterances), audio[:sum(len(u) for u in utterances)])
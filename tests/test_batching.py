@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from src.utilities.llm_module.batching import BatchScheduler
+
+VOCAB = 48
+EOS = VOCAB - 1
+
+
+class CharTokenizer:
+    """
+    Токенизатор крошечной модели: id -> одна буква
+    """
+
+    eos_token_id = EOS
+    pad_token_id = 0
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(ord("A") + i) for i in ids if not (skip_special_tokens and i == EOS))
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = LlamaConfig(vocab_size=VOCAB, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                         num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=128)
+    return LlamaForCausalLM(config).eval()
+
+
+@pytest.fixture()
+def scheduler(model):
+    return BatchScheduler(model, CharTokenizer(), max_batch_size=4, max_wait_ms=5)
+
+
+def reference(model, prompt, max_new_tokens):
+    """
+    Жадная генерация той же модели без батча и без кеша - эталон для строк батча
+    """
+
+    ids = list(prompt)
+    with torch.no_grad():
+        for _ in range(max_new_tokens):
+            token_id = int(model(torch.tensor([ids])).logits[0, -1].argmax())
+            if token_id == EOS:
+                break
+            ids.append(token_id)
+    return CharTokenizer().decode(ids[len(prompt):])
+
+
+PARAMS = {"do_sample": False, "stop_on_json": False}
+
+
+def test_interleaved_admission(model, scheduler):
+    prompts = [[1, 2, 3, 4, 5, 6, 7], [9, 8], [20, 21, 22, 23]]
+    started = threading.Event()
+    tokens = []
+
+    def on_token(text):
+        tokens.append(text)
+        if len(tokens) == 3:
+            started.set()
+
+    first = scheduler.submit(prompts[0], max_new_tokens=24, on_token=on_token, **PARAMS)
+    # остальные подключаются к батчу, когда первая строка уже генерирует
+    assert started.wait(10)
+    others = [scheduler.submit(prompt, max_new_tokens=16, **PARAMS) for prompt in prompts[1:]]
+
+    assert first.result(30) == reference(model, prompts[0], 24)
+    for prompt, future in zip(prompts[1:], others):
+        assert future.result(30) == reference(model, prompt, 16)
+    assert "".join(tokens) == first.result()
+
+
+def test_early_stop_keeps_other_rows(model, scheduler):
+    short = scheduler.submit([3, 1, 4, 1, 5], max_new_tokens=2, **PARAMS)
+    long = scheduler.submit([2, 7, 1, 8], max_new_tokens=20, **PARAMS)
+    assert short.result(30) == reference(model, [3, 1, 4, 1, 5], 2)
+    assert long.result(30) == reference(model, [2, 7, 1, 8], 20)
+
+
+def test_stop_string(model, scheduler):
+    expected = reference(model, [5, 5, 5], 20)
+    stop = expected[3:5]
+    result = scheduler.submit([5, 5, 5], max_new_tokens=20, stop=[stop], **PARAMS).result(30)
+    assert result.endswith(stop) and expected.startswith(result)
+
+
+def test_failing_callback_finishes_only_its_row(model, scheduler):
+    def broken_client(text):
+        raise BrokenPipeError("client disconnected")
+
+    healthy = [scheduler.submit(prompt, max_new_tokens=12, **PARAMS) for prompt in ([1, 2, 3], [4, 5, 6, 7])]
+    broken = scheduler.submit([7, 7, 7], max_new_tokens=12, on_token=broken_client, **PARAMS)
+
+    with pytest.raises(BrokenPipeError):
+        broken.result(30)
+    assert healthy[0].result(30) == reference(model, [1, 2, 3], 12)
+    assert healthy[1].result(30) == reference(model, [4, 5, 6, 7], 12)
+
+    # планировщик жив и принимает новые запросы
+    assert scheduler.generate([9, 9], max_new_tokens=4, **PARAMS) == reference(model, [9, 9], 4)
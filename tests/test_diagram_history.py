@@ -0,0 +1,42 @@
+from src.utilities.llm_module.diagram_history import DiagramHistory
+
+DIAGRAM = {"nodes": [{"id": 1, "shape": "event", "label": "start"}, {"id": 2, "shape": "activity", "label": "a"}],
+           "edges": [{"source": 1, "target": 2}]}
+
+
+def test_empty_diagram_is_not_shared():
+    first, second = DiagramHistory(), DiagramHistory()
+    first.latest()["nodes"].append({"id": 1})
+    assert first.latest() == second.latest() == {"nodes": [], "edges": []}
+
+
+def test_mutating_result_does_not_change_history():
+    history = DiagramHistory()
+    version = history.commit(DIAGRAM)
+    history.commit({"nodes": DIAGRAM["nodes"][:1], "edges": []})
+
+    history.latest()["nodes"][0]["label"] = "changed"
+    history.get(version)["nodes"][1]["label"] = "changed"
+    assert history.latest()["nodes"][0]["label"] == "start"
+    assert history.get(version) == DIAGRAM
+    history.undo()
+    assert history.latest() == DIAGRAM
+
+
+def test_view_and_is_empty_do_not_copy():
+    history = DiagramHistory()
+    assert history.is_empty()
+    version = history.commit(DIAGRAM)
+    assert not history.is_empty()
+    assert history.view() is history.view(version)
+    assert history.view() == history.latest() == DIAGRAM
+
+
+def test_patch_on_view_leaves_history_intact():
+    from src.utilities.llm_module.patches import apply_patch
+
+    history = DiagramHistory()
+    history.commit(DIAGRAM)
+    patched = apply_patch(history.view(), [{"op": "relabel", "id": 2, "label": "b"}])
+    assert patched["nodes"][1]["label"] == "b"
+    assert history.view() == DIAGRAM
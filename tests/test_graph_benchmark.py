@@ -0,0 +1,44 @@
+import logging
+import time
+from typing import Dict
+
+import pytest
+
+from src.utilities.llm_module import graphs
+from src.utilities.llm_module.graphs import GenerationGraph, get_generation_graph
+from src.utilities.llm_module.states import generation
+
+pytestmark = pytest.mark.bench
+
+
+def stub_call(messages, local_model_cfg=None):
+    return '{"is_bpmn_request": false, "content": "nothing"}'
+
+
+def benchmark(num_requests: int = 200) -> Dict[str, float]:
+    """
+    Накладные расходы графа на запрос (мс), LLM заменен заглушкой, которая сразу отклоняет запрос в verifier:
+    * rebuild - сборка и компиляция графа на каждый запрос (как было до кеша)
+    * cached - граф из get_generation_graph
+    """
+
+    config = {"configurable": {"mode": "api", "llm_call": stub_call, "local_model_cfg": None}}
+    level = graphs.logger.level
+    graphs.logger.setLevel(logging.WARNING)
+    try:
+        results = {}
+        for name, factory in [("rebuild", lambda: GenerationGraph(mode="api")),
+                              ("cached", lambda: get_generation_graph(mode="api"))]:
+            start = time.perf_counter()
+            for _ in range(num_requests):
+                factory().compiled.invoke(generation("Какая погода сегодня?"), config=config)
+            results[name] = (time.perf_counter() - start) * 1000 / num_requests
+    finally:
+        graphs.logger.setLevel(level)
+    return results
+
+
+def test_cached_graph_overhead():
+    results = benchmark()
+    print(f"\nrebuild {results['rebuild']:.1f} ms/request, cached {results['cached']:.1f} ms/request")
+    assert results["cached"] < results["rebuild"]
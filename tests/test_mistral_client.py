@@ -0,0 +1,207 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import pytest
+from mistralai.models import UserMessage
+
+from src.utilities.llm_module import mistral_client
+from src.utilities.llm_module.llm_constants import MISTRAL_CLIENT_CFG
+from src.utilities.llm_module.mistral_client import (CircuitOpenError, MistralUnavailableError, RetryPolicy,
+                                                     get_mistral_client)
+
+MESSAGES = [UserMessage(content="ping")]
+
+
+def _completion(text: str) -> dict:
+    return {"id": "stub", "object": "chat.completion", "model": "stub", "created": 0,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}
+
+
+def _chunk(text: str) -> dict:
+    return {"id": "stub", "object": "chat.completion.chunk", "model": "stub", "created": 0,
+            "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+
+
+class StubMistral:
+    """
+    Заглушка API: ответы на POST /v1/chat/completions берутся по очереди из replies,
+    последний повторяется. Ответ - код статуса, текст (или список чанков для стриминга) и задержка
+    """
+
+    def __init__(self):
+        self.replies: List[tuple] = [(200, "ok", 0)]
+        self.requests: List[dict] = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests.append(body)
+                status, payload, delay = stub.replies[min(len(stub.requests), len(stub.replies)) - 1]
+                time.sleep(delay)
+                if status != 200:
+                    data = json.dumps({"message": f"stub error {status}"}).encode()
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                if body.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.end_headers()
+                    for text in payload:
+                        self.wfile.write(f"data: {json.dumps(_chunk(text))}\n\n".encode())
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    return
+                data = json.dumps(_completion(payload)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        # медленные ответы не держат остановку сервера
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture()
+def stub(monkeypatch):
+    server = StubMistral()
+    # клиент собирается из конфига, как в проде: MISTRAL_SERVER_URL указывает на заглушку
+    monkeypatch.setattr(mistral_client, "MISTRAL_API_KEY", "test-key")
+    for key, value in {"server_url": server.url, "model": "stub", "timeout": 5, "max_attempts": 4,
+                       "backoff_base": 0.01, "backoff_max": 0.05, "deadline": 5,
+                       "breaker_threshold": 3, "breaker_reset": 0.3}.items():
+        monkeypatch.setitem(MISTRAL_CLIENT_CFG, key, value)
+    get_mistral_client.cache_clear()
+    yield server
+    get_mistral_client.cache_clear()
+    server.close()
+
+
+def test_full_jitter_delay(monkeypatch):
+    bounds = []
+    monkeypatch.setattr(mistral_client.random, "uniform", lambda low, high: bounds.append((low, high)) or high)
+    policy = RetryPolicy(base_delay=0.5, max_delay=3.0)
+    assert [policy.delay(attempt) for attempt in range(5)] == [0.5, 1.0, 2.0, 3.0, 3.0]
+    assert all(low == 0 for low, _ in bounds)
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_retries_retryable_statuses(stub, status):
+    stub.replies = [(status, "", 0), (status, "", 0), (200, "recovered", 0)]
+    client = get_mistral_client()
+    assert client.complete(MESSAGES) == "recovered"
+    assert len(stub.requests) == 3
+    assert client.circuit_breaker.state == "closed"
+
+
+def test_client_errors_are_not_retried(stub):
+    stub.replies = [(400, "", 0)]
+    client = get_mistral_client()
+    with pytest.raises(Exception) as error:
+        client.complete(MESSAGES)
+    assert not isinstance(error.value, MistralUnavailableError)
+    assert len(stub.requests) == 1
+    assert client.circuit_breaker.state == "closed"
+
+
+def test_gives_up_after_max_attempts(stub):
+    MISTRAL_CLIENT_CFG.update(breaker_threshold=1000)
+    stub.replies = [(503, "", 0)]
+    with pytest.raises(MistralUnavailableError, match="after 4 attempts"):
+        get_mistral_client().complete(MESSAGES)
+    assert len(stub.requests) == 4
+
+
+def test_overall_deadline(stub):
+    MISTRAL_CLIENT_CFG.update(deadline=1.0, max_attempts=100, breaker_threshold=1000)
+    stub.replies = [(503, "", 0.3)]
+    started = time.monotonic()
+    with pytest.raises(MistralUnavailableError, match="deadline"):
+        get_mistral_client().complete(MESSAGES)
+    assert time.monotonic() - started < 1.5
+    assert 1 < len(stub.requests) < 100
+
+
+def test_deadline_caps_request_timeout(stub):
+    MISTRAL_CLIENT_CFG.update(deadline=0.5, max_attempts=100, breaker_threshold=1000)
+    stub.replies = [(200, "too late", 3)]
+    started = time.monotonic()
+    with pytest.raises(MistralUnavailableError):
+        get_mistral_client().complete(MESSAGES)
+    assert time.monotonic() - started < 1.5
+
+
+def test_circuit_breaker_open_half_open_close(stub):
+    MISTRAL_CLIENT_CFG.update(max_attempts=1)
+    client = get_mistral_client()
+    stub.replies = [(503, "", 0)]
+    for _ in range(3):
+        with pytest.raises(MistralUnavailableError):
+            client.complete(MESSAGES)
+    assert client.circuit_breaker.state == "open"
+
+    # разомкнутый предохранитель отклоняет без обращения к сети
+    with pytest.raises(CircuitOpenError):
+        client.complete(MESSAGES)
+    assert len(stub.requests) == 3
+
+    # пробный запрос в half-open падает - снова open
+    time.sleep(0.35)
+    assert client.circuit_breaker.state == "half-open"
+    with pytest.raises(MistralUnavailableError):
+        client.complete(MESSAGES)
+    assert client.circuit_breaker.state == "open"
+
+    # успешный пробный запрос замыкает
+    time.sleep(0.35)
+    stub.replies = [(200, "back", 0)]
+    stub.requests.clear()
+    assert client.complete(MESSAGES) == "back"
+    assert client.circuit_breaker.state == "closed"
+
+
+def test_stream(stub):
+    stub.replies = [(200, ["Hel", "lo", " world"], 0)]
+    tokens = []
+    assert get_mistral_client().stream(MESSAGES, on_token=tokens.append) == "Hello world"
+    assert tokens == ["Hel", "lo", " world"]
+    assert stub.requests[0]["stream"] is True
+
+
+def test_stream_stops_early(stub):
+    stub.replies = [(200, ["{", "\"a\": 1", "}", "trailing"], 0)]
+    text = get_mistral_client().stream(MESSAGES, until=lambda chunk: chunk == "}")
+    assert text == "{\"a\": 1}"
+
+
+def test_stream_retries_before_first_token(stub):
+    stub.replies = [(503, "", 0), (200, ["ok"], 0)]
+    assert get_mistral_client().stream(MESSAGES) == "ok"
+    assert len(stub.requests) == 2
+
+
+def test_complete_async(stub):
+    import asyncio
+
+    stub.replies = [(502, "", 0), (200, "async", 0)]
+    assert asyncio.run(get_mistral_client().complete_async(MESSAGES)) == "async"
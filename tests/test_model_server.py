@@ -0,0 +1,42 @@
+import os
+import stat
+import threading
+import time
+from multiprocessing import AuthenticationError
+
+import pytest
+
+from src.utilities.services.model_client import ModelServerClient, ModelServerError
+from src.utilities.services.model_server import ModelServer
+
+KEY = b"test-secret"
+
+
+@pytest.fixture()
+def address(tmp_path):
+    path = str(tmp_path / "models.sock")
+    threading.Thread(target=ModelServer(path, authkey=KEY).serve_forever, daemon=True).start()
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.01)
+    return path
+
+
+def test_refuses_to_start_without_authkey(tmp_path):
+    with pytest.raises(ValueError, match="MODEL_SERVER_AUTHKEY"):
+        ModelServer(str(tmp_path / "models.sock"), authkey=None)
+    with pytest.raises(ValueError, match="MODEL_SERVER_AUTHKEY"):
+        ModelServerClient(str(tmp_path / "models.sock"), authkey=b"")
+
+
+def test_socket_is_owner_only(address):
+    assert stat.S_IMODE(os.stat(address).st_mode) == 0o600
+
+
+def test_wrong_authkey_is_rejected(address):
+    with pytest.raises(AuthenticationError):
+        ModelServerClient(address, authkey=b"guess").transcribe("a.wav")
+    # сервер продолжает принимать клиентов с верным ключом
+    with pytest.raises(ModelServerError, match="Unknown operation"):
+        ModelServerClient(address, authkey=KEY)._request({"op": "noop"})
@@ -0,0 +1,71 @@
+import itertools
+
+import pytest
+
+from src.utilities.llm_module.preclassifier import NgramNaiveBayes, PreClassifier
+
+ACCEPT_VERBS = ["Нарисуй", "Построй", "Сделай", "Опиши", "Покажи", "Смоделируй"]
+ACCEPT_OBJECTS = ["процесс найма сотрудника", "согласование договора", "обработку заказа в интернет-магазине",
+                  "возврат товара покупателем", "оформление отпуска", "закупку оборудования", "выдачу кредита",
+                  "онбординг нового клиента", "обработку обращения в поддержку", "выставление счета"]
+REJECTS = ["Расскажи анекдот про программистов", "Какая завтра погода в Москве", "Сколько будет два плюс два",
+           "Переведи это предложение на английский", "Напиши код сортировки пузырьком на питоне",
+           "Кто выиграл чемпионат мира по футболу", "Посоветуй хороший фильм на вечер", "Какой сегодня день недели",
+           "Объясни теорию относительности простыми словами", "Придумай имя для кота"]
+SUFFIXES = ["", " пожалуйста", ", срочно", " подробно", " кратко", " для меня"]
+
+
+@pytest.fixture()
+def classifier() -> PreClassifier:
+    classifier = PreClassifier(min_samples=50)
+    for verb, obj in itertools.islice(itertools.product(ACCEPT_VERBS, ACCEPT_OBJECTS), 60):
+        classifier.record(f"{verb} {obj}", True)
+    for text, suffix in itertools.islice(itertools.product(REJECTS, SUFFIXES), 60):
+        classifier.record(text + suffix, False)
+    return classifier
+
+
+@pytest.mark.parametrize("text", ["Напиши стихотворение о весне", "Сделай мне презентацию про продажи",
+                                  "Составь план тренировок на неделю"])
+def test_unrelated_requests_are_not_accepted(classifier, text):
+    assert classifier.classify(text)[0] is not True
+
+
+def test_model_never_accepts_without_llm(classifier):
+    for verb, obj in itertools.product(ACCEPT_VERBS, ACCEPT_OBJECTS):
+        decision, source = classifier.classify(f"{verb} {obj}")
+        assert (decision, source) == (None, "llm")
+    assert "model_accept" not in classifier.stats()
+
+
+def test_confidence_does_not_saturate_with_length(classifier):
+    _, short = classifier.model.predict("Сделай мне презентацию")
+    _, long = classifier.model.predict("Сделай мне презентацию про продажи за третий квартал с графиками и выводами")
+    assert short < 0.75 and long < 0.75
+
+
+def test_logged_reject_is_short_circuited(classifier):
+    assert classifier.classify("Расскажи анекдот про программистов") == (False, "model")
+
+
+def test_rules(classifier):
+    assert classifier.classify("Построй BPMN диаграмму закупки") == (True, "rule")
+    assert classifier.classify("Привет!") == (False, "rule")
+
+
+def test_model_needs_min_samples():
+    model = NgramNaiveBayes()
+    model.update("Нарисуй процесс найма", True)
+    classifier = PreClassifier(min_samples=1)
+    classifier.model = model
+    assert classifier.classify("Расскажи анекдот") == (None, "llm")
+
+
+def test_llm_route_counted_without_record(classifier):
+    # ответ verifier из кеша не доходит до record, но запрос все равно ушел мимо пре-классификатора
+    before = classifier.stats()
+    assert classifier.classify("Расскажи анекдот") == (None, "llm")
+    after = classifier.stats()
+    assert after["llm"] == before["llm"] + 1
+    classifier.record("Расскажи анекдот", False)
+    assert classifier.stats()["llm"] == after["llm"]
@@ -0,0 +1,47 @@
+import threading
+import time
+
+import pytest
+
+from src.utilities.llm_module.states import generation
+from src.utilities.services.session_store import InMemorySessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemorySessionStore()
+    return SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"))
+
+
+def test_lock_serialises_same_session(store):
+    store.set("chat", generation("start"))
+
+    def append(text):
+        # чтение-изменение-запись, как в generate_output; пауза - время работы графа
+        with store.lock("chat"):
+            state = store.get("chat")
+            time.sleep(0.01)
+            state["user_input"].append(text)
+            store.set("chat", state)
+
+    threads = [threading.Thread(target=append, args=(f"edit {i}",)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(store.get("chat")["user_input"][1:]) == sorted(f"edit {i}" for i in range(8))
+
+
+def test_lock_does_not_block_other_sessions(store):
+    entered = threading.Event()
+
+    def other():
+        with store.lock("second"):
+            entered.set()
+
+    with store.lock("first"):
+        thread = threading.Thread(target=other)
+        thread.start()
+        assert entered.wait(2)
+    thread.join()
@@ -0,0 +1,14 @@
+import pydantic
+import pytest
+
+from src.config.settings.base import BackendBaseSettings
+
+
+def test_memory_sessions_with_several_workers_fail_at_startup():
+    with pytest.raises(pydantic.ValidationError, match="SESSION_STORE_BACKEND"):
+        BackendBaseSettings(SERVER_WORKERS=4, SESSION_STORE_BACKEND="memory")
+
+
+def test_shared_store_with_several_workers():
+    assert BackendBaseSettings(SERVER_WORKERS=4, SESSION_STORE_BACKEND="sqlite").SESSION_STORE_BACKEND == "sqlite"
+    assert BackendBaseSettings(SERVER_WORKERS=1, SESSION_STORE_BACKEND="memory").SESSION_STORE_BACKEND == "memory"
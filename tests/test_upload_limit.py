@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.api.routes import graph_audio_input
+from src.api.routes.graph_audio_input import FORM_OVERHEAD_BYTES
+
+LIMIT = 1000
+BOUNDARY = "limit-test"
+
+
+@pytest.fixture()
+def app(monkeypatch):
+    monkeypatch.setattr(graph_audio_input.settings, "UPLOAD_MAX_BYTES", LIMIT)
+    app = FastAPI()
+    app.include_router(graph_audio_input.router)
+    return app
+
+
+def test_content_length_over_limit_is_rejected_before_parsing(app):
+    response = TestClient(app).post("/user_input/voice",
+                                    files={"file": ("a.wav", b"0" * (LIMIT + FORM_OVERHEAD_BYTES))})
+    assert response.status_code == 413
+
+
+def test_small_request_reaches_handler(app):
+    response = TestClient(app).post("/user_input/voice", files={"file": ("a.txt", b"0" * 10)})
+    assert response.status_code == 400
+
+
+def test_chunked_body_stops_at_limit(app):
+    head = (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.wav\"\r\n"
+            f"Content-Type: audio/wav\r\n\r\n").encode()
+    chunk = b"0" * 4096
+    chunks = [head] + [chunk] * 100
+    consumed = 0
+    sent = []
+
+    async def receive():
+        nonlocal consumed
+        consumed += 1
+        return {"type": "http.request", "body": chunks[consumed - 1], "more_body": consumed < len(chunks)}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+             "scheme": "http", "path": "/user_input/voice", "raw_path": b"/user_input/voice", "root_path": "",
+             "query_string": b"", "server": ("test", 80), "client": ("test", 1),
+             "headers": [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode()),
+                         (b"transfer-encoding", b"chunked")]}
+    asyncio.run(app(scope, receive, send))
+
+    assert sent[0]["status"] == 413
+    # тело дочитывается только до лимита
+    assert consumed * len(chunk) <= LIMIT + FORM_OVERHEAD_BYTES + 2 * len(chunk)
@@ -0,0 +1,91 @@
+import json
+
+from src.utilities.llm_module.graphs import GenerationGraph
+from src.utilities.llm_module.llm_constants import GENERATION_NUM_ITERATIONS, PROMPTS
+from src.utilities.llm_module.states import generation
+from src.utilities.llm_module.validator import repair_diagram
+
+DIAGRAM = {
+    "nodes": [{"id": 1, "shape": "event", "label": "start"}, {"id": 2, "shape": "activity", "label": "a"},
+              {"id": 3, "shape": "event", "label": "end"}],
+    "edges": [{"source": 1, "target": 2}, {"source": 2, "target": 3}],
+}
+DELETE_ALL = {"ops": [{"op": "remove_node", "id": node["id"]} for node in DIAGRAM["nodes"]]}
+
+
+def test_empty_diagram_needs_llm_by_default():
+    _, report = repair_diagram({"nodes": [], "edges": []})
+    assert report["unfixable"] == ["diagram has no nodes"]
+
+
+def test_empty_diagram_allowed_for_editor():
+    diagram, report = repair_diagram({"nodes": [], "edges": []}, allow_empty=True)
+    assert diagram == {"nodes": [], "edges": []}
+    assert report == {"fixed": [], "unfixable": []}
+
+
+def test_missing_events_are_added():
+    diagram, report = repair_diagram({"nodes": [{"id": 1, "shape": "task", "label": "a"}], "edges": []})
+    assert [node["shape"] for node in diagram["nodes"]] == ["event", "activity", "event"]
+    assert not report["unfixable"]
+
+
+def test_editor_can_delete_whole_diagram():
+    def stub_call(messages, **kwargs):
+        prompt = messages[0].content
+        if prompt.startswith(PROMPTS["verification"]):
+            return '{"is_bpmn_request": true, "content": "nothing"}'
+        if prompt.startswith(PROMPTS["clarification"]):
+            return '{"await_user_input": false, "content": "nothing"}'
+        if prompt.startswith(PROMPTS["x6processing"]):
+            return json.dumps(DIAGRAM)
+        return json.dumps(DELETE_ALL)
+
+    graph = GenerationGraph(mode="api")
+    config = {"configurable": {"mode": "api", "llm_call": stub_call, "local_model_cfg": None}}
+    state = graph.compiled.invoke(generation("Построй BPMN диаграмму простого процесса"), config=config)
+    # clarifier задает вопросы, пока не кончатся итерации уточнения
+    for _ in range(5):
+        if state["bpmn"].latest()["nodes"]:
+            break
+        state["user_input"].append("Шаги: старт, a, конец")
+        state = graph.compiled.invoke(state, config=config)
+    assert len(state["bpmn"].latest()["nodes"]) == 3
+
+    state["user_input"].append("Удали всю диаграмму")
+    state = graph.compiled.invoke(state, config=config)
+
+    assert state["bpmn"].latest() == {"nodes": [], "edges": []}
+    assert state["agents_result"]["validator"][-1]["flag"]
+    assert state["last"][-1][1] == "editor"
+    assert not state["agents_result"].get("repairer")
+
+
+def test_repair_attempts_reset_every_turn():
+    def stub_call(messages, **kwargs):
+        prompt = messages[0].content
+        if prompt.startswith(PROMPTS["verification"]):
+            return '{"is_bpmn_request": true, "content": "nothing"}'
+        if prompt.startswith(PROMPTS["clarification"]):
+            return '{"await_user_input": false, "content": "nothing"}'
+        if prompt.startswith(PROMPTS["x6processing"]):
+            return json.dumps(DIAGRAM)
+        # редактор и repairer отвечают операциями, которые не применить
+        return '{"ops": "broken"}'
+
+    graph = GenerationGraph(mode="api")
+    config = {"configurable": {"mode": "api", "llm_call": stub_call, "local_model_cfg": None}}
+    state = graph.compiled.invoke(generation("Построй BPMN диаграмму простого процесса"), config=config)
+    for _ in range(5):
+        if state["bpmn"].latest()["nodes"]:
+            break
+        state["user_input"].append("Шаги: старт, a, конец")
+        state = graph.compiled.invoke(state, config=config)
+
+    repairs = []
+    for request in ["Переименуй a в b", "Переименуй a в c"]:
+        state["user_input"].append(request)
+        state = graph.compiled.invoke(state, config=config)
+        repairs.append(len(state["agents_result"]["repairer"]))
+    # каждый ход получает все попытки, а не остаток от предыдущего
+    assert repairs == [GENERATION_NUM_ITERATIONS, 2 * GENERATION_NUM_ITERATIONS]
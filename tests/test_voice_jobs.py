@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.utilities.services.voice_jobs import InMemoryVoiceJobRegistry, SQLiteVoiceJobRegistry
+
+
+def _collect(registry, job):
+    async def run():
+        return [item async for item in registry.events(job)]
+
+    return asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def _run_job(job):
+    job.publish("status", {"status": "transcribing"})
+    job.publish("segment", {"start": 0, "end": 1, "text": " Сделай"})
+    job.publish("segment", {"start": 1, "end": 2, "text": " диаграмму"})
+    job.publish("token", {"text": "{"})
+    job.publish("result", {"output": "ok"})
+
+
+def test_in_memory_replays_events_to_late_subscriber():
+    registry = InMemoryVoiceJobRegistry()
+    job = registry.create("chat", "a.wav")
+    _run_job(job)
+    events = _collect(registry, registry.get(job.id))
+    # токены опоздавшему подписчику не повторяются
+    assert [event for event, _ in events] == ["status", "segment", "segment", "result"]
+    assert registry.get(job.id).transcript == "Сделай диаграмму"
+
+
+@pytest.mark.parametrize("late", [False, True])
+def test_sqlite_job_is_visible_to_other_worker(tmp_path, late):
+    path = str(tmp_path / "sessions.sqlite3")
+    owner, other = SQLiteVoiceJobRegistry(path), SQLiteVoiceJobRegistry(path, poll_interval=0.01)
+    job = owner.create("chat", "a.wav", "hash")
+
+    snapshot = other.get(job.id)
+    assert (snapshot.status, snapshot.session_id, snapshot.audio_hash) == ("queued", "chat", "hash")
+    assert other.active_files() == ["a.wav"]
+
+    if late:
+        _run_job(job)
+        events = _collect(other, snapshot)
+    else:
+        # подписчик другого воркера получает события по мере публикации
+        thread = threading.Timer(0.05, _run_job, args=(job,))
+        thread.start()
+        events = _collect(other, snapshot)
+        thread.join()
+    assert [event for event, _ in events] == ["status", "segment", "segment", "token", "result"]
+
+    done = other.get(job.id)
+    assert (done.status, done.transcript, done.result) == ("done", "Сделай диаграмму", {"output": "ok"})
+    assert other.active_files() == []
+    assert other.get("missing") is None
+
+
+def test_sqlite_expired_job_ends_subscription(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    owner, other = SQLiteVoiceJobRegistry(path, ttl=0), SQLiteVoiceJobRegistry(path, poll_interval=0.01)
+    job = owner.create(None, "a.wav")
+    owner.create(None, "b.wav")  # удаляет задачу, брошенную дольше ttl
+    assert _collect(other, job) == []
+    assert other.get(job.id) is None
@@ -0,0 +1,31 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from src.api.routes import graph_audio_input
+
+
+@pytest.fixture()
+def client():
+    app = FastAPI()
+    app.include_router(graph_audio_input.router)
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("text", ["not json", "[1, 2]"])
+def test_non_json_text_frame_closes_with_1003(client, text):
+    with client.websocket_connect("/user_input/voice/stream") as ws:
+        ws.send_bytes(b"\x00\x00" * 160)
+        ws.send_text(text)
+        assert ws.receive_json()["type"] == "error"
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+    assert closed.value.code == 1003
+
+
+def test_end_frame_returns_transcript(client):
+    with client.websocket_connect("/user_input/voice/stream") as ws:
+        ws.send_bytes(b"\x00\x00" * 160)
+        ws.send_text('{"type": "end"}')
+        assert ws.receive_json() == {"type": "transcript", "text": ""}